@@ -0,0 +1,69 @@
+import time
+import argparse
+import threading
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.buffer import WriteBuffer
+from cmanager.backends.postgres import PostgresBackend
+from tests.settings import DB_CONN_STRING
+
+from .common import APR, LIMIT, PERIOD, START, connect, reset
+
+def run(managers, threads, payments):
+    """`run` makes `payments` payments from each of `threads` threads,
+    spread over the managers, and returns the payments per second.
+    """
+    def worker(thread):
+        cm = managers[thread % len(managers)]
+        for n in range(payments):
+            cm.pay(Decimal('1.000'), 'payment', START + timedelta(days=1, seconds=thread * payments + n))
+
+    workers = [threading.Thread(target=worker, args=(thread,)) for thread in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return threads * payments / (time.time() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the payment throughput with group commits.')
+    parser.add_argument('--accounts', type=int, default=16, help='accounts paid into')
+    parser.add_argument('--threads', type=int, default=64, help='concurrent callers')
+    parser.add_argument('--payments', type=int, default=200, help='payments per thread')
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 10, 50, 100, 500], help='buffer batch sizes')
+    parser.add_argument('--max-latency', type=float, default=0.005, help='buffer latency in seconds')
+    parser.add_argument('--connections', type=int, default=16, help='pool size')
+    args = parser.parse_args(argv)
+
+    cursor = connect().cursor()
+    pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=args.connections, timeout=60.0)
+    backend = PostgresBackend(pool)
+
+    def managers(buffer=None):
+        reset(cursor)
+        accounts = [CreditManager(account_id, APR, LIMIT, PERIOD, backend=backend, buffer=buffer)
+                    for account_id in range(1, args.accounts + 1)]
+        for cm in accounts:
+            cm.open_account(START)
+        return accounts
+
+    print('%-12s %12s %10s %10s' % ('batch', 'payments/s', 'commits', 'largest'))
+    rate = run(managers(), args.threads, args.payments)
+    print('%-12s %12.0f %10d %10s' % ('unbuffered', rate, args.threads * args.payments, '-'))
+
+    for size in args.batches:
+        buffer = WriteBuffer(backend, max_batch=size, max_latency=args.max_latency)
+        rate = run(managers(buffer), args.threads, args.payments)
+        buffer.close()
+        stats = buffer.stats()
+        print('%-12d %12.0f %10d %10d' % (size, rate, stats['batches'], stats['largest_batch']))
+
+    pool.closeall()
+    reset(cursor)
+
+if __name__ == '__main__':
+    main()
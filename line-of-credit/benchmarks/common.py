@@ -0,0 +1,81 @@
+import time
+import psycopg2
+import psycopg2.extras
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from tests.settings import DB_CONN_STRING
+from cmanager import queries
+
+# CAUTION: like the test cases, the benchmarks wipe the database
+# configured in `tests/settings.py`.
+
+APR = Decimal('0.350')
+LIMIT = Decimal('1000.000')
+PERIOD = 30
+START = datetime(2015, 1, 1)
+
+def connect():
+    """`connect` opens an autocommit connection to the test database.
+    """
+    conn = psycopg2.connect(DB_CONN_STRING)
+    conn.autocommit = True
+    return conn
+
+def reset(cursor):
+    """`reset` deletes all the data of the test database.
+    """
+    cursor.execute("TRUNCATE transaction, daily_balance, account;")
+
+def seed_ledger(cursor, account_id, rows, start=START):
+    """`seed_ledger` opens an account and fills its ledger with `rows`
+    transactions (one a minute, alternating $10 withdrawals and $10
+    payments at a hundred merchants) in a single server side statement,
+    then builds its daily rollup.
+    """
+    cursor.execute("""
+        INSERT INTO
+            transaction (account_id, tstamp, amount, balance, description, type)
+        SELECT
+            %s,
+            %s + n * INTERVAL '1 minute',
+            CASE WHEN n = 0 THEN 0 WHEN n %% 2 = 1 THEN -10 ELSE 10 END,
+            CASE WHEN n %% 2 = 1 THEN %s - 10 ELSE %s END,
+            CASE WHEN n = 0 THEN 'opening balance'
+                 WHEN n %% 2 = 1 THEN 'Payment at Merchant ' || (n %% 100)
+                 ELSE 'Payment for the month' END,
+            CASE WHEN n = 0 THEN 'eot' WHEN n %% 2 = 1 THEN 'withdrawal' ELSE 'payment' END
+        FROM
+            generate_series(0, %s) AS n;
+    """, (account_id, start, LIMIT, LIMIT, rows - 1))
+    last = start + timedelta(minutes=rows - 1)
+    cursor.execute("""
+        INSERT INTO
+            account (id, apr, credit_limit, period, balance, last_tstamp, last_eot)
+        VALUES (%s, %s, %s, %s, %s, %s, %s);
+    """, (account_id, APR, LIMIT, PERIOD,
+          LIMIT - 10 if (rows - 1) % 2 == 1 else LIMIT, last, start))
+    cursor.execute(queries.ROLLUP_REBUILD, {'account_id': account_id})
+    cursor.execute("ANALYZE transaction, daily_balance;")
+
+def timed(function, *args, **kwargs):
+    """`timed` calls the function and returns its wall time in seconds.
+    """
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+def percentile(samples, fraction):
+    """`percentile` is the nearest rank percentile of sorted samples.
+    """
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+class NullWriter(object):
+    """`NullWriter` is a file like object discarding (but counting)
+    everything written to it.
+    """
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
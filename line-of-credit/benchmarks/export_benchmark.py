@@ -0,0 +1,54 @@
+import csv
+import json
+import argparse
+
+from cmanager import CreditManager
+
+from .common import (
+    APR, LIMIT, PERIOD, START, connect, reset, seed_ledger, timed, NullWriter
+)
+
+def fetchall_csv(cm, out):
+    """`fetchall_csv` is the statement run as it used to be done: fetch
+    the whole statement and reformat every row in Python.
+    """
+    writer = csv.writer(out)
+    writer.writerow(['id', 'tstamp', 'amount', 'type', 'description'])
+    for row in cm.get_statement(START):
+        writer.writerow([row['id'], row['tstamp'], row['amount'], row['type'], row['description']])
+
+def fetchall_jsonl(cm, out):
+    for row in cm.get_statement(START):
+        out.write(json.dumps({
+            'id': row['id'], 'tstamp': row['tstamp'].isoformat(),
+            'amount': str(row['amount']), 'type': row['type'],
+            'description': row['description'],
+        }) + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the COPY export with the fetchall path.')
+    parser.add_argument('--rows', type=int, default=100000, help='transactions in the ledger')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per method (best is kept)')
+    args = parser.parse_args(argv)
+
+    cursor = connect().cursor()
+    reset(cursor)
+    seed_ledger(cursor, 1, args.rows)
+    cm = CreditManager(1, APR, LIMIT, PERIOD)
+
+    methods = [
+        ('fetchall + csv', lambda out: fetchall_csv(cm, out)),
+        ('COPY csv', lambda out: cm.export_statement(out, START, format='csv')),
+        ('fetchall + json', lambda out: fetchall_jsonl(cm, out)),
+        ('COPY jsonl', lambda out: cm.export_statement(out, START, format='jsonl')),
+    ]
+    print('%-18s %10s %14s %12s' % ('method', 'seconds', 'rows/sec', 'bytes'))
+    for name, method in methods:
+        out = NullWriter()
+        best = min(timed(method, out) for _ in range(args.repeat))
+        print('%-18s %10.3f %14.0f %12d' % (name, best, args.rows / best, out.size / args.repeat))
+
+    reset(cursor)
+
+if __name__ == '__main__':
+    main()
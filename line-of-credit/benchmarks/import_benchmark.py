@@ -0,0 +1,51 @@
+import time
+import argparse
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+
+from .common import APR, LIMIT, PERIOD, START, connect, reset
+
+def legacy_rows(count, start):
+    """`legacy_rows` generates a legacy ledger of alternating
+    withdrawals and payments, one a minute.
+    """
+    for n in range(count):
+        kind = 'withdrawal' if n % 2 == 0 else 'payment'
+        yield start + timedelta(minutes=n + 1), Decimal('10.000'), kind, 'legacy %d' % n
+
+def replay(cm, rows):
+    """`replay` is the migration as it used to be done: one call per row.
+    """
+    for tstamp, amount, kind, description in rows:
+        if kind == 'payment':
+            cm.pay(amount, description, tstamp)
+        else:
+            cm.withdraw(amount, description, tstamp)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the bulk import with replaying pay/withdraw.')
+    parser.add_argument('--rows', type=int, default=10000, help='transactions replayed row by row')
+    parser.add_argument('--bulk-rows', type=int, default=1000000, help='transactions bulk imported')
+    args = parser.parse_args(argv)
+
+    cursor = connect().cursor()
+    reset(cursor)
+
+    cm = CreditManager(1, APR, LIMIT, PERIOD)
+    cm.open_account(START)
+    start = time.time()
+    replay(cm, legacy_rows(args.rows, START))
+    elapsed = time.time() - start
+    print('%-12s %10d rows %10.3fs %12.0f rows/sec' % ('pay/withdraw', args.rows, elapsed, args.rows / elapsed))
+
+    cm = CreditManager(2, APR, LIMIT, PERIOD)
+    cm.open_account(START)
+    report = cm.import_transactions(legacy_rows(args.bulk_rows, START))
+    print('%-12s %10d rows %10.3fs %12.0f rows/sec' % ('bulk import', report['rows'], report['elapsed'], report['rows_per_sec']))
+
+    reset(cursor)
+
+if __name__ == '__main__':
+    main()
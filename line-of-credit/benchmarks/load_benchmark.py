@@ -0,0 +1,211 @@
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.backends.postgres import PostgresBackend
+from cmanager.exceptions import WithdrawalDenied, InvalidOutstandingInvocation
+from tests.settings import DB_CONN_STRING
+
+from .common import APR, LIMIT, PERIOD, START, connect, reset, seed_ledger, percentile
+
+# The load test seeds ledgers of a given size, then runs a mix of the
+# credit manager operations from many threads for a while and reports,
+# per operation, the throughput and the latency percentiles as JSON (so
+# that runs can be kept and compared).
+
+OPERATIONS = ['pay', 'withdraw', 'current_due', 'statement', 'outstanding']
+DEFAULT_MIX = 'pay=30,withdraw=30,current_due=30,statement=8,outstanding=2'
+AMOUNT = Decimal('10.000')
+
+def parse_mix(text):
+    """`parse_mix` parses the weights of the operations of the workload
+    (eg. `pay=30,withdraw=30,current_due=40`).
+    """
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in OPERATIONS or not weight.isdigit():
+            raise argparse.ArgumentTypeError('invalid operation weight %r' % item)
+        mix.append((name, int(weight)))
+    if not sum(weight for _, weight in mix):
+        raise argparse.ArgumentTypeError('the workload is empty')
+    return mix
+
+class Clock(object):
+    """`Clock` is the simulated time of an account: every write moves it
+    forward by a second, every end of term to the end of the period
+    (hence the periods are closed once and in order).
+    """
+
+    def __init__(self, now):
+        self.lock = threading.Lock()
+        self.now = now
+        self.next_eot = START + timedelta(days=PERIOD)
+
+    def tick(self):
+        with self.lock:
+            self.now += timedelta(seconds=1)
+            return self.now
+
+    def eot(self):
+        with self.lock:
+            as_of = max(self.now, self.next_eot)
+            self.now, self.next_eot = as_of, as_of + timedelta(days=PERIOD)
+            return as_of
+
+class Stats(object):
+    """`Stats` collects the latencies (and the failures) of an operation.
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.denied = 0
+        self.errors = 0
+
+    def report(self, elapsed):
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': 0, 'denied': self.denied, 'errors': self.errors}
+        return {
+            'count': len(samples),
+            'denied': self.denied,
+            'errors': self.errors,
+            'throughput': len(samples) / elapsed,
+            'mean_ms': 1000 * sum(samples) / len(samples),
+            'p50_ms': 1000 * percentile(samples, 0.50),
+            'p95_ms': 1000 * percentile(samples, 0.95),
+            'p99_ms': 1000 * percentile(samples, 0.99),
+            'max_ms': 1000 * samples[-1],
+        }
+
+def run_workload(managers, clocks, mix, concurrency, duration, statement_days, seed):
+    """`run_workload` runs the operations of the mix against random
+    accounts from `concurrency` threads for `duration` seconds and
+    returns the stats of every operation and the elapsed time.
+    """
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    stats = dict((name, Stats()) for name in names)
+    deadline = time.time() + duration
+
+    def call(name, cm, clock):
+        if name == 'pay':
+            cm.pay(AMOUNT, 'load payment', clock.tick())
+        elif name == 'withdraw':
+            cm.withdraw(AMOUNT, 'load withdrawal', clock.tick())
+        elif name == 'current_due':
+            cm.get_current_due(clock.now)
+        elif name == 'statement':
+            cm.get_statement(clock.now - timedelta(days=statement_days), clock.now)
+        else:
+            cm.compute_outstanding(clock.eot())
+
+    def worker(index):
+        rand = random.Random(seed + index)
+        local = dict((name, Stats()) for name in names)
+        while time.time() < deadline:
+            name = rand.choices(names, weights)[0]
+            account = rand.randrange(len(managers))
+            start = time.time()
+            try:
+                call(name, managers[account], clocks[account])
+            except (WithdrawalDenied, InvalidOutstandingInvocation):
+                local[name].denied += 1
+            except Exception as e:
+                local[name].errors += 1
+                sys.stderr.write('%s failed: %s\n' % (name, e))
+                continue
+            local[name].samples.append(time.time() - start)
+
+        # merge once done, no lock needed on the hot path.
+        with lock:
+            for name in names:
+                stats[name].samples.extend(local[name].samples)
+                stats[name].denied += local[name].denied
+                stats[name].errors += local[name].errors
+
+    lock = threading.Lock()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats, time.time() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the credit manager with a mixed workload.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000],
+                        help='transactions seeded in each ledger, one run per size (1000 to 10000000)')
+    parser.add_argument('--accounts', type=int, default=4, help='accounts seeded and used by the workload')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads running the workload')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of workload per run')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help='weights of the operations (default %s)' % DEFAULT_MIX)
+    parser.add_argument('--statement-days', type=int, default=7, help='days covered by each statement')
+    parser.add_argument('--no-prepare', action='store_true', help='run the plain statements')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random workload')
+    parser.add_argument('--output', help='write the JSON report to this file (stdout by default)')
+    args = parser.parse_args(argv)
+    for rows in args.rows:
+        if not 1000 <= rows <= 10000000:
+            parser.error('ledger sizes range from 1000 to 10000000 rows')
+
+    report = {
+        'accounts': args.accounts,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'mix': dict(args.mix),
+        'prepare': not args.no_prepare,
+        'runs': [],
+    }
+
+    cursor = connect().cursor()
+    for rows in args.rows:
+        reset(cursor)
+        start = time.time()
+        for account_id in range(1, args.accounts + 1):
+            seed_ledger(cursor, account_id, rows)
+        seeded = time.time() - start
+
+        pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=args.concurrency, timeout=30.0)
+        backend = PostgresBackend(pool, prepare=not args.no_prepare)
+        managers = [CreditManager(account_id, APR, LIMIT, PERIOD, backend=backend)
+                    for account_id in range(1, args.accounts + 1)]
+        clocks = [Clock(START + timedelta(minutes=rows)) for _ in managers]
+
+        stats, elapsed = run_workload(
+            managers, clocks, args.mix, args.concurrency, args.duration,
+            args.statement_days, args.seed
+        )
+        pool.closeall()
+
+        total = sum(len(operation.samples) for operation in stats.values())
+        report['runs'].append({
+            'rows': rows,
+            'seed_seconds': seeded,
+            'elapsed': elapsed,
+            'operations': total,
+            'throughput': total / elapsed,
+            'latency': dict((name, operation.report(elapsed)) for name, operation in stats.items()),
+        })
+        sys.stderr.write('%d rows: %d operations in %.1fs (%.0f ops/sec)\n' % (
+            rows, total, elapsed, total / elapsed))
+    reset(cursor)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
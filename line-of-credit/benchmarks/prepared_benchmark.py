@@ -0,0 +1,59 @@
+import time
+import argparse
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.backends.postgres import PostgresBackend
+from tests.settings import DB_CONN_STRING
+
+from .common import APR, LIMIT, PERIOD, START, connect, reset, seed_ledger, percentile
+
+def measure(call, calls):
+    """`measure` times every call and returns the sorted latencies.
+    """
+    samples = []
+    for n in range(calls):
+        start = time.time()
+        call(n)
+        samples.append(time.time() - start)
+    return sorted(samples)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the prepared statements with the plain ones.')
+    parser.add_argument('--rows', type=int, default=100000, help='transactions in each seeded ledger')
+    parser.add_argument('--calls', type=int, default=5000, help='calls per operation')
+    args = parser.parse_args(argv)
+
+    cursor = connect().cursor()
+    reset(cursor)
+
+    print('%-10s %-12s %10s %10s %10s' % ('statement', 'operation', 'mean ms', 'p50 ms', 'p99 ms'))
+    for account_id, prepare in [(1, False), (2, True)]:
+        seed_ledger(cursor, account_id, args.rows)
+        pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+        cm = CreditManager(account_id, APR, LIMIT, PERIOD, backend=PostgresBackend(pool, prepare=prepare))
+        last = START + timedelta(minutes=args.rows)
+
+        # the withdrawals come after the last payment: appends, like the
+        # payments, none of them backdated (and repaired).
+        after_pays = last + timedelta(seconds=args.calls)
+        operations = [
+            ('pay', lambda n: cm.pay(Decimal('1.000'), 'payment', last + timedelta(seconds=n))),
+            ('withdraw', lambda n: cm.withdraw(Decimal('1.000'), 'withdrawal', after_pays + timedelta(seconds=n))),
+            ('current_due', lambda n: cm.get_current_due(last)),
+        ]
+        for name, call in operations:
+            samples = measure(call, args.calls)
+            print('%-10s %-12s %10.3f %10.3f %10.3f' % (
+                'prepared' if prepare else 'plain', name,
+                1000 * sum(samples) / len(samples),
+                1000 * percentile(samples, 0.50), 1000 * percentile(samples, 0.99),
+            ))
+        pool.closeall()
+
+    reset(cursor)
+
+if __name__ == '__main__':
+    main()
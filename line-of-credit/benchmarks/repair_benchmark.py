@@ -0,0 +1,44 @@
+import argparse
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.backends.postgres import PostgresBackend
+from tests.settings import DB_CONN_STRING
+
+from .common import APR, LIMIT, PERIOD, START, connect, reset, seed_ledger, timed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the repair of the ledger after backdated payments.')
+    parser.add_argument('--rows', type=int, default=1000000, help='transactions in the ledger')
+    parser.add_argument('--suffixes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 100000, 1000000],
+                        help='transactions after the backdated payment')
+    parser.add_argument('--repeat', type=int, default=3, help='payments per suffix length (best is kept)')
+    args = parser.parse_args(argv)
+
+    cursor = connect().cursor()
+    reset(cursor)
+    seed_ledger(cursor, 1, args.rows)
+    pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+    cm = CreditManager(1, APR, LIMIT, PERIOD, backend=PostgresBackend(pool))
+
+    # the seeded ledger has a transaction a minute, the latest one at:
+    last = START + timedelta(minutes=args.rows - 1)
+    best = min(timed(cm.pay, Decimal('1.000'), 'payment', last + timedelta(seconds=n)) for n in range(args.repeat))
+    print('%-10s %12s %12s %14s' % ('suffix', 'seconds', 'per row us', 'rows/sec'))
+    print('%-10s %12.4f %12s %14s' % ('latest', best, '-', '-'))
+
+    for suffix in args.suffixes:
+        if suffix >= args.rows:
+            continue
+        # half a minute before the `suffix` latest seeded transactions.
+        tstamp = last - timedelta(minutes=suffix - 1, seconds=30)
+        best = min(timed(cm.pay, Decimal('1.000'), 'backdated payment', tstamp) for _ in range(args.repeat))
+        print('%-10d %12.4f %12.2f %14.0f' % (suffix, best, 1e6 * best / suffix, suffix / best))
+
+    pool.closeall()
+    reset(cursor)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import time
+import argparse
+import threading
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.replica import ReplicaSet
+from cmanager.backends.postgres import PostgresBackend
+from tests.settings import DB_CONN_STRING, REPLICA_CONN_STRINGS
+
+from .common import APR, LIMIT, PERIOD, START, connect, reset, seed_ledger, percentile
+
+def run(args, backend, replicas):
+    """`run` pays from `writers` threads while `readers` threads fetch
+    statements for `duration` seconds, and returns the payment latencies
+    along with the number of statements read.
+    """
+    latencies, statements = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+
+    def writer(thread):
+        cm = CreditManager(1, APR, LIMIT, PERIOD, backend=backend)
+        n = 0
+        while time.time() < deadline:
+            start = time.time()
+            cm.pay(Decimal('1.000'), 'payment', START + timedelta(days=3650, seconds=thread * 10 ** 6 + n))
+            with lock:
+                latencies.append(time.time() - start)
+            n += 1
+
+    def reader():
+        cm = CreditManager(1, APR, LIMIT, PERIOD, backend=backend, replicas=replicas)
+        while time.time() < deadline:
+            cm.get_statement(START, START + timedelta(days=args.days))
+            with lock:
+                statements[0] += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), statements[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the payments competing with statement reads, with and without read replicas.')
+    parser.add_argument('--rows', type=int, default=1000000, help='transactions in the ledger')
+    parser.add_argument('--days', type=int, default=30, help='days of ledger per statement')
+    parser.add_argument('--writers', type=int, default=8, help='threads paying')
+    parser.add_argument('--readers', type=int, default=8, help='threads reading statements')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per run')
+    parser.add_argument('--replica', action='append', help='replica DSN (repeat), REPLICA_CONN_STRINGS by default')
+    args = parser.parse_args(argv)
+
+    cursor = connect().cursor()
+    reset(cursor)
+    seed_ledger(cursor, 1, args.rows)
+    pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=args.writers + args.readers, timeout=60.0)
+    backend = PostgresBackend(pool)
+
+    print('%-10s %12s %12s %12s %12s %10s' % ('reads', 'payments/s', 'pay p50 ms', 'pay p99 ms', 'statements/s', 'fallbacks'))
+    for name, replicas in [('primary', None), ('replicas', ReplicaSet.from_dsns(args.replica or REPLICA_CONN_STRINGS,
+                                                                               maxconn=args.readers))]:
+        latencies, statements = run(args, backend, replicas)
+        fallbacks = replicas.stats()['fallbacks'] if replicas is not None else '-'
+        print('%-10s %12.0f %12.2f %12.2f %12.1f %10s' % (
+            name, len(latencies) / args.duration, 1e3 * percentile(latencies, 0.5),
+            1e3 * percentile(latencies, 0.99), statements / args.duration, fallbacks))
+        if replicas is not None:
+            replicas.closeall()
+
+    pool.closeall()
+    reset(cursor)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.backends.postgres import PostgresBackend
+from tests.settings import DB_CONN_STRING
+
+from .common import APR, LIMIT, PERIOD, START, connect, reset, seed_ledger, timed
+
+def filter_statement(cm, text, start_date, end_date, limit):
+    """`filter_statement` searches like before the search API: the whole
+    statement is fetched and filtered on the client.
+    """
+    text = text.lower()
+    return [row for row in cm.get_statement(start_date, end_date) if text in row['description'].lower()][:limit]
+
+def total_statement(cm, start_date, end_date, limit):
+    """`total_statement` totals the spending per description on the
+    client, from the whole statement.
+    """
+    totals = {}
+    for row in cm.get_statement(start_date, end_date):
+        if row['type'] == 'withdrawal':
+            totals[row['description']] = totals.get(row['description'], Decimal('0')) - row['amount']
+    return sorted(totals.items(), key=lambda total: -total[1])[:limit]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the indexed description search with filtering statements.')
+    parser.add_argument('--rows', type=int, default=5000000, help='transactions in the ledger')
+    parser.add_argument('--text', default='Merchant 42', help='searched description text')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per indexed query (best is kept)')
+    args = parser.parse_args(argv)
+
+    cursor = connect().cursor()
+    reset(cursor)
+    seed_ledger(cursor, 1, args.rows)
+    pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+    cm = CreditManager(1, APR, LIMIT, PERIOD, backend=PostgresBackend(pool))
+
+    # the whole ledger, and its latest day (a transaction a minute).
+    end = START + timedelta(minutes=args.rows)
+    ranges = [('ledger', START, end), ('day', end - timedelta(days=1), end)]
+
+    print('%-8s %-10s %14s %14s %10s' % ('range', 'operation', 'database s', 'client s', 'speedup'))
+    for name, start_date, end_date in ranges:
+        operations = [
+            ('search', lambda: cm.search_statement(args.text, start_date, end_date, 100),
+                       lambda: filter_statement(cm, args.text, start_date, end_date, 100)),
+            ('spending', lambda: cm.get_spending(start_date, end_date, limit=10),
+                         lambda: total_statement(cm, start_date, end_date, 10)),
+        ]
+        for operation, indexed, client in operations:
+            database = min(timed(indexed) for _ in range(args.repeat))
+            filtered = timed(client)
+            print('%-8s %-10s %14.4f %14.4f %9.1fx' % (name, operation, database, filtered, filtered / database))
+
+    pool.closeall()
+    reset(cursor)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import time
+import argparse
+import threading
+from decimal import Decimal
+from datetime import timedelta
+
+from cmanager import CreditManager
+from cmanager.backends.sharded import ShardRouter, ShardedBackend
+from tests.settings import SHARD_CONN_STRINGS
+
+from .common import APR, LIMIT, PERIOD, START
+
+def reset(router):
+    """`reset` deletes all the data of the shard databases.
+    """
+    for backend in router.shards.values():
+        with backend.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+
+def run(managers, threads, payments):
+    """`run` makes `payments` payments from each of `threads` threads,
+    spread over the managers, and returns the payments per second.
+    """
+    def worker(thread):
+        cm = managers[thread % len(managers)]
+        for n in range(payments):
+            cm.pay(Decimal('1.000'), 'payment', START + timedelta(days=1, seconds=thread * payments + n))
+
+    workers = [threading.Thread(target=worker, args=(thread,)) for thread in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return threads * payments / (time.time() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the payment throughput over 1 to N shard databases.')
+    parser.add_argument('--accounts', type=int, default=64, help='accounts paid into')
+    parser.add_argument('--threads', type=int, default=64, help='concurrent callers')
+    parser.add_argument('--payments', type=int, default=200, help='payments per thread')
+    parser.add_argument('--connections', type=int, default=16, help='pool size per shard')
+    parser.add_argument('--moves', type=int, default=10, help='accounts moved between shards')
+    args = parser.parse_args(argv)
+
+    names = sorted(SHARD_CONN_STRINGS)
+    print('%-8s %12s %s' % ('shards', 'payments/s', 'accounts per shard'))
+    for count in range(1, len(names) + 1):
+        router = ShardRouter.from_dsns(dict((name, SHARD_CONN_STRINGS[name]) for name in names[:count]),
+                                       maxconn=args.connections)
+        reset(router)
+        backend = ShardedBackend(router)
+        managers = [CreditManager(account_id, APR, LIMIT, PERIOD, backend=backend)
+                    for account_id in range(1, args.accounts + 1)]
+        for cm in managers:
+            cm.open_account(START)
+
+        rate = run(managers, args.threads, args.payments)
+        spread = [sum(1 for cm in managers if router.shard_for(cm.account_id) == name) for name in names[:count]]
+        print('%-8d %12.0f %s' % (count, rate, ' '.join('%d' % accounts for accounts in spread)))
+
+        if count == len(names) and count > 1:
+            # copy then switch, the ledgers being as long as they are now.
+            start = time.time()
+            moved = 0
+            for cm in managers[:args.moves]:
+                target = [name for name in names if name != router.shard_for(cm.account_id)][0]
+                moved += router.move_account(cm.account_id, target)
+            elapsed = time.time() - start
+            print('moved %d accounts (%d transactions) in %.3fs, %.1f ms per account' % (
+                args.moves, moved, elapsed, 1e3 * elapsed / args.moves))
+
+        reset(router)
+        router.closeall()
+
+if __name__ == '__main__':
+    main()
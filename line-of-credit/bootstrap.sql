@@ -1,10 +1,74 @@
+-- CREATE THE account TABLE
+-- one head record per credit account holding the terms of the credit
+-- line, its current balance, the timestamp of its latest transaction
+-- and of its latest eot. It is updated in the same statement as every
+-- ledger insert so that the hot-path reads are single primary key lookups.
+CREATE TABLE account (
+	   id BIGINT PRIMARY KEY NOT NULL,
+	   apr NUMERIC NOT NULL,
+	   credit_limit NUMERIC NOT NULL,
+	   period INTEGER NOT NULL,
+	   balance NUMERIC NOT NULL,
+	   last_tstamp TIMESTAMP NOT NULL,
+	   last_eot TIMESTAMP NOT NULL
+);
+
 -- CREATE THE transaction TABLE
+-- the ledger is range partitioned by month on tstamp (Postgres 11+) so
+-- that the queries, all bounded by tstamp, only touch the recent months
+-- and the closed months can be archived (see `cmanager/partitions.py`).
 CREATE TABLE transaction (
-	   id BIGSERIAL PRIMARY KEY NOT NULL,
+	   id BIGSERIAL NOT NULL,
+	   account_id BIGINT NOT NULL,
 	   tstamp TIMESTAMP NOT NULL,
 	   amount NUMERIC NOT NULL,
 	   balance NUMERIC NOT NULL,
 	   type VARCHAR(20) NOT NULL,
-	   description VARCHAR(100) NOT NULL
-);
+	   description VARCHAR(100) NOT NULL,
+	   PRIMARY KEY (id, tstamp)
+) PARTITION BY RANGE (tstamp);
+
+-- rows of a month without a partition land here until the monthly
+-- partition is created (run `cmanager-partitions` ahead of time).
+CREATE TABLE transaction_default PARTITION OF transaction DEFAULT;
+
+-- every query is scoped to an account and ordered / filtered by tstamp
+-- (then id, the ledger order). balance is carried as the trailing column
+-- so that the latest balance lookups are answered by an index-only scan of
+-- a single account.
+CREATE INDEX transaction_account_tstamp_idx
+	   ON transaction (account_id, tstamp, id, balance);
 
+-- statements are listed (and keyset paginated) in insertion order.
+CREATE INDEX transaction_account_id_idx
+	   ON transaction (account_id, id);
+
+-- the descriptions (ie. the merchants) are searched by substring within an
+-- account (see `SEARCH`): a trigram index, along with the account id thanks
+-- to btree_gin. Both extensions come with Postgres (contrib).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE INDEX transaction_description_trgm_idx
+	   ON transaction USING GIN (account_id, description gin_trgm_ops);
+
+-- the eot transactions, the boundaries of the periods cached by the
+-- statement cache (`cmanager/cache.py`), out of the way of the others.
+CREATE INDEX transaction_eot_idx
+	   ON transaction (account_id, tstamp) WHERE type = 'eot';
+
+-- CREATE THE daily_balance TABLE
+-- a rollup of the ledger holding, for each account and each day with
+-- transactions, the closing balance of the day (the balance after its
+-- latest transaction, at tstamp) and the payments made that day. It is
+-- upserted in the same statement as every ledger insert so that the
+-- point in time dues and the interest (which is day granular) read one
+-- row per day instead of one per transaction. It can be rebuilt from
+-- the ledger of an account with `ROLLUP_REBUILD` (`cmanager/queries.py`).
+CREATE TABLE daily_balance (
+	   account_id BIGINT NOT NULL,
+	   day DATE NOT NULL,
+	   tstamp TIMESTAMP NOT NULL,
+	   balance NUMERIC NOT NULL,
+	   payments NUMERIC NOT NULL,
+	   PRIMARY KEY (account_id, day)
+);
@@ -1 +1 @@
-from cmanager import CreditManager
+from .cmanager import CreditManager
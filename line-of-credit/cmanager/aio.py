@@ -0,0 +1,427 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from datetime import datetime, timedelta, date
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.extensions
+
+from .settings import DB_CONN_STRING, DB_POOL_MAX, DB_POOL_TIMEOUT, MONEY_MINOR_UNITS
+from .cmanager import (
+    check_terms, as_datetime, round_up, statement_range, check_period, eot_description
+)
+from . import money
+from . import queries
+
+from .exceptions import (
+    InvalidPayment, InvalidWithdrawal,
+    WithdrawalDenied, InvalidParameterValue, SystemFailed,
+    InvalidOutstandingInvocation, AccountNotFound, PoolTimeout, PeriodClosed
+)
+
+async def wait(conn):
+    """`wait` drives an asynchronous connection until its pending
+    operation (connecting or running a query) completes, yielding to
+    the event loop whenever the socket is not ready.
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        if state == psycopg2.extensions.POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise SystemFailed("Unexpected poll state %s" % state)
+
+        ready = loop.create_future()
+        fileno = conn.fileno()
+        add(fileno, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(fileno)
+
+class AsyncConnectionPool(object):
+    """`AsyncConnectionPool` is the asyncio counterpart of
+    `cmanager.pool.ConnectionPool`: it keeps up to `maxconn` asynchronous
+    connections which are shared by the coroutines of an event loop.
+    Connections are opened on demand and a connection runs one query
+    at a time, hence `maxconn` bounds the queries in flight.
+    """
+
+    def __init__(self, dsn=DB_CONN_STRING, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT):
+        if maxconn < 1:
+            raise InvalidParameterValue("Invalid pool size")
+        if timeout is not None and timeout < 0:
+            raise InvalidParameterValue("Invalid pool checkout timeout")
+
+        self.dsn = dsn
+        self.maxconn = maxconn
+        # seconds to wait for a free connection (None waits forever).
+        self.timeout = timeout
+
+        # NOTE: the condition is created on first use so that it belongs
+        # to the running event loop rather than to the one (if any) that
+        # was current when the pool was built.
+        self._cond = None
+        self._idle = []  # used as a stack
+        self._size = 0  # number of open connections (idle + in use)
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+    async def _connect(self):
+        try:
+            conn = psycopg2.connect(self.dsn, async_=True)
+            await wait(conn)
+        except psycopg2.Error as e:
+            raise SystemFailed(str(e))
+        # asynchronous connections are always in autocommit mode.
+        return conn
+
+    def _available(self):
+        return self._idle or self._size < self.maxconn
+
+    async def getconn(self):
+        """`getconn` checks out a connection from the pool, waiting up
+        to `timeout` seconds for one to be returned when all `maxconn`
+        connections are in use.
+        """
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+
+        async with self._cond:
+            if not self._available():
+                self._waits += 1
+                waited_from = time.time()
+                try:
+                    await asyncio.wait_for(self._cond.wait_for(self._available), self.timeout)
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        "No connection available after %s seconds" % self.timeout
+                    )
+                finally:
+                    self._wait_time += time.time() - waited_from
+
+            conn = None
+            while self._idle and conn is None:
+                conn = self._idle.pop()
+                if conn.closed:
+                    self._size -= 1
+                    self._discarded += 1
+                    conn = None
+            if conn is None:
+                # reserve a slot, the connection is opened below.
+                self._size += 1
+            self._in_use += 1
+            self._checkouts += 1
+
+        if conn is None:
+            try:
+                conn = await self._connect()
+            except BaseException:
+                # give the reserved slot back.
+                await self._release(None)
+                raise
+        return conn
+
+    async def _release(self, conn):
+        async with self._cond:
+            self._in_use -= 1
+            if conn is None:
+                self._size -= 1
+            elif conn.closed:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    async def putconn(self, conn, close=False):
+        """`putconn` returns a connection to the pool. Broken
+        connections (or ones asked to be closed) are discarded.
+        """
+        # a connection given back in the middle of a query (eg. when the
+        # coroutine running it was cancelled) cannot be used anymore.
+        if close or conn.isexecuting():
+            conn.close()
+        await self._release(conn)
+
+    @asynccontextmanager
+    async def connection(self):
+        """`connection` checks out a connection for the duration
+        of an `async with` block.
+        """
+        conn = await self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # the connection is most likely unusable from here on.
+            broken = True
+            raise
+        finally:
+            await self.putconn(conn, close=broken)
+
+    def stats(self):
+        """`stats` returns a snapshot of the pool usage for monitoring.
+        """
+        return {
+            'size': self._size,
+            'idle': len(self._idle),
+            'in_use': self._in_use,
+            'max': self.maxconn,
+            'checkouts': self._checkouts,
+            'waits': self._waits,
+            'wait_time': self._wait_time,
+            'timeouts': self._timeouts,
+            'discarded': self._discarded,
+        }
+
+    def closeall(self):
+        """`closeall` closes all the idle connections of the pool.
+        """
+        idle, self._idle = self._idle, []
+        self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+
+class AsyncCreditManager(object):
+    """`AsyncCreditManager` provides the operations of `CreditManager`
+    as coroutines for asyncio applications. It runs the very same
+    statements (see `cmanager.queries`) over psycopg2's asynchronous
+    connections, hence waiting on the database never blocks the event
+    loop, and raises the same exceptions.
+
+    Every operation checks out its own connection from the pool, so
+    operations on different accounts (or on the same one) run
+    concurrently, up to the size of the pool. With `minor_units`, the
+    amounts are stored as minor units (see `PostgresBackend`).
+    """
+
+    def __init__(self, account_id, apr, limit, period, pool=None, minor_units=MONEY_MINOR_UNITS):
+        # NOTE: without a shared pool, the manager gets a private pool
+        # holding a single connection, like `CreditManager`.
+        self.pool = pool or AsyncConnectionPool(DB_CONN_STRING, maxconn=1)
+        self.minor_units = minor_units
+
+        # every query below is scoped to this credit account.
+        self.account_id = account_id
+
+        check_terms(apr, limit, period)
+        self.apr = apr
+        self.limit = limit
+        self.period = period
+
+    @asynccontextmanager
+    async def _cursor(self):
+        """`_cursor` checks out a connection from the pool for
+        the duration of one operation and yields a cursor on it.
+        """
+        async with self.pool.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    async def _execute(self, cursor, query, params):
+        cursor.execute(query, params)
+        await wait(cursor.connection)
+
+    @asynccontextmanager
+    async def _transaction(self, cursor):
+        """`_transaction` runs the statements of an `async with` block
+        in one transaction; asynchronous connections are in autocommit,
+        hence the explicit one.
+        """
+        await self._execute(cursor, "BEGIN;", None)
+        try:
+            yield
+        except Exception:
+            await self._execute(cursor, "ROLLBACK;", None)
+            raise
+        await self._execute(cursor, "COMMIT;", None)
+
+    def _dump(self, amount):
+        return money.to_minor(amount) if self.minor_units else amount
+
+    def _load(self, row, *columns):
+        if self.minor_units and row is not None:
+            for column in columns:
+                if row[column] is not None:
+                    row[column] = money.from_minor(row[column])
+        return row
+
+    async def _get_head(self, cursor):
+        """`_get_head` fetches the head record of the account.
+        """
+        await self._execute(cursor, queries.HEAD, {'account_id': self.account_id})
+        head = self._load(cursor.fetchone(), 'balance')
+        if head is None:
+            raise AccountNotFound("Account %s does not exist" % self.account_id)
+        return head
+
+    async def _get_balance(self, cursor, as_of=None):
+        """`_get_balance` fetches the balance of the account
+        as of the given time (or the latest one).
+        """
+        if as_of is None:
+            return (await self._get_head(cursor))['balance']
+
+        await self._execute(cursor, queries.BALANCE_AS_OF, {'account_id': self.account_id, 'as_of': as_of})
+        row = self._load(cursor.fetchone(), 'balance')
+        if row is None:
+            # no transaction before as_of; tell apart an unknown account.
+            await self._get_head(cursor)
+            raise InvalidParameterValue("No balance as of %s" % as_of)
+        return row['balance']
+
+    async def _post(self, cursor, amount, description, tstamp, type, check_balance):
+        """`_post` appends a transaction to the ledger and moves the
+        account head in a single statement (see `queries.POST`). A
+        backdated transaction is left out by it and posted again, along
+        with the rebalancing of the ledger, in one transaction under the
+        account row lock (see `queries.REPAIR`).
+        """
+        posted = await self._post_once(cursor, amount, description, tstamp, type, check_balance, True)
+        if posted is None:
+            async with self._transaction(cursor):
+                posted = await self._post_once(cursor, amount, description, tstamp, type, check_balance, False)
+        return posted
+
+    async def _post_once(self, cursor, amount, description, tstamp, type, check_balance, append_only):
+        """`_post_once` runs `POST` (see `PostgresBackend._post`).
+        """
+        await self._execute(cursor, queries.POST, {
+            'account_id': self.account_id, 'amount': self._dump(amount), 'tstamp': tstamp,
+            'description': description, 'type': type, 'check_balance': check_balance,
+            'append_only': append_only,
+        })
+        result = cursor.fetchone()
+        if result is None:
+            raise AccountNotFound("Account %s does not exist" % self.account_id)
+        if result['id'] is None:
+            if result['closed']:
+                raise PeriodClosed("Transaction at %s falls in a closed period" % tstamp)
+            if append_only and result['backdated']:
+                return None
+            return False
+        if result['backdated']:
+            await self._execute(cursor, queries.REPAIR, {
+                'account_id': self.account_id, 'id': result['id'], 'tstamp': tstamp,
+            })
+        return True
+
+    async def open_account(self, tstamp=None):
+        """`open_account` creates the account head record along with
+        the opening balance transaction of the account.
+        """
+        tstamp = tstamp or date.today()
+        async with self._cursor() as cursor:
+            await self._execute(cursor, queries.OPEN_ACCOUNT, {
+                'account_id': self.account_id, 'apr': self.apr,
+                'limit': self._dump(self.limit), 'period': self.period, 'tstamp': tstamp,
+            })
+
+    async def pay(self, amount, description, tstamp=None):
+        """`pay` creates a transaction indicating
+        a payment made to the user's credit.
+        """
+        if amount <= Decimal('0.000'):
+            raise InvalidPayment("Payment amount should be greater than 0.000 USD")
+        if not money.in_minor_units(amount):
+            raise InvalidPayment("Payment amounts have at most 6 decimals")
+
+        tstamp = tstamp or datetime.now()
+        async with self._cursor() as cursor:
+            posted = await self._post(cursor, amount, description, tstamp, 'payment', False)
+        if not posted:
+            raise SystemFailed("Payment could not be posted")
+
+    async def withdraw(self, amount, description, tstamp=None):
+        """`withdraw` creates a transaction indicating a withdrawal
+        from the user's credit, unless it crosses the credit limit.
+        """
+        if amount <= Decimal('0.000'):
+            raise InvalidWithdrawal("Withdrawal amount should be greater than 0.000 USD")
+        if not money.in_minor_units(amount):
+            raise InvalidWithdrawal("Withdrawal amounts have at most 6 decimals")
+
+        tstamp = tstamp or datetime.now()
+        async with self._cursor() as cursor:
+            posted = await self._post(cursor, -amount, description, tstamp, 'withdrawal', True)
+        if not posted:
+            raise WithdrawalDenied("Withdrawal crosses the credit limit - Denied")
+
+    async def get_current_due(self, as_of=None):
+        """`get_current_due` computes the amount due in the user's
+        credit account at any point of time.
+        """
+        async with self._cursor() as cursor:
+            balance = await self._get_balance(cursor, as_of)
+        return round_up(self.limit - balance)
+
+    async def compute_outstanding(self, as_of=None):
+        """`compute_outstanding` computes the interest of the period
+        and hence the total outstanding (see `CreditManager`).
+        """
+        interest = 0  # in minor units
+        today = as_datetime(as_of or date.today())
+
+        async with self._cursor() as cursor:
+            previous_eot = (await self._get_head(cursor))['last_eot']
+            check_period(today, previous_eot, self.period)
+
+            due = round_up(self.limit - await self._get_balance(cursor, today))
+            outstanding = self.limit - await self._get_balance(cursor, previous_eot + timedelta(days=1))
+
+            if outstanding > Decimal('0.000'):
+                await self._execute(cursor, queries.PERIOD_SUMMARY, {
+                    'account_id': self.account_id, 'limit': self._dump(self.limit),
+                    'as_of': today, 'previous_eot': previous_eot,
+                })
+                period = self._load(cursor.fetchone(), 'payments', 'weighted_due', 'last_balance')
+                if period['payments'] < outstanding:
+                    interest = money.interest(self.apr, period['weighted_due'])
+                    due = self.limit - period['last_balance']
+
+            interest = money.from_minor(interest)
+            async with self._transaction(cursor):
+                await self._execute(cursor, queries.CLOSE_PERIOD, {
+                    'account_id': self.account_id, 'interest': self._dump(interest),
+                    'as_of': today, 'previous_eot': previous_eot,
+                    'description': eot_description(interest, self.period),
+                })
+                entry = cursor.fetchone()
+                if entry is None:
+                    raise InvalidOutstandingInvocation(
+                        "Outstanding has already been calculated for this period"
+                    )
+                if entry['backdated']:
+                    await self._execute(cursor, queries.REPAIR, {
+                        'account_id': self.account_id, 'id': entry['id'], 'tstamp': entry['tstamp'],
+                    })
+
+        return round_up(interest + due)
+
+    async def get_statement(self, start_date=None, end_date=None):
+        """`get_statement` gets a detailed credit account statement
+        of all the transaction over a time period.
+        """
+        start_date, end_date = statement_range(start_date, end_date)
+        async with self._cursor() as cursor:
+            await self._execute(cursor, queries.STATEMENT, {
+                'account_id': self.account_id,
+                'start_date': start_date, 'end_date': end_date,
+            })
+            return [self._load(row, 'amount') for row in cursor.fetchall()]
@@ -0,0 +1,6 @@
+from .base import Backend
+from .memory import MemoryBackend
+from .sharded import ShardRouter, ShardedBackend
+
+# NOTE: the Postgres backend (the default one) needs psycopg2, hence it
+# is imported from `cmanager.backends.postgres` rather than from here.
@@ -0,0 +1,139 @@
+class Backend(object):
+    """`Backend` defines the storage interface behind `CreditManager`.
+    A backend keeps, for every account, the head record (the terms of
+    the credit line, the latest balance and the last eot) and the ledger
+    of its transactions, and runs the few primitive operations below
+    atomically. The credit rules (validations, interest) stay in
+    `CreditManager`, hence every backend gives the same results.
+
+    Timestamps may be given as dates (midnight) or datetimes. Rows are
+    returned as mappings keyed by column name.
+    """
+
+    def open_account(self, account_id, apr, limit, period, tstamp):
+        """`open_account` creates the head record of the account along
+        with its opening balance transaction.
+        """
+        raise NotImplementedError
+
+    def post(self, account_id, amount, description, tstamp, type, check_balance):
+        """`post` appends a transaction to the ledger and moves the head
+        of the account. With `check_balance` nothing is written if the
+        balance would become negative. Returns whether the transaction
+        was posted and raises `AccountNotFound` for an unknown account.
+        """
+        raise NotImplementedError
+
+    def post_batch(self, writes):
+        """`post_batch` posts the writes (mappings of the arguments of
+        `post`) in a single transaction, in the given order, and returns
+        for each one the pair (posted, error), the error being the
+        `InvalidParameterValue` it raised (eg. `AccountNotFound`). Any
+        other failure posts none of them; a failed commit, which may have
+        gone through, raises `UncertainCommit`.
+        """
+        raise NotImplementedError
+
+    def get_head(self, account_id):
+        """`get_head` returns the head record of the account (`balance`,
+        `last_tstamp` and `last_eot`) or None for an unknown account.
+        """
+        raise NotImplementedError
+
+    def get_balance(self, account_id, as_of):
+        """`get_balance` returns the balance of the account right before
+        `as_of`, or None when there is no transaction before it.
+        """
+        raise NotImplementedError
+
+    def period_summary(self, account_id, limit, previous_eot, as_of):
+        """`period_summary` summarizes the transactions since the previous
+        eot: the `payments` made, the due weighted by the days it was
+        carried (`weighted_due`) and the balance after the latest
+        transaction (`last_balance`).
+        """
+        raise NotImplementedError
+
+    def close_period(self, account_id, previous_eot, as_of, interest, description):
+        """`close_period` charges the interest of the period and moves the
+        last eot of the account to `as_of`, unless the period was closed
+        in the meantime (the last eot is no longer `previous_eot`).
+        Returns whether the period was closed.
+        """
+        raise NotImplementedError
+
+    def get_statement(self, account_id, start_date, end_date):
+        """`get_statement` returns the transactions of the account over a
+        time range (`id`, `tstamp`, `amount`, `type` and `description`),
+        in insertion order.
+        """
+        raise NotImplementedError
+
+    def get_eots(self, account_id, after):
+        """`get_eots` returns the timestamps of the eot transactions of the
+        account (the opening balance included) after `after`, in order.
+        """
+        raise NotImplementedError
+
+    def iter_statement(self, account_id, start_date, end_date, fetch_size):
+        """`iter_statement` yields the rows of `get_statement`, fetching
+        `fetch_size` rows at a time.
+        """
+        raise NotImplementedError
+
+    def get_statement_page(self, account_id, start_date, end_date, after_id, page_size):
+        """`get_statement_page` returns up to `page_size` rows of the
+        statement following the transaction `after_id` (0 for the first
+        page).
+        """
+        raise NotImplementedError
+
+    def search(self, account_id, text, start_date, end_date, limit):
+        """`search` returns up to `limit` rows of the statement whose
+        description contains `text` (case insensitive).
+        """
+        raise NotImplementedError
+
+    def spending(self, account_id, text, start_date, end_date, limit):
+        """`spending` returns the withdrawals per description over a time
+        range (`description`, `withdrawals` and the amount `spent`), the
+        largest first, for the descriptions containing `text` (any for
+        an empty text), up to `limit` of them (all of them for None).
+        """
+        raise NotImplementedError
+
+    def export(self, fileobj, account_ids, start_date, end_date, format):
+        """`export` writes the ledger of the given accounts (all of them
+        for None) to `fileobj` as CSV (`csv`) or JSON lines (`jsonl`).
+        """
+        raise NotImplementedError
+
+    def detach_account(self, account_id):
+        """`detach_account` is a context manager yielding a snapshot of the
+        account: its `head` (`apr`, `credit_limit`, `period`, `balance`,
+        `last_tstamp` and `last_eot`) and its `transactions` (with their
+        running `balance`, in insertion order), amounts in dollars. The
+        writes to the account wait meanwhile; the account is deleted once
+        the block completes, and kept should it raise.
+        """
+        raise NotImplementedError
+
+    def attach_account(self, account_id, snapshot):
+        """`attach_account` creates the account from the snapshot of
+        `detach_account`, all or nothing. The transactions get new ids,
+        in the same order.
+        """
+        raise NotImplementedError
+
+    def replication_lag(self):
+        """`replication_lag` returns how far (in seconds) the database lags
+        behind its primary, 0 for a primary (see `cmanager.replica`).
+        """
+        raise NotImplementedError
+
+    def import_transactions(self, account_id, rows):
+        """`import_transactions` loads (tstamp, amount, type, description)
+        rows into the ledger of the account, all or nothing, and returns
+        a report (see `cmanager.importer.import_transactions`).
+        """
+        raise NotImplementedError
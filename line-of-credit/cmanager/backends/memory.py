@@ -0,0 +1,386 @@
+import io
+import json
+import time
+import threading
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .. import importer
+from ..queries import COLUMNS, FORMATS
+from .base import Backend
+
+from ..exceptions import InvalidParameterValue, AccountNotFound, PeriodClosed
+
+EPOCH = datetime(1970, 1, 1)
+DAY = 86400 * 10 ** 6  # in microseconds
+
+def to_micros(value):
+    """`to_micros` turns a date or a datetime into microseconds since
+    the epoch, the key the ledgers are sorted on.
+    """
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+class Ledger(object):
+    """`Ledger` holds the head record and the transactions of an account.
+    The transactions are kept in parallel arrays sorted by timestamp (and
+    by insertion for equal timestamps, like `ORDER BY tstamp, id`), the
+    timestamps and ids as 64 bit integers, so that the balance as of any
+    time is a binary search and a period is a contiguous slice.
+    """
+
+    def __init__(self, apr, limit, period, balance, last_tstamp, last_eot):
+        self.apr = apr
+        self.limit = limit
+        self.period = period
+        self.balance = balance
+        self.last_tstamp = last_tstamp
+        self.last_eot = last_eot
+
+        self.tstamps = array('q')  # 64 bit integers
+        self.ids = array('q')
+        self.amounts = []
+        self.balances = []
+        self.types = []
+        self.descriptions = []
+
+    def insert(self, id, tstamp, amount, balance, type, description):
+        """`insert` adds a transaction and returns its index.
+        """
+        key = to_micros(tstamp)
+        if not self.tstamps or key >= self.tstamps[-1]:
+            # the common case: the transaction is the latest one.
+            position = len(self.tstamps)
+        else:
+            position = bisect_right(self.tstamps, key)
+        self.tstamps.insert(position, key)
+        self.ids.insert(position, id)
+        self.amounts.insert(position, amount)
+        self.balances.insert(position, balance)
+        self.types.insert(position, type)
+        self.descriptions.insert(position, description)
+        return position
+
+    def rebalance(self, position):
+        """`rebalance` recomputes the running balances from the
+        transaction at `position` onwards (after a backdated one).
+        """
+        balance = self.balances[position - 1]
+        for index in range(position, len(self.balances)):
+            balance += self.amounts[index]
+            self.balances[index] = balance
+
+    def position(self, tstamp):
+        """`position` is the index of the first transaction
+        at or after the given time.
+        """
+        return bisect_left(self.tstamps, to_micros(tstamp))
+
+    def row(self, index):
+        return {
+            'id': self.ids[index],
+            'tstamp': from_micros(self.tstamps[index]),
+            'amount': self.amounts[index],
+            'balance': self.balances[index],
+            'type': self.types[index],
+            'description': self.descriptions[index],
+        }
+
+    def between(self, start_date, end_date):
+        """`between` lists the indexes of the transactions over a time
+        range in insertion (id) order.
+        """
+        indexes = range(self.position(start_date), self.position(end_date))
+        # already in id order unless transactions were backdated.
+        return sorted(indexes, key=self.ids.__getitem__)
+
+def format_tstamp(tstamp, separator):
+    """`format_tstamp` formats a timestamp the way Postgres writes it
+    (the fractional seconds without their trailing zeros).
+    """
+    text = tstamp.strftime('%Y-%m-%d' + separator + '%H:%M:%S')
+    if tstamp.microsecond:
+        text += ('.%06d' % tstamp.microsecond).rstrip('0')
+    return text
+
+def format_csv(value):
+    if isinstance(value, Decimal):
+        return format(value, 'f')
+    if isinstance(value, datetime):
+        return format_tstamp(value, ' ')
+    value = '%s' % value
+    if value == '' or any(c in value for c in ',"\r\n'):
+        return '"%s"' % value.replace('"', '""')
+    return value
+
+def format_json(value):
+    if isinstance(value, Decimal):
+        return format(value, 'f')
+    if isinstance(value, datetime):
+        return '"%s"' % format_tstamp(value, 'T')
+    if isinstance(value, int):
+        return '%d' % value
+    return json.dumps(value, ensure_ascii=False)
+
+class MemoryBackend(Backend):
+    """`MemoryBackend` keeps the accounts and their ledgers in memory,
+    for simulations and fast tests. It gives the same results as the
+    Postgres backend; a single lock makes every primitive atomic.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ledgers = {}
+        self._last_id = 0  # transaction ids are unique across accounts
+
+    def _ledger(self, account_id):
+        ledger = self._ledgers.get(account_id)
+        if ledger is None:
+            raise AccountNotFound("Account %s does not exist" % account_id)
+        return ledger
+
+    def _insert(self, ledger, tstamp, amount, balance, type, description):
+        self._last_id += 1
+        position = ledger.insert(self._last_id, tstamp, amount, balance, type, description)
+        if position < len(ledger.tstamps) - 1:
+            # backdated: the later transactions move by the amount.
+            ledger.rebalance(position)
+
+    def open_account(self, account_id, apr, limit, period, tstamp):
+        tstamp = from_micros(to_micros(tstamp))
+        with self._lock:
+            if account_id in self._ledgers:
+                raise InvalidParameterValue("Account %s already exists" % account_id)
+            ledger = Ledger(apr, limit, period, limit, tstamp, tstamp)
+            self._insert(ledger, tstamp, Decimal('0'), limit, 'eot', 'opening balance')
+            self._ledgers[account_id] = ledger
+
+    def post(self, account_id, amount, description, tstamp, type, check_balance):
+        tstamp = from_micros(to_micros(tstamp))
+        with self._lock:
+            ledger = self._ledger(account_id)
+            if tstamp < ledger.last_eot:
+                raise PeriodClosed("Transaction at %s falls in a closed period" % tstamp)
+            balance = ledger.balance + amount
+            if check_balance and balance < 0:
+                return False
+            ledger.balance = balance
+            ledger.last_tstamp = max(ledger.last_tstamp, tstamp)
+            self._insert(ledger, tstamp, amount, balance, type, description)
+            return True
+
+    def post_batch(self, writes):
+        outcomes = []
+        with self._lock:
+            for write in writes:
+                try:
+                    outcomes.append((self.post(**write), None))
+                except InvalidParameterValue as e:
+                    outcomes.append((None, e))
+        return outcomes
+
+    def get_head(self, account_id):
+        with self._lock:
+            ledger = self._ledgers.get(account_id)
+            if ledger is None:
+                return None
+            return {
+                'balance': ledger.balance,
+                'last_tstamp': ledger.last_tstamp,
+                'last_eot': ledger.last_eot,
+            }
+
+    def get_balance(self, account_id, as_of):
+        with self._lock:
+            ledger = self._ledger(account_id)
+            position = ledger.position(as_of)
+            return ledger.balances[position - 1] if position > 0 else None
+
+    def period_summary(self, account_id, limit, previous_eot, as_of):
+        with self._lock:
+            ledger = self._ledger(account_id)
+            start = ledger.position(previous_eot)
+            days = [tstamp // DAY for tstamp in ledger.tstamps[start:]]
+            balances = ledger.balances[start:]
+
+            payments = Decimal('0')
+            weighted_due = Decimal('0')
+            for index in range(len(days)):
+                if ledger.types[start + index] == 'payment':
+                    payments += ledger.amounts[start + index]
+                # the due after each transaction times the days until
+                # the next one (or until as_of for the last one).
+                next_day = days[index + 1] if index + 1 < len(days) else to_micros(as_of) // DAY
+                weighted_due += (next_day - days[index]) * (limit - balances[index])
+
+            return {
+                'payments': payments,
+                'weighted_due': weighted_due,
+                'last_balance': balances[-1] if balances else None,
+            }
+
+    def close_period(self, account_id, previous_eot, as_of, interest, description):
+        as_of = from_micros(to_micros(as_of))
+        with self._lock:
+            ledger = self._ledger(account_id)
+            if ledger.last_eot != previous_eot:
+                return False
+            ledger.balance -= interest
+            ledger.last_tstamp = max(ledger.last_tstamp, as_of)
+            ledger.last_eot = as_of
+            self._insert(ledger, as_of, Decimal('0') - interest, ledger.balance, 'eot', description)
+            return True
+
+    def _statement(self, account_id, start_date, end_date):
+        ledger = self._ledger(account_id)
+        rows = []
+        for index in ledger.between(start_date, end_date):
+            row = ledger.row(index)
+            del row['balance']
+            rows.append(row)
+        return rows
+
+    def get_statement(self, account_id, start_date, end_date):
+        with self._lock:
+            return self._statement(account_id, start_date, end_date)
+
+    def get_eots(self, account_id, after):
+        with self._lock:
+            ledger = self._ledger(account_id)
+            return [
+                from_micros(ledger.tstamps[index])
+                for index in range(ledger.position(after), len(ledger.tstamps))
+                if ledger.types[index] == 'eot' and ledger.tstamps[index] > to_micros(after)
+            ]
+
+    def iter_statement(self, account_id, start_date, end_date, fetch_size):
+        # the statement is already in memory, hence fetched at once.
+        for row in self.get_statement(account_id, start_date, end_date):
+            yield row
+
+    def get_statement_page(self, account_id, start_date, end_date, after_id, page_size):
+        with self._lock:
+            rows = self._statement(account_id, start_date, end_date)
+        return [row for row in rows if row['id'] > after_id][:page_size]
+
+    def search(self, account_id, text, start_date, end_date, limit):
+        text = text.lower()
+        with self._lock:
+            rows = self._statement(account_id, start_date, end_date)
+        return [row for row in rows if text in row['description'].lower()][:limit]
+
+    def spending(self, account_id, text, start_date, end_date, limit):
+        text = text.lower()
+        totals = {}
+        with self._lock:
+            for row in self._statement(account_id, start_date, end_date):
+                if row['type'] == 'withdrawal' and text in row['description'].lower():
+                    total = totals.setdefault(row['description'], {
+                        'description': row['description'], 'withdrawals': 0, 'spent': Decimal('0'),
+                    })
+                    total['withdrawals'] += 1
+                    total['spent'] -= row['amount']
+        rows = sorted(totals.values(), key=lambda total: (-total['spent'], total['description']))
+        return rows[:limit] if limit is not None else rows
+
+    def get_ledger(self, account_id):
+        """`get_ledger` returns all the transactions of the account with
+        their running balance, in insertion order.
+        """
+        with self._lock:
+            ledger = self._ledger(account_id)
+            return [ledger.row(index) for index in sorted(range(len(ledger.ids)), key=ledger.ids.__getitem__)]
+
+    @contextmanager
+    def detach_account(self, account_id):
+        with self._lock:
+            ledger = self._ledger(account_id)
+            yield {
+                'head': {
+                    'apr': ledger.apr, 'credit_limit': ledger.limit, 'period': ledger.period,
+                    'balance': ledger.balance, 'last_tstamp': ledger.last_tstamp, 'last_eot': ledger.last_eot,
+                },
+                'transactions': self.get_ledger(account_id),
+            }
+            del self._ledgers[account_id]
+
+    def attach_account(self, account_id, snapshot):
+        head = snapshot['head']
+        with self._lock:
+            if account_id in self._ledgers:
+                raise InvalidParameterValue("Account %s already exists" % account_id)
+            ledger = Ledger(head['apr'], head['credit_limit'], head['period'],
+                            head['balance'], head['last_tstamp'], head['last_eot'])
+            for row in snapshot['transactions']:
+                # in insertion order, with their running balance as is.
+                self._last_id += 1
+                ledger.insert(self._last_id, row['tstamp'], row['amount'], row['balance'], row['type'], row['description'])
+            self._ledgers[account_id] = ledger
+
+    def replication_lag(self):
+        # never a replica.
+        return 0.0
+
+    def export(self, fileobj, account_ids, start_date, end_date, format):
+        if format not in FORMATS:
+            raise InvalidParameterValue("Invalid export format %s" % format)
+
+        lines = []
+        if format == 'csv':
+            lines.append(','.join(COLUMNS))
+        with self._lock:
+            if account_ids is None:
+                account_ids = sorted(self._ledgers)
+            for account_id in sorted(set(account_ids)):
+                ledger = self._ledgers.get(account_id)
+                if ledger is None:
+                    continue
+                for index in ledger.between(start_date, end_date):
+                    row = ledger.row(index)
+                    row['account_id'] = account_id
+                    if format == 'csv':
+                        lines.append(','.join(format_csv(row[column]) for column in COLUMNS))
+                    else:
+                        lines.append('{%s}' % ','.join(
+                            '"%s":%s' % (column, format_json(row[column])) for column in COLUMNS
+                        ))
+
+        data = ''.join(line + '\n' for line in lines)
+        if not isinstance(fileobj, io.TextIOBase):
+            data = data.encode('utf-8')
+        fileobj.write(data)
+
+    def import_transactions(self, account_id, rows):
+        start = time.time()
+        with self._lock:
+            ledger = self._ledger(account_id)
+            balance, last_tstamp = ledger.balance, ledger.last_tstamp
+
+            # validate every row before writing any (all or nothing).
+            entries = []
+            for tstamp, amount, type, description in rows:
+                importer.validate(tstamp, amount, type, last_tstamp)
+                amount = importer.SIGNS[type] * amount
+                balance += amount
+                last_tstamp = tstamp
+                entries.append((tstamp, amount, balance, type, description))
+
+            for entry in entries:
+                self._insert(ledger, *entry)
+            ledger.balance, ledger.last_tstamp = balance, last_tstamp
+
+        elapsed = time.time() - start
+        return {
+            'rows': len(entries),
+            'balance': balance,
+            'elapsed': elapsed,
+            'rows_per_sec': len(entries) / elapsed if elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,405 @@
+import csv
+import tempfile
+import psycopg2
+import psycopg2.extras
+from contextlib import contextmanager
+
+from ..settings import DB_CONN_STRING, MONEY_MINOR_UNITS
+from ..pool import ConnectionPool
+from ..money import to_minor, from_minor
+from ..export import copy_ledger
+from .. import importer
+from .. import queries
+from .. import prepared
+from .. import instrument
+from .base import Backend
+
+from ..exceptions import InvalidParameterValue, AccountNotFound, PeriodClosed, UncertainCommit
+
+def like_pattern(text):
+    """`like_pattern` is the `LIKE` pattern matching the descriptions
+    which contain the text as is.
+    """
+    for special in ('\\', '%', '_'):
+        text = text.replace(special, '\\' + special)
+    return '%' + text + '%'
+
+class PostgresBackend(Backend):
+    """`PostgresBackend` keeps the accounts and their ledgers in the
+    `account` and `transaction` tables (see `bootstrap.sql`). Each
+    primitive is a single statement (see `cmanager.queries`) run on a
+    connection checked out from the pool for that statement only; a
+    write also repairs the running balances after a backdated transaction
+    (see `queries.REPAIR`) in the same transaction.
+
+    With `minor_units`, the amounts are stored as BIGINT minor units (see
+    `minor_units.sql` and `cmanager.money`); they are converted from and
+    to dollars right here, the rest of the library sees dollars.
+    """
+
+    def __init__(self, pool=None, prepare=True, minor_units=MONEY_MINOR_UNITS):
+        # NOTE: without a shared pool, the backend gets a private pool
+        # holding a single connection (opened right away) which keeps
+        # the original one connection per manager behaviour.
+        self.pool = pool or ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1, ping_after=None)
+
+        # run the statements as server side prepared statements (see
+        # `cmanager.prepared`). Turn it off behind a pooler which does
+        # not keep the sessions, eg. pgbouncer in transaction mode.
+        self.prepare = prepare
+        self.minor_units = minor_units
+
+    def _dump(self, amount):
+        """`_dump` turns an amount into its stored value.
+        """
+        return to_minor(amount) if self.minor_units else amount
+
+    def _load(self, row, *columns):
+        """`_load` turns the stored amounts of a row into dollars.
+        """
+        if self.minor_units and row is not None:
+            for column in columns:
+                if row[column] is not None:
+                    row[column] = from_minor(row[column])
+        return row
+
+    @contextmanager
+    def _cursor(self):
+        """`_cursor` checks out a connection from the pool for
+        the duration of one operation and yields a cursor on it.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def _transaction(self, function):
+        """`_transaction` checks out a connection from the pool, runs
+        `function(cursor)` in a transaction and returns its result once
+        committed (the transaction is rolled back should it raise). A
+        failed commit may have gone through, hence it raises
+        `UncertainCommit`. A transaction which ran into a statement
+        deallocated behind our back is run again, once, the statements
+        of the session prepared again (see `prepared.reset`).
+        """
+        retry = self.prepare
+        while True:
+            with self.pool.connection() as conn:
+                conn.autocommit = False
+                try:
+                    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+                    result = function(cursor)
+                except Exception as e:
+                    if not conn.closed:
+                        conn.rollback()
+                    if not (retry and prepared.deallocated(e)):
+                        raise
+                else:
+                    try:
+                        conn.commit()
+                    except psycopg2.Error as e:
+                        raise UncertainCommit(str(e))
+                    return result
+                finally:
+                    if not conn.closed:
+                        conn.autocommit = True
+                prepared.reset(conn)
+                retry = False
+
+    def _execute(self, cursor, name, params):
+        """`_execute` runs the statement `name` of `cmanager.queries`.
+        """
+        with instrument.query(name, cursor):
+            if self.prepare:
+                prepared.execute(cursor, name, params, self.minor_units)
+            else:
+                cursor.execute(getattr(queries, name), params)
+
+        slow = instrument.slow_query()
+        if slow is not None:
+            slow.plan = self._explain(cursor.connection, name, params)
+
+    def _explain(self, conn, name, params):
+        """`_explain` runs the statement `name` again under `EXPLAIN
+        ANALYZE` and returns the plan. The statement runs in a transaction
+        (or a savepoint of the ongoing one) rolled back right after, so
+        what a write does is not kept twice.
+        """
+        autocommit = conn.autocommit
+        cursor = conn.cursor()
+        try:
+            # NOTE: psycopg2 ignores `rollback()` in autocommit mode, hence
+            # the transaction is opened and rolled back explicitly.
+            cursor.execute("BEGIN;" if autocommit else "SAVEPOINT explain;")
+            try:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + getattr(queries, name), params)
+                return '\n'.join(line for (line,) in cursor.fetchall())
+            except psycopg2.Error as e:
+                # eg. opening the account again violates its primary key.
+                return 'EXPLAIN ANALYZE failed: %s' % e
+            finally:
+                if autocommit:
+                    cursor.execute("ROLLBACK;")
+                else:
+                    cursor.execute("ROLLBACK TO SAVEPOINT explain;")
+                    cursor.execute("RELEASE SAVEPOINT explain;")
+        finally:
+            cursor.close()
+
+    def open_account(self, account_id, apr, limit, period, tstamp):
+        with self._cursor() as cursor:
+            try:
+                self._execute(cursor, 'OPEN_ACCOUNT', {
+                    'account_id': account_id, 'apr': apr,
+                    'limit': self._dump(limit), 'period': period,
+                    'tstamp': tstamp,  # eot -- END of Term (payment term)
+                })
+            except psycopg2.IntegrityError:
+                raise InvalidParameterValue("Account %s already exists" % account_id)
+
+    def post(self, account_id, amount, description, tstamp, type, check_balance):
+        # an append (the common case) is a single statement in autocommit;
+        # a backdated transaction is left out by it, and posted again along
+        # with its repair in one transaction.
+        with self._cursor() as cursor:
+            posted = self._post(cursor, account_id, amount, description, tstamp, type, check_balance,
+                                append_only=True)
+        if posted is not None:
+            return posted
+        return self._transaction(lambda cursor: self._post(
+            cursor, account_id, amount, description, tstamp, type, check_balance
+        ))
+
+    def post_batch(self, writes):
+        def post(cursor):
+            outcomes = []
+            for write in writes:
+                try:
+                    outcomes.append((self._post(cursor, **write), None))
+                except InvalidParameterValue as e:
+                    outcomes.append((None, e))
+            return outcomes
+        return self._transaction(post)
+
+    def _post(self, cursor, account_id, amount, description, tstamp, type, check_balance, append_only=False):
+        """`_post` runs `POST` on a cursor in a transaction and, for a
+        backdated transaction, `REPAIR` right after it: the account row
+        lock taken by `POST` is held until the commit, so the ledger and
+        the daily rollup are never seen (or left) half repaired. With
+        `append_only` (in autocommit) a backdated transaction is not
+        posted, and None is returned.
+        """
+        self._execute(cursor, 'POST', {
+            'account_id': account_id, 'amount': self._dump(amount), 'tstamp': tstamp,
+            'description': description, 'type': type, 'check_balance': check_balance,
+            'append_only': append_only,
+        })
+        result = cursor.fetchone()
+        if append_only and result is not None and result['backdated'] and not result['closed']:
+            return None
+        posted = self._posted(result, account_id, tstamp)
+        if posted and result['backdated']:
+            self._execute(cursor, 'REPAIR', {'account_id': account_id, 'id': result['id'], 'tstamp': tstamp})
+        return posted
+
+    def _posted(self, result, account_id, tstamp):
+        """`_posted` tells from the row returned by `POST` if the
+        transaction was posted, or raises why it could not be.
+        """
+        if result is None:
+            raise AccountNotFound("Account %s does not exist" % account_id)
+        if result['id'] is None:
+            if result['closed']:
+                raise PeriodClosed("Transaction at %s falls in a closed period" % tstamp)
+            return False
+        return True
+
+    def repair(self, account_id, id, tstamp):
+        """`repair` recomputes the running balances of the ledger (and of
+        the daily rollup) from the transaction `id` at `tstamp` onwards,
+        after a backdated transaction (see `queries.REPAIR`), and returns
+        the number of transactions read and repaired. It holds the account
+        row lock meanwhile; running it again does no harm. The writes
+        repair their backdated transactions themselves, in the transaction
+        which posts them.
+        """
+        def repair(cursor):
+            self._execute(cursor, 'LOCK_ACCOUNT', {'account_id': account_id})
+            self._execute(cursor, 'REPAIR', {'account_id': account_id, 'id': id, 'tstamp': tstamp})
+            return cursor.fetchone()
+        return self._transaction(repair)
+
+    def get_head(self, account_id):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'HEAD', {'account_id': account_id})
+            return self._load(cursor.fetchone(), 'balance')
+
+    def get_balance(self, account_id, as_of):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'BALANCE_AS_OF', {'account_id': account_id, 'as_of': as_of})
+            row = self._load(cursor.fetchone(), 'balance')
+        return row['balance'] if row is not None else None
+
+    def period_summary(self, account_id, limit, previous_eot, as_of):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'PERIOD_SUMMARY', {
+                'account_id': account_id, 'limit': self._dump(limit),
+                'as_of': as_of, 'previous_eot': previous_eot,
+            })
+            return self._load(cursor.fetchone(), 'payments', 'weighted_due', 'last_balance')
+
+    def close_period(self, account_id, previous_eot, as_of, interest, description):
+        # the interest entry and its repair commit (or not) together.
+        def close(cursor):
+            self._execute(cursor, 'CLOSE_PERIOD', {
+                'account_id': account_id, 'interest': self._dump(interest),
+                'as_of': as_of, 'previous_eot': previous_eot,
+                'description': description,
+            })
+            entry = cursor.fetchone()
+            if entry is None:
+                return False
+            if entry['backdated']:
+                self._execute(cursor, 'REPAIR', {'account_id': account_id, 'id': entry['id'], 'tstamp': entry['tstamp']})
+            return True
+        return self._transaction(close)
+
+    def get_statement(self, account_id, start_date, end_date):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'STATEMENT', {
+                'account_id': account_id,
+                'start_date': start_date, 'end_date': end_date,
+            })
+            return [self._load(row, 'amount') for row in cursor.fetchall()]
+
+    def get_eots(self, account_id, after):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'EOTS', {'account_id': account_id, 'after': after})
+            return [row['tstamp'] for row in cursor.fetchall()]
+
+    def iter_statement(self, account_id, start_date, end_date, fetch_size):
+        with self.pool.connection() as conn:
+            # server side (named) cursors only live within a transaction.
+            conn.autocommit = False
+            cursor = conn.cursor('statement', cursor_factory=psycopg2.extras.DictCursor)
+            cursor.itersize = fetch_size
+            try:
+                # a named cursor declares its query, it cannot EXECUTE a
+                # prepared statement: the plain statement is run here.
+                cursor.execute(queries.STATEMENT, {
+                    'account_id': account_id,
+                    'start_date': start_date, 'end_date': end_date,
+                })
+                for row in cursor:
+                    yield self._load(row, 'amount')
+            finally:
+                cursor.close()
+                conn.rollback()
+
+    def get_statement_page(self, account_id, start_date, end_date, after_id, page_size):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'STATEMENT_PAGE', {
+                'account_id': account_id, 'after_id': after_id,
+                'start_date': start_date, 'end_date': end_date,
+                'page_size': page_size,
+            })
+            return [self._load(row, 'amount') for row in cursor.fetchall()]
+
+    def search(self, account_id, text, start_date, end_date, limit):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'SEARCH', {
+                'account_id': account_id, 'pattern': like_pattern(text),
+                'start_date': start_date, 'end_date': end_date,
+                'page_size': limit,
+            })
+            return [self._load(row, 'amount') for row in cursor.fetchall()]
+
+    def spending(self, account_id, text, start_date, end_date, limit):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'SPENDING', {
+                'account_id': account_id, 'pattern': like_pattern(text),
+                'start_date': start_date, 'end_date': end_date,
+                'page_size': limit,
+            })
+            return [self._load(row, 'spent') for row in cursor.fetchall()]
+
+    def export(self, fileobj, account_ids, start_date, end_date, format):
+        with self._cursor() as cursor:
+            with instrument.query('EXPORT'):
+                copy_ledger(cursor, fileobj, account_ids, start_date, end_date, format, self.minor_units)
+
+    @contextmanager
+    def detach_account(self, account_id):
+        with self.pool.connection() as conn:
+            # the account row lock (`ACCOUNT`) holds the writes until the
+            # account is dropped, in the same transaction.
+            conn.autocommit = False
+            try:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+                self._execute(cursor, 'ACCOUNT', {'account_id': account_id})
+                head = self._load(cursor.fetchone(), 'credit_limit', 'balance')
+                if head is None:
+                    raise AccountNotFound("Account %s does not exist" % account_id)
+                self._execute(cursor, 'LEDGER', {'account_id': account_id})
+                yield {
+                    'head': dict(head),
+                    'transactions': [dict(self._load(row, 'amount', 'balance')) for row in cursor.fetchall()],
+                }
+                self._execute(cursor, 'DROP_ACCOUNT', {'account_id': account_id})
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+
+    def attach_account(self, account_id, snapshot):
+        head = snapshot['head']
+        with self.pool.connection() as conn:
+            conn.autocommit = False
+            try:
+                cursor = conn.cursor()
+                try:
+                    self._execute(cursor, 'ATTACH_ACCOUNT', {
+                        'account_id': account_id, 'apr': head['apr'],
+                        'limit': self._dump(head['credit_limit']), 'period': head['period'],
+                        'balance': self._dump(head['balance']),
+                        'tstamp': head['last_tstamp'], 'last_eot': head['last_eot'],
+                    })
+                except psycopg2.IntegrityError:
+                    raise InvalidParameterValue("Account %s already exists" % account_id)
+
+                # the ledger is copied in insertion order (hence the new ids
+                # keep it) and the rollup is rebuilt from it.
+                with tempfile.TemporaryFile('w+') as ledger:
+                    writer = csv.writer(ledger, lineterminator='\n')
+                    for row in snapshot['transactions']:
+                        writer.writerow([
+                            account_id, row['tstamp'], self._dump(row['amount']),
+                            self._dump(row['balance']), row['description'], row['type'],
+                        ])
+                    ledger.seek(0)
+                    cursor.copy_expert("""
+                        COPY
+                            transaction (account_id, tstamp, amount, balance, description, type)
+                        FROM STDIN WITH CSV
+                    """, ledger)
+                cursor.execute(queries.ROLLUP_REBUILD, {'account_id': account_id})
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.autocommit = True
+
+    def replication_lag(self):
+        with self._cursor() as cursor:
+            self._execute(cursor, 'REPLICATION_LAG', {})
+            return float(cursor.fetchone()['lag'])
+
+    def import_transactions(self, account_id, rows):
+        with self.pool.connection() as conn:
+            with instrument.query('IMPORT'):
+                return importer.import_transactions(conn, account_id, rows, self.minor_units)
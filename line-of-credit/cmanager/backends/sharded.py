@@ -0,0 +1,292 @@
+import io
+import bisect
+import hashlib
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from ..settings import DB_SHARDS, DB_POOL_MAX, SHARD_VNODES
+from ..queries import FORMATS
+from .base import Backend
+
+from ..exceptions import InvalidParameterValue, AccountNotFound, UncertainCommit
+
+def ring_hash(key):
+    """`ring_hash` places a key on the hash ring (a 64 bit integer), the
+    same way in every process.
+    """
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+class ShardRouter(object):
+    """`ShardRouter` maps the accounts to the shards: several databases
+    (any backends, by name) each holding a subset of the accounts along
+    with their whole ledgers. The mapping is a consistent hash: every
+    shard owns `vnodes` points of a hash ring and an account belongs to
+    the shard owning the first point at or after its own hash, hence a
+    shard added to N of them takes about 1/(N+1) of the accounts, from
+    every other shard, and no account moves between the others.
+
+    An account moved off the shard it hashes to (see `move_account`)
+    is routed to its new shard from then on; `moved` lists those, to be
+    kept (eg. along with the configuration) and given back when the
+    router is built again.
+    """
+
+    def __init__(self, shards, vnodes=SHARD_VNODES, moved=None):
+        if not shards:
+            raise InvalidParameterValue("No shards")
+        if vnodes < 1:
+            raise InvalidParameterValue("Invalid number of virtual nodes")
+        self.shards = dict(shards)
+        self.vnodes = vnodes
+
+        ring = sorted(
+            (ring_hash('%s#%d' % (name, vnode)), name)
+            for name in self.shards for vnode in range(vnodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [name for _, name in ring]
+
+        # the moved accounts, guarded by this lock.
+        self._lock = threading.Lock()
+        self._moved = {}
+        for account_id, name in (moved or {}).items():
+            if name not in self.shards:
+                raise InvalidParameterValue("Unknown shard %s" % name)
+            self._moved[account_id] = name
+
+    @classmethod
+    def from_dsns(cls, dsns=None, maxconn=DB_POOL_MAX, vnodes=SHARD_VNODES, moved=None):
+        """`from_dsns` builds a router over Postgres databases, by name
+        (`DB_SHARDS` by default), each one with its own connection pool.
+        """
+        # NOTE: imported here so that psycopg2 is only needed
+        # when the shards are actually Postgres databases.
+        from ..pool import ConnectionPool
+        from .postgres import PostgresBackend
+        dsns = dsns if dsns is not None else DB_SHARDS
+        return cls(dict(
+            (name, PostgresBackend(ConnectionPool(dsn, minconn=1, maxconn=maxconn)))
+            for name, dsn in dsns.items()
+        ), vnodes, moved)
+
+    def home(self, account_id):
+        """`home` is the shard the account hashes to, moved or not.
+        """
+        index = bisect.bisect_left(self._points, ring_hash(str(account_id)))
+        return self._owners[index % len(self._owners)]
+
+    def shard_for(self, account_id):
+        """`shard_for` is the name of the shard holding the account.
+        """
+        with self._lock:
+            moved = self._moved.get(account_id)
+        return moved if moved is not None else self.home(account_id)
+
+    def backend_for(self, account_id):
+        """`backend_for` is the backend of the shard holding the account.
+        """
+        return self.shards[self.shard_for(account_id)]
+
+    def moved(self):
+        """`moved` returns the accounts held off the shard they hash to,
+        with the shard holding them.
+        """
+        with self._lock:
+            return dict(self._moved)
+
+    def move_account(self, account_id, target):
+        """`move_account` moves an account, with its ledger, to the shard
+        `target` (copy then switch) and returns the number of transactions
+        moved:
+
+        1. the source shard takes a snapshot of the account, the writes
+           to the account waiting on the source meanwhile;
+        2. the target shard creates the account from it, committed;
+        3. the account is routed to the target;
+        4. the source deletes the account and lets the writes go, which
+           find no account there (`POST` reads the account under its
+           lock) and are run again on the target (see `ShardedBackend`).
+
+        Should the copy fail, the account stays where it was. The moved
+        transactions get new ids: the pages of a statement started before
+        the move do not carry over.
+        """
+        if target not in self.shards:
+            raise InvalidParameterValue("Unknown shard %s" % target)
+        source = self.shard_for(account_id)
+        if source == target:
+            return 0
+
+        with self.shards[source].detach_account(account_id) as snapshot:
+            self.shards[target].attach_account(account_id, snapshot)
+            with self._lock:
+                if target == self.home(account_id):
+                    self._moved.pop(account_id, None)
+                else:
+                    self._moved[account_id] = target
+        return len(snapshot['transactions'])
+
+    def closeall(self):
+        """`closeall` closes the connection pools of the shards.
+        """
+        for backend in self.shards.values():
+            pool = getattr(backend, 'pool', None)
+            if pool is not None:
+                pool.closeall()
+
+class ShardedBackend(Backend):
+    """`ShardedBackend` runs every primitive on the shard holding its
+    account (see `ShardRouter`), hence a `CreditManager(...,
+    backend=ShardedBackend(router))` talks to the right database
+    whatever the account. A primitive finding no account on a shard the
+    account was moved off meanwhile is run again on its new shard. The
+    exports of many accounts fan out to the shards, in parallel.
+    """
+
+    def __init__(self, router, workers=None):
+        self.router = router
+        # threads running the exports of the shards (one per shard).
+        self.workers = workers or len(router.shards)
+
+    def _run(self, account_id, name, *args):
+        """`_run` runs the primitive `name` on the shard of the account.
+        """
+        while True:
+            shard = self.router.shard_for(account_id)
+            try:
+                result = getattr(self.router.shards[shard], name)(account_id, *args)
+            except AccountNotFound:
+                if self.router.shard_for(account_id) == shard:
+                    raise
+                continue  # moved meanwhile
+            if result is None and self.router.shard_for(account_id) != shard:
+                continue  # moved meanwhile (eg. `get_head`)
+            return result
+
+    def open_account(self, account_id, apr, limit, period, tstamp):
+        self.router.backend_for(account_id).open_account(account_id, apr, limit, period, tstamp)
+
+    def post(self, account_id, amount, description, tstamp, type, check_balance):
+        return self._run(account_id, 'post', amount, description, tstamp, type, check_balance)
+
+    def _post_alone(self, write):
+        """`_post_alone` posts a write of a batch on its own and returns
+        its outcome (see `post_batch`), whatever it raised.
+        """
+        try:
+            return self.post(**write), None
+        except Exception as e:
+            return None, e
+
+    def post_batch(self, writes):
+        """`post_batch` posts a batch per shard, one shard after the other,
+        each in a transaction of its own: the writes are not posted all or
+        nothing across the shards. Hence the writes of a shard whose batch
+        failed are posted one at a time, failing on their own (with any
+        error, `UncertainCommit` for a commit which may have gone through)
+        while the batches of the other shards are kept. A write to an
+        account moved meanwhile is posted on its new shard.
+        """
+        shards = {}
+        for index, write in enumerate(writes):
+            shards.setdefault(self.router.shard_for(write['account_id']), []).append(index)
+
+        outcomes = [None] * len(writes)
+        for name, indexes in sorted(shards.items()):
+            try:
+                results = self.router.shards[name].post_batch([writes[index] for index in indexes])
+            except UncertainCommit as e:
+                results = [(None, e)] * len(indexes)
+            except Exception:
+                results = [self._post_alone(writes[index]) for index in indexes]
+            for index, (posted, error) in zip(indexes, results):
+                if isinstance(error, AccountNotFound) and self.router.shard_for(writes[index]['account_id']) != name:
+                    posted, error = self._post_alone(writes[index])  # moved meanwhile
+                outcomes[index] = (posted, error)
+        return outcomes
+
+    def get_head(self, account_id):
+        return self._run(account_id, 'get_head')
+
+    def get_balance(self, account_id, as_of):
+        return self._run(account_id, 'get_balance', as_of)
+
+    def period_summary(self, account_id, limit, previous_eot, as_of):
+        return self._run(account_id, 'period_summary', limit, previous_eot, as_of)
+
+    def close_period(self, account_id, previous_eot, as_of, interest, description):
+        return self._run(account_id, 'close_period', previous_eot, as_of, interest, description)
+
+    def get_statement(self, account_id, start_date, end_date):
+        return self._run(account_id, 'get_statement', start_date, end_date)
+
+    def get_eots(self, account_id, after):
+        return self._run(account_id, 'get_eots', after)
+
+    def iter_statement(self, account_id, start_date, end_date, fetch_size):
+        return self.router.backend_for(account_id).iter_statement(account_id, start_date, end_date, fetch_size)
+
+    def get_statement_page(self, account_id, start_date, end_date, after_id, page_size):
+        return self._run(account_id, 'get_statement_page', start_date, end_date, after_id, page_size)
+
+    def search(self, account_id, text, start_date, end_date, limit):
+        return self._run(account_id, 'search', text, start_date, end_date, limit)
+
+    def spending(self, account_id, text, start_date, end_date, limit):
+        return self._run(account_id, 'spending', text, start_date, end_date, limit)
+
+    def detach_account(self, account_id):
+        return self.router.backend_for(account_id).detach_account(account_id)
+
+    def attach_account(self, account_id, snapshot):
+        self.router.backend_for(account_id).attach_account(account_id, snapshot)
+
+    def replication_lag(self):
+        # as far as the furthest shard (eg. shards of replicas).
+        return max(backend.replication_lag() for backend in self.router.shards.values())
+
+    def import_transactions(self, account_id, rows):
+        return self._run(account_id, 'import_transactions', rows)
+
+    def export(self, fileobj, account_ids, start_date, end_date, format):
+        """`export` exports the accounts of every shard to a temporary
+        file, the shards in parallel, then writes the files one after the
+        other (one CSV header): the ledgers come grouped by shard, in
+        account order within a shard.
+        """
+        if format not in FORMATS:
+            raise InvalidParameterValue("Invalid export format %s" % format)
+        if account_ids is None:
+            parts = [(name, None) for name in sorted(self.router.shards)]
+        else:
+            accounts = {}
+            for account_id in account_ids:
+                accounts.setdefault(self.router.shard_for(account_id), []).append(account_id)
+            parts = sorted(accounts.items()) or [(sorted(self.router.shards)[0], [])]
+
+        def export_shard(part):
+            name, ids = part
+            spool = tempfile.TemporaryFile()
+            try:
+                self.router.shards[name].export(spool, ids, start_date, end_date, format)
+                spool.seek(0)
+            except Exception:
+                spool.close()
+                raise
+            return spool
+
+        workers = ThreadPool(min(self.workers, len(parts)))
+        try:
+            spools = workers.map(export_shard, parts)
+        finally:
+            workers.close()
+            workers.join()
+
+        text = isinstance(fileobj, io.TextIOBase)
+        for index, spool in enumerate(spools):
+            with spool:
+                if format == 'csv' and index > 0:
+                    spool.readline()  # the header, written once
+                for line in spool:
+                    fileobj.write(line.decode('utf-8') if text else line)
@@ -0,0 +1,239 @@
+import sys
+import time
+import argparse
+import threading
+import psycopg2.extras
+from datetime import datetime, date
+from multiprocessing.pool import ThreadPool
+
+from .settings import DB_CONN_STRING, DB_SHARDS, MONEY_MINOR_UNITS
+from .pool import ConnectionPool
+from .backends.sharded import ShardRouter
+from .backends.postgres import PostgresBackend
+from .money import from_minor
+from .cmanager import CreditManager
+from .partitions import ensure_partitions
+
+from .exceptions import InvalidParameterValue, InvalidOutstandingInvocation
+
+class EndOfTermRunner(object):
+    """`EndOfTermRunner` runs the end of term (eot) computation for
+    every account whose payment period has completed as of a given
+    date, using a pool of worker threads which share a connection pool.
+
+    Each account is closed by a single `compute_outstanding` call which
+    moves the account's last eot to the run date, hence a run that
+    crashed half way can simply be started again: the accounts already
+    closed for that date are no longer due and are skipped.
+
+    With `minor_units`, the database stores the amounts as minor units
+    (see `PostgresBackend`), like the backends of its credit managers.
+    """
+
+    def __init__(self, pool=None, workers=4, chunk_size=500, progress=None, minor_units=MONEY_MINOR_UNITS):
+        if workers < 1:
+            raise InvalidParameterValue("Invalid number of workers")
+        if chunk_size < 1:
+            raise InvalidParameterValue("Invalid chunk size")
+
+        # one connection per worker plus one to page through the accounts.
+        self.pool = pool or ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=workers + 1)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.minor_units = minor_units
+
+        # called with a copy of the run report after each chunk.
+        self.progress = progress
+
+    def _count_due(self, cursor, as_of):
+        cursor.execute("""
+            SELECT
+                COUNT(*) AS due
+            FROM
+                account
+            WHERE
+                last_eot + period * INTERVAL '1 day' <= %s;
+        """, (as_of,))
+        return cursor.fetchone()['due']
+
+    def due_accounts(self, as_of):
+        """`due_accounts` yields the accounts whose period has completed
+        as of the given date, in chunks of `chunk_size` (keyset paginated
+        on the account id so that each chunk is a bounded query).
+        """
+        after_id = None
+        while True:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+                cursor.execute("""
+                    SELECT
+                        id, apr, credit_limit, period
+                    FROM
+                        account
+                    WHERE
+                        (%s IS NULL OR id > %s) AND
+                        last_eot + period * INTERVAL '1 day' <= %s
+                    ORDER BY
+                        id
+                    LIMIT %s;
+                """, (after_id, after_id, as_of, self.chunk_size))
+                chunk = cursor.fetchall()
+            if not chunk:
+                return
+            yield chunk
+            after_id = chunk[-1]['id']
+
+    def _close(self, account, as_of):
+        limit = account['credit_limit']
+        if self.minor_units:
+            limit = from_minor(limit)
+        backend = PostgresBackend(self.pool, minor_units=self.minor_units)
+        cm = CreditManager(account['id'], account['apr'], limit, account['period'], backend=backend)
+        try:
+            cm.compute_outstanding(as_of)
+        except InvalidOutstandingInvocation:
+            # closed by someone else in the meantime.
+            return 'skipped', None
+        except Exception as e:
+            return 'failed', e
+        return 'closed', None
+
+    def run(self, as_of=None):
+        """`run` closes all the due accounts and returns a report with
+        the number of accounts closed, skipped and failed, along with
+        the time taken and the throughput (accounts closed per second).
+        """
+        as_of = as_of or date.today()
+        if not isinstance(as_of, datetime):
+            as_of = datetime.combine(as_of, datetime.min.time())
+
+        with self.pool.connection() as conn:
+            # the eot transactions of this run, and the ones of the next
+            # months, get their ledger partitions ahead of time.
+            ensure_partitions(conn, as_of)
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            due = self._count_due(cursor, as_of)
+
+        report = {
+            'as_of': as_of, 'due': due, 'closed': 0, 'skipped': 0,
+            'failed': 0, 'errors': {}, 'elapsed': 0.0, 'throughput': 0.0,
+        }
+        lock = threading.Lock()
+
+        def close(account):
+            status, error = self._close(account, as_of)
+            with lock:
+                report[status] += 1
+                if error is not None:
+                    report['errors'][account['id']] = error
+
+        start = time.time()
+        workers = ThreadPool(self.workers)
+        try:
+            for chunk in self.due_accounts(as_of):
+                workers.map(close, chunk)
+                report['elapsed'] = time.time() - start
+                if self.progress is not None:
+                    self.progress(dict(report))
+        finally:
+            workers.close()
+            workers.join()
+
+        report['elapsed'] = time.time() - start
+        if report['elapsed'] > 0:
+            report['throughput'] = report['closed'] / report['elapsed']
+        return report
+
+class ShardedEndOfTermRunner(object):
+    """`ShardedEndOfTermRunner` runs the end of term computation on every
+    shard of a `ShardRouter` (Postgres databases) at once: an
+    `EndOfTermRunner` per shard, with `workers` threads of its own on the
+    connection pool of its shard (to be sized for `workers + 1`
+    connections). Safe to re-run, like a single database run.
+    """
+
+    def __init__(self, router, workers=4, chunk_size=500, progress=None):
+        self.router = router
+        self.runners = {}
+        for name, backend in router.shards.items():
+            # the progress of a shard tells which shard it is.
+            def shard_progress(report, name=name):
+                if progress is not None:
+                    progress(dict(report, shard=name))
+            self.runners[name] = EndOfTermRunner(backend.pool, workers, chunk_size, shard_progress,
+                                                 minor_units=backend.minor_units)
+
+    def run(self, as_of=None):
+        """`run` closes all the due accounts of every shard and returns
+        the report of `EndOfTermRunner.run` summed over the shards, the
+        report of every shard under `shards`.
+        """
+        start = time.time()
+        names = sorted(self.runners)
+        workers = ThreadPool(len(names))
+        try:
+            reports = workers.map(lambda name: self.runners[name].run(as_of), names)
+        finally:
+            workers.close()
+            workers.join()
+
+        report = {
+            'as_of': reports[0]['as_of'], 'due': 0, 'closed': 0, 'skipped': 0,
+            'failed': 0, 'errors': {}, 'elapsed': time.time() - start, 'throughput': 0.0,
+            'shards': dict(zip(names, reports)),
+        }
+        for shard in reports:
+            for key in ('due', 'closed', 'skipped', 'failed'):
+                report[key] += shard[key]
+            report['errors'].update(shard['errors'])
+        if report['elapsed'] > 0:
+            report['throughput'] = report['closed'] / report['elapsed']
+        return report
+
+def main(argv=None):
+    """`main` is the command line entry point of the end of term runner.
+    """
+    parser = argparse.ArgumentParser(
+        description='Compute the outstanding of every account whose payment period has completed.'
+    )
+    parser.add_argument('--as-of', help='run date (YYYY-MM-DD), defaults to today')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker threads')
+    parser.add_argument('--chunk-size', type=int, default=500, help='accounts fetched per chunk')
+    parser.add_argument('--dsn', default=DB_CONN_STRING, help='database connection string')
+    parser.add_argument('--shard', action='append', default=[], metavar='NAME=DSN',
+                        help='shard database (repeat for every shard), runs on all the shards instead of --dsn')
+    args = parser.parse_args(argv)
+
+    shards = dict(DB_SHARDS)
+    for shard in args.shard:
+        name, separator, dsn = shard.partition('=')
+        if not separator:
+            parser.error('invalid shard %s (NAME=DSN expected)' % shard)
+        shards[name] = dsn
+
+    as_of = datetime.strptime(args.as_of, '%Y-%m-%d') if args.as_of else None
+
+    def progress(report):
+        done = report['closed'] + report['skipped'] + report['failed']
+        shard = 'shard %s: ' % report['shard'] if 'shard' in report else ''
+        sys.stderr.write('%s%d/%d accounts processed (%d failed)\n' % (shard, done, report['due'], report['failed']))
+
+    if shards:
+        router = ShardRouter.from_dsns(shards, maxconn=args.workers + 1)
+        report = ShardedEndOfTermRunner(router, args.workers, args.chunk_size, progress).run(as_of)
+        router.closeall()
+    else:
+        pool = ConnectionPool(args.dsn, minconn=1, maxconn=args.workers + 1)
+        runner = EndOfTermRunner(pool, args.workers, args.chunk_size, progress)
+        report = runner.run(as_of)
+        pool.closeall()
+
+    for account_id, error in sorted(report['errors'].items()):
+        sys.stderr.write('account %s failed: %s\n' % (account_id, error))
+    sys.stdout.write('closed %d, skipped %d, failed %d accounts in %.2fs (%.1f accounts/sec)\n' % (
+        report['closed'], report['skipped'], report['failed'],
+        report['elapsed'], report['throughput']))
+    return 1 if report['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import time
+import threading
+
+from .settings import WRITE_BUFFER_MAX_BATCH, WRITE_BUFFER_MAX_LATENCY, WRITE_BUFFER_TIMEOUT
+
+from .exceptions import InvalidParameterValue, SystemFailed, UncertainCommit
+
+class Write(object):
+    """`Write` is a transaction waiting in the buffer for its batch.
+    """
+
+    def __init__(self, account_id, amount, description, tstamp, type, check_balance):
+        self.params = {
+            'account_id': account_id, 'amount': amount, 'tstamp': tstamp,
+            'description': description, 'type': type, 'check_balance': check_balance,
+        }
+        self.queued = time.time()
+        self.done = threading.Event()
+        self.posted = None
+        self.error = None
+
+class WriteBuffer(object):
+    """`WriteBuffer` coalesces the payments and withdrawals of any number
+    of credit managers (on any accounts, from any threads) into batches
+    posted in a single transaction, hence a single commit (and WAL flush)
+    per batch. A batch is flushed once `max_batch` writes are waiting or
+    when its first write has waited for `max_latency` seconds; every
+    caller returns (or raises) once its own batch is committed, or after
+    `timeout` seconds.
+
+    Give it to the credit managers (`CreditManager(..., buffer=buffer)`)
+    and `close` it once done. It writes through a backend posting batches
+    (see `Backend.post_batch`), a Postgres one by default.
+    """
+
+    def __init__(self, backend=None, max_batch=WRITE_BUFFER_MAX_BATCH, max_latency=WRITE_BUFFER_MAX_LATENCY,
+                 timeout=WRITE_BUFFER_TIMEOUT):
+        if max_batch < 1:
+            raise InvalidParameterValue("Invalid write batch size")
+        if max_latency < 0:
+            raise InvalidParameterValue("Invalid write latency")
+        if timeout is not None and timeout <= 0:
+            raise InvalidParameterValue("Invalid write timeout")
+
+        if backend is None:
+            # NOTE: imported here so that psycopg2 is only needed
+            # when the buffer actually writes to Postgres.
+            from .backends.postgres import PostgresBackend
+            backend = PostgresBackend()
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        # None waits for the commit however long it takes.
+        self.timeout = timeout
+
+        # all the state below is guarded by this condition.
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = []
+        self._flushing = []
+        self._closed = False
+        self._failure = None
+        self._batches = 0
+        self._writes = 0
+        self._largest = 0
+        self._retried = 0
+
+        self._flusher = threading.Thread(target=self._run, name='cmanager-write-buffer')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def post(self, account_id, amount, description, tstamp, type, check_balance):
+        """`post` queues a transaction and waits for its batch to be
+        committed; same arguments and outcome as `Backend.post`. Past the
+        timeout, a write still waiting for its batch is dropped (and raises
+        `SystemFailed`) while one being committed raises `UncertainCommit`,
+        as it may still go through.
+        """
+        write = Write(account_id, amount, description, tstamp, type, check_balance)
+        with self._cond:
+            if self._failure is not None:
+                raise SystemFailed("The write buffer failed: %s" % self._failure)
+            if self._closed:
+                raise SystemFailed("The write buffer is closed")
+            self._pending.append(write)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        if not write.done.wait(self.timeout):
+            with self._cond:
+                if write in self._pending:
+                    self._pending.remove(write)
+                    raise SystemFailed("The write was not committed within %s seconds" % self.timeout)
+            if not write.done.is_set():
+                raise UncertainCommit("The write was not committed within %s seconds" % self.timeout)
+        if write.error is not None:
+            raise write.error
+        return write.posted
+
+    def _run(self):
+        try:
+            self._drain()
+        except Exception as e:
+            # the flusher is gone: fail the writes waiting for it (and
+            # the later ones) rather than leaving their callers hanging.
+            with self._cond:
+                self._failure = e
+                self._closed = True
+                waiting = self._flushing + self._pending
+                self._pending = []
+            for write in waiting:
+                if not write.done.is_set():
+                    write.error = SystemFailed("The write buffer failed: %s" % e)
+                    write.error.__cause__ = e
+                    write.done.set()
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return  # closed and drained
+
+                # wait for the batch to fill up, until the first write
+                # of the batch has waited long enough.
+                deadline = self._pending[0].queued + self.max_latency
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                self._flushing = batch
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            self._commit(batch)
+        except UncertainCommit as e:
+            # the commit itself failed: the batch may or may not be in,
+            # posting it again could post it twice.
+            for write in batch:
+                write.error = e
+        except Exception:
+            # a statement failed (eg. a deadlock): nothing was committed,
+            # post the writes one at a time so only the faulty one fails.
+            with self._cond:
+                self._retried += 1
+            for write in batch:
+                try:
+                    params = write.params
+                    write.posted = self.backend.post(
+                        params['account_id'], params['amount'], params['description'],
+                        params['tstamp'], params['type'], params['check_balance'],
+                    )
+                except Exception as e:
+                    write.error = e
+
+        with self._cond:
+            self._flushing = []
+            self._batches += 1
+            self._writes += len(batch)
+            self._largest = max(self._largest, len(batch))
+        for write in batch:
+            write.done.set()
+
+    def _commit(self, batch):
+        """`_commit` posts the batch in a single transaction (see
+        `Backend.post_batch`). The writes are posted in account order (in
+        arrival order for an account), so that concurrent batches take the
+        account row locks in the same order.
+        """
+        writes = sorted(batch, key=lambda write: write.params['account_id'])
+        outcomes = self.backend.post_batch([write.params for write in writes])
+        for write, (posted, error) in zip(writes, outcomes):
+            write.posted, write.error = posted, error
+
+    def stats(self):
+        """`stats` returns a snapshot of the buffer usage for monitoring.
+        """
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'batches': self._batches,
+                'writes': self._writes,
+                'largest_batch': self._largest,
+                'retried_batches': self._retried,
+            }
+
+    def close(self):
+        """`close` flushes the pending writes and stops the buffer.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._flusher.join()
@@ -0,0 +1,234 @@
+import os
+import pickle
+import tempfile
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+
+from .settings import STATEMENT_CACHE_MAX_ROWS
+from .cmanager import as_datetime
+
+from .exceptions import InvalidParameterValue
+
+# Statements of the closed periods. A transaction before the last eot of
+# an account is refused (`PeriodClosed`), hence the statement of a closed
+# period (from one eot to the next) never changes and is cached for good,
+# keyed by `(account_id, start, end)`. A statement is made of the cached
+# periods it covers plus a live query of the current (open) period, which
+# is never cached.
+
+FILE_TSTAMP = '%Y%m%dT%H%M%S%f'
+
+def _as_dict(row):
+    return dict((column, row[column]) for column in row.keys())
+
+class DiskStore(object):
+    """`DiskStore` keeps the cached periods in a local directory (one
+    pickle file per period), eg. to keep them across restarts or to share
+    them between the processes of a host. Give it to a `StatementCache`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, key):
+        account_id, start, end = key
+        return os.path.join(self.path, '%s-%s-%s.pickle' % (
+            account_id, start.strftime(FILE_TSTAMP), end.strftime(FILE_TSTAMP)
+        ))
+
+    def get(self, key):
+        """`get` returns the rows of a period, or None.
+        """
+        try:
+            with open(self._file(key), 'rb') as stored:
+                return pickle.load(stored)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, rows):
+        """`put` stores the rows of a period. The file is written aside
+        and renamed, so that a reader never sees half a file.
+        """
+        fd, path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as stored:
+            pickle.dump(rows, stored, pickle.HIGHEST_PROTOCOL)
+        os.rename(path, self._file(key))
+
+    def keys(self, account_id):
+        """`keys` lists the periods stored for an account.
+        """
+        keys = []
+        for name in os.listdir(self.path):
+            parts = name[:-len('.pickle')].split('-')
+            if not name.endswith('.pickle') or len(parts) != 3 or parts[0] != str(account_id):
+                continue
+            keys.append((account_id,
+                         datetime.strptime(parts[1], FILE_TSTAMP),
+                         datetime.strptime(parts[2], FILE_TSTAMP)))
+        return keys
+
+    def discard(self, key):
+        """`discard` drops a period and tells if it was stored.
+        """
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            return False
+        return True
+
+class StatementCache(object):
+    """`StatementCache` caches the statements of the closed periods of any
+    number of accounts, in memory (least recently used periods evicted
+    beyond `max_rows` rows) and, with a `store` (see `DiskStore`), on disk
+    behind it. Give it to the credit managers (`CreditManager(...,
+    cache=cache)`) and `get_statement` goes through it. A cache belongs to
+    a single database, whose accounts are never deleted.
+    """
+
+    def __init__(self, max_rows=STATEMENT_CACHE_MAX_ROWS, store=None):
+        if max_rows < 0:
+            raise InvalidParameterValue("Invalid cache size")
+        self.max_rows = max_rows
+        self.store = store
+
+        # all the state below is guarded by this lock.
+        self._lock = threading.Lock()
+        self._periods = OrderedDict()  # least recently used first
+        self._rows = 0
+        self._eots = {}  # the known eots of every account
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._tails = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get_statement(self, backend, account_id, start_date, end_date):
+        """`get_statement` returns the statement of `backend.get_statement`,
+        the closed periods it covers from the cache.
+        """
+        head = backend.get_head(account_id)
+        if head is None:
+            return backend.get_statement(account_id, start_date, end_date)
+        start, end = as_datetime(start_date), as_datetime(end_date)
+        last_eot = head['last_eot']
+
+        rows = []
+        if start < last_eot:
+            for key in self._covering(backend, account_id, last_eot, start, min(end, last_eot)):
+                # copies, the cached rows are shared.
+                rows.extend(dict(row) for row in self._period(backend, key) if start <= row['tstamp'] < end)
+        if end > last_eot:
+            with self._lock:
+                self._tails += 1
+            rows.extend(_as_dict(row) for row in backend.get_statement(account_id, max(start, last_eot), end))
+
+        # in insertion order, which may interleave the periods.
+        rows.sort(key=lambda row: row['id'])
+        return rows
+
+    def _covering(self, backend, account_id, last_eot, start, end):
+        """`_covering` lists the keys of the closed periods overlapping
+        `[start, end)`, fetching the eots of the account it does not know.
+        """
+        with self._lock:
+            eots = self._eots.get(account_id, [])
+        if not eots or eots[-1] > last_eot:
+            eots = backend.get_eots(account_id, datetime.min)
+        elif eots[-1] < last_eot:
+            eots = eots + backend.get_eots(account_id, eots[-1])
+        # a period closed since the head was read is not closed yet here.
+        eots = [eot for eot in eots if eot <= last_eot]
+        with self._lock:
+            self._eots[account_id] = eots
+
+        return [
+            (account_id, eots[index], eots[index + 1])
+            for index in range(len(eots) - 1)
+            if eots[index] < end and eots[index + 1] > start
+        ]
+
+    def _period(self, backend, key):
+        """`_period` returns the rows of a closed period, from memory, from
+        the store or from the backend (in that order).
+        """
+        with self._lock:
+            rows = self._periods.pop(key, None)
+            if rows is not None:
+                self._periods[key] = rows  # the most recently used now
+                self._hits += 1
+                return rows
+
+        rows = self.store.get(key) if self.store is not None else None
+        if rows is not None:
+            with self._lock:
+                self._disk_hits += 1
+        else:
+            account_id, start, end = key
+            rows = [_as_dict(row) for row in backend.get_statement(account_id, start, end)]
+            if self.store is not None:
+                self.store.put(key, rows)
+            with self._lock:
+                self._misses += 1
+
+        with self._lock:
+            if len(rows) <= self.max_rows and key not in self._periods:
+                self._periods[key] = rows
+                self._rows += len(rows)
+                while self._rows > self.max_rows:
+                    _, evicted = self._periods.popitem(last=False)
+                    self._rows -= len(evicted)
+                    self._evictions += 1
+        return rows
+
+    def invalidate(self, account_id, tstamp):
+        """`invalidate` drops the cached period of the account which a
+        transaction at `tstamp` falls in and returns how many were dropped
+        (0 or 1). Writes in the closed periods are refused, hence `pay` and
+        `withdraw` never drop any; should a closed period change anyway (eg.
+        a ledger fixed by hand), call it for the period to be read again.
+        The period is found among the eots known to the cache (those of the
+        statements read through it): a transaction in the open period, the
+        case of every write, is dropped right away, the store untouched.
+        """
+        tstamp = as_datetime(tstamp)
+        with self._lock:
+            eots = self._eots.get(account_id, [])
+        index = bisect_right(eots, tstamp) - 1
+        if index < 0 or index >= len(eots) - 1:
+            return 0  # not in a period known to be closed
+        key = (account_id, eots[index], eots[index + 1])
+
+        with self._lock:
+            rows = self._periods.pop(key, None)
+            if rows is not None:
+                self._rows -= len(rows)
+        dropped = rows is not None
+        if self.store is not None:
+            dropped = self.store.discard(key) or dropped
+        with self._lock:
+            self._invalidations += int(dropped)
+        return int(dropped)
+
+    def stats(self):
+        """`stats` returns a snapshot of the cache usage for monitoring
+        (`hits`, `disk_hits` and `misses` count periods, `tails` the
+        live queries of the open periods).
+        """
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                'periods': len(self._periods),
+                'rows': self._rows,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_ratio': float(self._hits + self._disk_hits) / lookups if lookups else 0.0,
+                'tails': self._tails,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
@@ -1,249 +1,374 @@
-import psycopg2
-import psycopg2.extras
+import time
 from decimal import Decimal, ROUND_UP
 from datetime import datetime, timedelta, date
 
-from settings import DB_CONN_STRING
+from . import money
+from .instrument import instrumented
 
-from exceptions import (
+from .exceptions import (
     InvalidPayment, InvalidWithdrawal,
     WithdrawalDenied, InvalidParameterValue, SystemFailed,
-    InvalidOutstandingInvocation
+    InvalidOutstandingInvocation, AccountNotFound
 )
 
+def check_terms(apr, limit, period):
+    """`check_terms` validates the terms of a credit line.
+    """
+    # check for apr validity
+    if apr <= Decimal('0.000'):
+        raise InvalidParameterValue("Invalid apr value")
+
+    # check for credit limit validity
+    if limit <= Decimal('0.000'):
+        raise InvalidParameterValue("Invalid credit limit value")
+
+    # check for payment period
+    if period <= 0:
+        raise InvalidParameterValue("Invalid payment period value")
+
+def as_datetime(value):
+    """`as_datetime` turns a date into a datetime at midnight
+    (datetimes are returned as they are).
+    """
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    return value
+
+def round_up(amount):
+    """`round_up` rounds an amount up to two decimals (away from zero,
+    like `money.round_up` on minor units).
+    """
+    return amount.quantize(Decimal('.01'), rounding=ROUND_UP)
+
+def statement_range(start_date, end_date):
+    """`statement_range` fills in the default range of a statement:
+    from the beginning of time until the end of today.
+    """
+    start_date = start_date or date(day=1,month=1,year=1970)
+    end_date = end_date or (date.today() + timedelta(days=1))
+    return start_date, end_date
+
+def check_period(today, previous_eot, period):
+    """`check_period` checks if we are running the outstanding
+    computation on the correct day (after the period).
+    """
+    # NOTE: this check basically acts as a sanity check to make sure the function
+    # cannot be run multiple times on the system and create inconsistencies.
+    if (today - previous_eot).days < period:
+        # we haven't yet passed the number of days specified in the period. Wait.
+        raise InvalidOutstandingInvocation(
+            "Outstanding should be calcualted once a %d day period is complete" % period
+        )
+
+def eot_description(interest, period):
+    return 'added interest of %s USD on the due amount past %s day payment period' % (interest, period)
+
 class CreditManager(object):
     """`CreditManager` class provides a simple mechanism to
     manage credit without understanding the lower level details
     of how the credit management works.
+
+    The accounts are stored by a backend (see `cmanager.backends`),
+    Postgres unless another one is given; a `ShardedBackend` spreads them
+    over several databases (see `cmanager.backends.sharded`). With an `Instrumentation` (see
+    `cmanager.instrument`), every public call (but the lazy
+    `iter_statement`) is timed along with the queries it runs. With a
+    `WriteBuffer` (see `cmanager.buffer`), the payments and withdrawals
+    are committed in batches along with the ones of other managers. With
+    a `StatementCache` (see `cmanager.cache`), the statements of the
+    closed periods are only read once. With a `ReplicaSet` (see
+    `cmanager.replica`), `get_current_due` and `get_statement` read from
+    the replicas, but for `read_your_writes` seconds after a write made
+    through this manager.
     """
-    
-    def __init__(self, apr, limit, period):
-        try:
-            # get a connection to database.
-            conn = psycopg2.connect(DB_CONN_STRING)
-        except Exception as e:
-            raise SystemFailed(e.message)
-        
-        # NOTE: this ideally should not be done and instead each
-        # transaction has to be handled based on the application
-        # logic. Since we know that there will not be many
-        # simultaneous connections to the database in our usecase,
-        # it is okay to autocommit each SQL query to simply some code.
-        conn.autocommit = True
-                    
-        # get the cursor object to make queries
-        self.cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        # check for apr validity
-        if apr <= Decimal('0.000'):
-            raise InvalidParameterValue("Invalid apr value")
-        self.apr = apr
 
-        # check for credit limit validity
-        if limit <= Decimal('0.000'):
-            raise InvalidParameterValue("Invalid credit limit value")
-        self.limit = limit
+    def __init__(self, account_id, apr, limit, period, pool=None, backend=None,
+                 instrumentation=None, buffer=None, cache=None, replicas=None,
+                 read_your_writes=None):
+        if backend is None:
+            # NOTE: imported here so that psycopg2 is only needed
+            # when the Postgres backend is actually used.
+            from .backends.postgres import PostgresBackend
+            backend = PostgresBackend(pool)
+        self.backend = backend
+        self.instrumentation = instrumentation
+        # payments and withdrawals go through the buffer, when given.
+        self.writer = buffer or backend
+        self.cache = cache
+        self.replicas = replicas
+        if read_your_writes is not None and read_your_writes < 0:
+            raise InvalidParameterValue("Invalid read your writes window")
+        self.read_your_writes = read_your_writes
+        self._last_write = None  # time of the latest write of this manager
 
-        # check for payment period
-        if period <= 0:
-            raise InvalidParameterValue("Invalid payment period value")
+        # every operation below is scoped to this credit account.
+        self.account_id = account_id
+
+        check_terms(apr, limit, period)
+        self.apr = apr
+        self.limit = limit
         self.period = period
 
+    def _wrote(self):
+        """`_wrote` records a write of this manager (see `_read`).
+        """
+        self._last_write = time.time()
+
+    def _read(self, function, *args):
+        """`_read` runs a read-only function on a replica unless this
+        manager wrote within the read your writes window, and on the
+        primary without a usable replica, or should the replica fail or
+        not know the account yet (eg. just opened).
+        """
+        replica = None
+        if self.replicas is not None:
+            last_write = self._last_write
+            if (self.read_your_writes is None or last_write is None or
+                    time.time() - last_write >= self.read_your_writes):
+                replica = self.replicas.pick()
+        if replica is not None:
+            try:
+                return function(*args, backend=replica)
+            except InvalidParameterValue:
+                pass  # eg. AccountNotFound, the primary tells
+            except Exception as e:
+                self.replicas.failed(replica, e)
+        return function(*args, backend=self.backend)
+
+    def _get_head(self, backend=None):
+        """`_get_head` fetches the head record of the account.
+        """
+        head = (backend or self.backend).get_head(self.account_id)
+        if head is None:
+            raise AccountNotFound("Account %s does not exist" % self.account_id)
+        return head
+
+    def _get_balance(self, as_of=None, backend=None):
+        """`_get_balance` fetches the balance of the account
+        as of the given time (or the latest one).
+        """
+        backend = backend or self.backend
+        if as_of is None:
+            # the head record always holds the latest balance.
+            return self._get_head(backend)['balance']
+
+        balance = backend.get_balance(self.account_id, as_of)
+        if balance is None:
+            # no transaction before as_of; tell apart an unknown account.
+            self._get_head(backend)
+            raise InvalidParameterValue("No balance as of %s" % as_of)
+        return balance
+
+    @instrumented
+    def open_account(self, tstamp=None):
+        """`open_account` creates the account head record (which also
+        keeps the terms of the credit line) along with the opening
+        balance transaction of the account.
+        """
+        tstamp = tstamp or date.today()
+        self._wrote()
+        self.backend.open_account(self.account_id, self.apr, self.limit, self.period, tstamp)
+
+    @instrumented
     def pay(self, amount, description, tstamp=None):
         """`pay` will create a transaction indicating
-        a payment made to the user's credit.
+        a payment made to the user's credit. A backdated payment
+        rebalances the later transactions; one before the last eot
+        (in a closed period) raises `PeriodClosed`.
         """
         # check if the amount is valid
         if amount <= Decimal('0.000'):
             raise InvalidPayment("Payment amount should be greater than 0.000 USD")
+        if not money.in_minor_units(amount):
+            raise InvalidPayment("Payment amounts have at most 6 decimals")
 
         # insert the transaction into the database.
         tstamp = tstamp or datetime.now()
-        self.cursor.execute("""
-            INSERT INTO 
-                transaction (tstamp, amount, balance, description, type)
-            VALUES ('%s', %s, (
-                SELECT 
-                    balance
-                FROM
-                    transaction
-                ORDER BY 
-                    tstamp 
-                DESC LIMIT 1) + %s, '%s', 'payment');
-        """ % (tstamp, amount, amount, description))
+        self._wrote()
+        posted = self.writer.post(self.account_id, amount, description, tstamp, 'payment', False)
+        if not posted:
+            # a payment is never denied; whatever happened, it is not in.
+            raise SystemFailed("Payment could not be posted")
+        if self.cache is not None:
+            self.cache.invalidate(self.account_id, tstamp)
 
+    @instrumented
     def withdraw(self, amount, description, tstamp=None):
         """`withdraw` will create a transaction indicating
-        a withdrawal from the user's credit.
+        a withdrawal from the user's credit. Like `pay`, it may be
+        backdated within the current period (the credit limit is
+        checked against the latest balance).
         """
         # check if the amount is valid
         if amount <= Decimal('0.000'):
             raise InvalidWithdrawal("Withdrawal amount should be greater than 0.000 USD")
+        if not money.in_minor_units(amount):
+            raise InvalidWithdrawal("Withdrawal amounts have at most 6 decimals")
 
-        # check if this withdrawal will take the user below the accepted limit.
-        self.cursor.execute("""
-            SELECT 
-                balance 
-            FROM 
-                transaction 
-            ORDER BY 
-                tstamp 
-            DESC LIMIT 1;""")
-        balance = self.cursor.fetchone()['balance']
-        if (balance - amount) < Decimal('0.0000'):
+        # insert the transaction into the database unless this withdrawal
+        # takes the user below the accepted limit (checked atomically).
+        tstamp = tstamp or datetime.now()
+        self._wrote()
+        posted = self.writer.post(self.account_id, -amount, description, tstamp, 'withdrawal', True)
+        if not posted:
             # yes, this withdrawal will take the user below the accepted limit.
             raise WithdrawalDenied("Withdrawal crosses the credit limit - Denied")
+        if self.cache is not None:
+            self.cache.invalidate(self.account_id, tstamp)
 
-        # insert the transaction into the database.
-        tstamp = tstamp or datetime.now()
-        self.cursor.execute("""
-            INSERT INTO 
-                transaction (tstamp, amount, balance, description, type)
-            VALUES ('%s', %s, (
-                SELECT 
-                    balance 
-                FROM 
-                    transaction 
-                ORDER BY 
-                    tstamp 
-                DESC LIMIT 1) - %s, '%s', 'withdrawal');
-        """ % (tstamp, -amount, amount, description))
+    @instrumented
+    def import_transactions(self, rows):
+        """`import_transactions` bulk loads historical (tstamp, amount,
+        type, description) rows, eg. from `importer.read_csv`, into the
+        ledger of the account in a single transaction and returns a
+        report with the number of rows imported per second. Amounts
+        are validated like in `pay` and `withdraw`.
+        """
+        self._wrote()
+        return self.backend.import_transactions(self.account_id, rows)
 
+    @instrumented
     def get_current_due(self, as_of=None):
         """`get_current_due` computes the amount due in the user's
-        credit account at any point of time.
-        """
-        # fetch the balance from the database
-        as_of = as_of or (date.today() + timedelta(days=1))
-        self.cursor.execute("""
-            SELECT
-                balance
-            FROM
-                transaction
-            WHERE 
-                tstamp < '%s' 
-            ORDER BY 
-                tstamp 
-            DESC LIMIT 1;
-        """ % as_of)
+        credit account at any point of time (from a replica, if any).
+        """
+        balance = self._read(self._get_balance, as_of)
 
         # compute the due from the balance and return it (rount to two decimals)
-        return (self.limit - self.cursor.fetchone()['balance']).quantize(Decimal('.01'), rounding=ROUND_UP)
+        return round_up(self.limit - balance)
 
+    @instrumented
     def compute_outstanding(self, as_of=None):
-        """`compute_outstanding` runs at the intervals 
-        defined by the user's payment period and computes 
-        the interest and hence the total outstanding.
+        """`compute_outstanding` runs at the intervals
+        defined by the user's payment period and computes
+        the interest and hence the total outstanding. The
+        interest is exact, rounded up to a micro-dollar (see
+        `cmanager.money`), and the outstanding up to the cent.
         """
-        interest = Decimal('0.000')
+        interest = 0  # in minor units
+        today = as_datetime(as_of or date.today())
 
         # fetch the day on which the previous outstanding was computed.
-        self.cursor.execute("""
-            SELECT 
-                tstamp 
-            FROM 
-                transaction 
-            WHERE 
-                type='eot' 
-            ORDER BY 
-                tstamp 
-            LIMIT 1;
-        """);
-        previous_eot = self.cursor.fetchone()['tstamp']
-
-        # check if we are running this function on the correct day (after the period)
-        # NOTE: this check basically acts as a sanity check to make sure the function
-        # cannot be run multiple times on the system and create inconsistencies.
-        today = as_of or date.today()
-        if (today - previous_eot).days < self.period:
-            # we haven't yet passed the number of days specified in the period. Wait.
-            raise InvalidOutstandingInvocation(
-                "Outstanding should be calcualted once a %d day period is complete" % self.period
-            )
+        previous_eot = self._get_head()['last_eot']
+        check_period(today, previous_eot, self.period)
 
         # compute the due for the current day (NOTE: this is total due).
-        due = self.get_current_due(today)
-        
-        # get the total balance at the end of previous eot day.
-        self.cursor.execute("""
-            SELECT 
-                balance 
-            FROM 
-                transaction 
-            WHERE 
-                tstamp < '%s' 
-            ORDER BY 
-                tstamp 
-            DESC LIMIT 1
-        """ % (previous_eot + timedelta(days=1)))
-        # compute the current outstanding based on the balance.
-        outstanding = self.limit - self.cursor.fetchone()['balance']
-        
+        due = round_up(self.limit - self._get_balance(today))
+
+        # compute the current outstanding based on the total
+        # balance at the end of previous eot day.
+        outstanding = self.limit - self._get_balance(previous_eot + timedelta(days=1))
+
         if outstanding > Decimal('0.000'):
-            # check if the payment has been made in this month to clear things off.
-            self.cursor.execute("""
-                SELECT 
-                    SUM(amount) AS amounts 
-                FROM 
-                    transaction 
-                WHERE 
-                    type='payment' AND tstamp >= '%s' 
-                LIMIT 1;
-            """ % previous_eot)
-            # fetch the total payment this month
-            payments = self.cursor.fetchone()['amounts']
-            if payments < outstanding:
+            period = self.backend.period_summary(self.account_id, self.limit, previous_eot, today)
+            if period['payments'] < outstanding:
                 # not all outstanding has been cleared.
-                # start to compute the interest that needs to be computed.
-                self.cursor.execute("""
-                    SELECT 
-                        balance, tstamp 
-                    FROM 
-                        transaction 
-                    WHERE 
-                        tstamp >= '%s' 
-                    ORDER BY 
-                        tstamp;
-                """ % previous_eot)
-                prev_transaction = self.cursor.next()
-                for transaction in self.cursor:
-                    # compute the due for this period.
-                    due = self.limit - prev_transaction['balance']
-                    # compute the interest for this period
-                    interest += (transaction['tstamp'].date() - prev_transaction['tstamp'].date()).days * (self.apr/Decimal('365.00')) * due
-                    prev_transaction = transaction
-
-                # finally compute from the last transaction until current
-                due = self.limit - prev_transaction['balance']
-                interest += (as_of.date() - prev_transaction['tstamp'].date()).days * (self.apr/Decimal('365.00')) * due
-
-        # write a record for this outstanding calculation
-        description = 'added interest of %s USD on the due amount past %s day payment period' % (interest, self.period)
-        self.cursor.execute("""
-            INSERT INTO 
-                transaction (tstamp, amount, balance, description, type) 
-            VALUES ('%s', 0, %s, '%s', 'eot');
-        """ % (today, interest+due, description))
+                # compute the interest on the day weighted due.
+                interest = money.interest(self.apr, period['weighted_due'])
+                due = self.limit - period['last_balance']
+
+        # write a record for this outstanding calculation.
+        interest = money.from_minor(interest)
+        self._wrote()
+        closed = self.backend.close_period(
+            self.account_id, previous_eot, today, interest,
+            eot_description(interest, self.period)
+        )
+        if not closed:
+            raise InvalidOutstandingInvocation(
+                "Outstanding has already been calculated for this period"
+            )
 
         # round to two decimals
-        return (interest + due).quantize(Decimal('.01'), rounding=ROUND_UP)
+        return round_up(interest + due)
 
+    @instrumented
+    def project_outstanding(self, scenarios, as_of=None):
+        """`project_outstanding` returns the outstanding which
+        `compute_outstanding` would compute at the end of the current
+        period under each of the given scenarios (see
+        `cmanager.projection.Scenario`: an apr and the payments made
+        meanwhile), without writing anything. Needs NumPy.
+        """
+        # NOTE: imported here so that numpy is only needed for projections.
+        from .projection import Projection
+        return Projection(self, as_of).project(scenarios)
+
+    @instrumented
     def get_statement(self, start_date=None, end_date=None):
         """`get_statement` gets a detailed credit account statement
-        of all the transaction over a time period.
-        """
-        start_date = start_date or date(day=1,month=1,year=1970)
-        end_date = end_date or (date.today() + timedelta(days=1))
-        self.cursor.execute("""
-            SELECT 
-                tstamp, amount, type, description 
-            FROM 
-                transaction 
-            WHERE 
-                tstamp >= '%s' AND tstamp < '%s' 
-            ORDER BY id;
-        """ % (start_date, end_date))
-
-        # return all the results as a list of lists.
-        return self.cursor.fetchall()
+        of all the transaction over a time period (from a replica, if any).
+        """
+        start_date, end_date = statement_range(start_date, end_date)
+        return self._read(self._get_statement, start_date, end_date)
+
+    def _get_statement(self, start_date, end_date, backend=None):
+        backend = backend or self.backend
+        if self.cache is not None:
+            return self.cache.get_statement(backend, self.account_id, start_date, end_date)
+        return backend.get_statement(self.account_id, start_date, end_date)
 
+    def iter_statement(self, start_date=None, end_date=None, fetch_size=1000):
+        """`iter_statement` streams the same statement as `get_statement`,
+        `fetch_size` rows at a time (through a server side cursor with the
+        Postgres backend), so the client memory stays flat regardless of
+        the size of the statement. The connection is held until the
+        iteration completes (or the iterator is closed).
+        """
+        if fetch_size < 1:
+            raise InvalidParameterValue("Invalid fetch size")
+        start_date, end_date = statement_range(start_date, end_date)
+        return self.backend.iter_statement(self.account_id, start_date, end_date, fetch_size)
+
+    @instrumented
+    def get_statement_page(self, start_date=None, end_date=None, after_id=None, page_size=100):
+        """`get_statement_page` gets one page of the statement, starting
+        right after the transaction `after_id` (the `id` of the last row
+        of the previous page, or None for the first page). With Postgres
+        the page is found by walking the `(account_id, id)` index from
+        that key, so every page comes back in constant time however deep
+        it is.
+        """
+        if page_size < 1:
+            raise InvalidParameterValue("Invalid page size")
+        start_date, end_date = statement_range(start_date, end_date)
+        return self.backend.get_statement_page(
+            self.account_id, start_date, end_date, after_id or 0, page_size
+        )
+
+    @instrumented
+    def search_statement(self, text, start_date=None, end_date=None, limit=100):
+        """`search_statement` finds the transactions (up to `limit`, in
+        insertion order) whose description contains the text, case
+        insensitive, eg. a merchant. With Postgres the search runs on the
+        trigram index of the descriptions of the account.
+        """
+        if not text:
+            raise InvalidParameterValue("Invalid search text")
+        if limit < 1:
+            raise InvalidParameterValue("Invalid search limit")
+        start_date, end_date = statement_range(start_date, end_date)
+        return self.backend.search(self.account_id, text, start_date, end_date, limit)
+
+    @instrumented
+    def get_spending(self, start_date=None, end_date=None, text='', limit=None):
+        """`get_spending` totals the withdrawals per description (ie. per
+        merchant) over a time period, the largest first: a list of
+        `description`, `withdrawals` (their number) and `spent`, computed
+        by the database. Only the descriptions containing `text` count
+        when given, and only the `limit` largest are returned when given.
+        """
+        if limit is not None and limit < 1:
+            raise InvalidParameterValue("Invalid spending limit")
+        start_date, end_date = statement_range(start_date, end_date)
+        return self.backend.spending(self.account_id, text, start_date, end_date, limit)
+
+    @instrumented
+    def export_statement(self, fileobj, start_date=None, end_date=None, format='csv'):
+        """`export_statement` writes the statement (with the running
+        balance) to the file like object `fileobj` as CSV (`csv`) or JSON
+        lines (`jsonl`); with Postgres straight from the database using
+        `COPY`.
+        """
+        start_date, end_date = statement_range(start_date, end_date)
+        self.backend.export(fileobj, [self.account_id], start_date, end_date, format)
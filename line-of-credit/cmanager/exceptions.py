@@ -15,3 +15,15 @@ class WithdrawalDenied(Exception):
 
 class InvalidOutstandingInvocation(Exception):
     pass
+
+class AccountNotFound(InvalidParameterValue):
+    pass
+
+class PeriodClosed(InvalidParameterValue):
+    pass
+
+class PoolTimeout(SystemFailed):
+    pass
+
+class UncertainCommit(SystemFailed):
+    pass
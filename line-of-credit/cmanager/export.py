@@ -0,0 +1,79 @@
+import psycopg2.extensions
+from datetime import date, timedelta
+
+from .settings import DB_CONN_STRING, MONEY_MINOR_UNITS
+from .pool import ConnectionPool
+from .money import DIGITS
+from .queries import COLUMNS, FORMATS
+
+from .exceptions import InvalidParameterValue
+
+def _copy_sql(cursor, account_ids, start_date, end_date, format, minor_units=False):
+    """`_copy_sql` builds the `COPY ... TO STDOUT` statement exporting the
+    ledger of the given accounts (all of them for None) over a time range.
+    The amounts stored as minor units are exported in dollars.
+    """
+    if format not in FORMATS:
+        raise InvalidParameterValue("Invalid export format %s" % format)
+    start_date = start_date or date(day=1,month=1,year=1970)
+    end_date = end_date or (date.today() + timedelta(days=1))
+
+    params = (start_date, end_date)
+    accounts = ''
+    if account_ids is not None:
+        accounts = 'account_id = ANY(%s) AND'
+        params = (list(account_ids),) + params
+
+    columns = list(COLUMNS)
+    if minor_units:
+        columns = [
+            'ROUND(%s / 1e%d, %d) AS %s' % (column, DIGITS, DIGITS, column)
+            if column in ('amount', 'balance') else column for column in columns
+        ]
+
+    # COPY takes no parameters, hence the query is bound on the client.
+    query = cursor.mogrify("""
+        SELECT
+            %s
+        FROM
+            transaction
+        WHERE
+            %s tstamp >= %%s AND tstamp < %%s
+        ORDER BY account_id, id
+    """ % (', '.join(columns), accounts), params)
+    if not isinstance(query, str):
+        # python 3: mogrify returns the query encoded for the connection.
+        query = query.decode(psycopg2.extensions.encodings[cursor.connection.encoding])
+
+    if format == 'csv':
+        return "COPY (%s) TO STDOUT WITH CSV HEADER" % query
+
+    # one JSON document per line. The rows are written as a single column
+    # CSV with quote and delimiter characters that never appear in JSON so
+    # that COPY writes them verbatim (the text format would escape them).
+    return "COPY (SELECT row_to_json(ledger) FROM (%s) AS ledger) TO STDOUT WITH CSV QUOTE E'\\x01' DELIMITER E'\\x02'" % query
+
+def copy_ledger(cursor, fileobj, account_ids=None, start_date=None, end_date=None, format='csv',
+                minor_units=MONEY_MINOR_UNITS):
+    """`copy_ledger` streams the ledger straight from the database to the
+    file like object `fileobj` using `COPY`; no row is ever turned into a
+    Python object on the way.
+    """
+    cursor.copy_expert(_copy_sql(cursor, account_ids, start_date, end_date, format, minor_units), fileobj)
+
+def export_ledger(fileobj, account_ids=None, start_date=None, end_date=None, format='csv', pool=None):
+    """`export_ledger` writes the ledger of many accounts at once (or of
+    all the accounts for None) as CSV (`csv`) or JSON lines (`jsonl`).
+    """
+    owned = pool is None
+    pool = pool or ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+    try:
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                copy_ledger(cursor, fileobj, account_ids, start_date, end_date, format)
+            finally:
+                cursor.close()
+    finally:
+        if owned:
+            pool.closeall()
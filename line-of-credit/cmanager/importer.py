@@ -0,0 +1,184 @@
+import csv
+import time
+from decimal import Decimal, InvalidOperation
+from datetime import datetime
+
+from . import queries
+from .money import in_minor_units, to_minor, from_minor
+from .settings import MONEY_MINOR_UNITS
+
+from .exceptions import (
+    InvalidPayment, InvalidWithdrawal, InvalidParameterValue, AccountNotFound
+)
+
+# transaction types accepted by the importer and the sign of their amount.
+SIGNS = {'payment': 1, 'withdrawal': -1}
+
+def parse_tstamp(value):
+    """`parse_tstamp` parses a timestamp as written by Postgres
+    (with or without the fractional seconds).
+    """
+    for fmt in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise InvalidParameterValue("Invalid timestamp %s" % value)
+
+def read_csv(fileobj):
+    """`read_csv` reads (tstamp, amount, type, description) rows
+    from a CSV file with a header line naming those columns.
+    """
+    for row in csv.DictReader(fileobj):
+        try:
+            amount = Decimal(row['amount'])
+        except InvalidOperation:
+            raise InvalidParameterValue("Invalid amount %s" % row['amount'])
+        yield parse_tstamp(row['tstamp']), amount, row['type'], row['description']
+
+def validate(tstamp, amount, type, last_tstamp):
+    """`validate` checks an imported row against the rules of `pay` and
+    `withdraw` and that it comes after `last_tstamp` (the latest
+    transaction of the account, or the previous imported row).
+    """
+    if type not in SIGNS:
+        raise InvalidParameterValue("Invalid transaction type %s" % type)
+    if type == 'payment' and amount <= Decimal('0.000'):
+        raise InvalidPayment("Payment amount should be greater than 0.000 USD")
+    if type == 'withdrawal' and amount <= Decimal('0.000'):
+        raise InvalidWithdrawal("Withdrawal amount should be greater than 0.000 USD")
+    if not in_minor_units(amount):
+        raise InvalidParameterValue("Imported amounts have at most 6 decimals")
+    if tstamp < last_tstamp:
+        raise InvalidParameterValue(
+            "Imported transactions must be in chronological order "
+            "and after the latest transaction of the account"
+        )
+
+class LedgerStream(object):
+    """`LedgerStream` turns the imported rows into the CSV input of
+    `COPY FROM` lazily, computing the running balance on the way, so
+    that the whole import is a single streaming pass over the rows.
+    With `minor_units`, the amounts are written (and the balance kept)
+    as minor units.
+    """
+
+    def __init__(self, account_id, rows, balance, last_tstamp, minor_units=False):
+        self.account_id = account_id
+        self.minor_units = minor_units
+        self.rows = iter(rows)
+        self.balance = balance
+        self.last_tstamp = last_tstamp
+        self.count = 0
+        # the daily rollup of the imported rows, by day.
+        self.days = {}
+        # set when a row is rejected; the COPY is then cut short.
+        self.error = None
+        self._buffer = []
+        self._size = 0
+        self._writer = csv.writer(self, lineterminator='\n')
+
+    def write(self, data):
+        # called by the csv writer with the formatted lines.
+        self._buffer.append(data)
+        self._size += len(data)
+
+    def _roll_up(self, tstamp, amount, type):
+        day = tstamp.date()
+        rollup = self.days.get(day)
+        if rollup is None:
+            rollup = self.days[day] = {
+                'account_id': self.account_id, 'day': day, 'payments': Decimal('0'),
+            }
+        # the rows are chronological: the latest one closes the day.
+        rollup['tstamp'] = tstamp
+        rollup['balance'] = self.balance
+        if type == 'payment':
+            rollup['payments'] += amount
+
+    def read(self, size=8192):
+        # called by COPY for the next chunk of input.
+        while self._size < size and self.error is None:
+            try:
+                tstamp, amount, type, description = next(self.rows)
+            except StopIteration:
+                break
+            try:
+                validate(tstamp, amount, type, self.last_tstamp)
+            except InvalidParameterValue as e:
+                self.error = e
+                break
+            amount = SIGNS[type] * (to_minor(amount) if self.minor_units else amount)
+            self.balance += amount
+            self.last_tstamp = tstamp
+            self.count += 1
+            self._roll_up(tstamp, amount, type)
+            self._writer.writerow([self.account_id, tstamp, amount, self.balance, description, type])
+
+        data = ''.join(self._buffer)
+        self._buffer, self._size = [], 0
+        return data
+
+def import_transactions(conn, account_id, rows, minor_units=MONEY_MINOR_UNITS):
+    """`import_transactions` loads the (tstamp, amount, type, description)
+    rows into the ledger of an account with `COPY FROM` and moves the
+    account head and the daily rollup, all in a single transaction:
+    either every row is imported or none is. The rows have to be in chronological order and
+    after the latest transaction of the account. Returns a report with
+    the number of rows imported, the time taken and the rows per second.
+    Pass `minor_units` for a schema storing the amounts as minor units.
+    """
+    start = time.time()
+    conn.autocommit = False
+    try:
+        cursor = conn.cursor()
+
+        # lock the head so that no write interleaves with the import.
+        cursor.execute("""
+            SELECT
+                balance, last_tstamp
+            FROM
+                account
+            WHERE
+                id = %s
+            FOR UPDATE;
+        """, (account_id,))
+        head = cursor.fetchone()
+        if head is None:
+            raise AccountNotFound("Account %s does not exist" % account_id)
+
+        stream = LedgerStream(account_id, rows, head[0], head[1], minor_units)
+        cursor.copy_expert("""
+            COPY
+                transaction (account_id, tstamp, amount, balance, description, type)
+            FROM STDIN WITH CSV
+        """, stream)
+        if stream.error is not None:
+            raise stream.error
+
+        # one upsert per imported day.
+        cursor.executemany(queries.ROLLUP_UPSERT, sorted(stream.days.values(), key=lambda day: day['day']))
+
+        cursor.execute("""
+            UPDATE
+                account
+            SET
+                balance = %s,
+                last_tstamp = %s
+            WHERE
+                id = %s;
+        """, (stream.balance, stream.last_tstamp, account_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+    elapsed = time.time() - start
+    return {
+        'rows': stream.count,
+        'balance': from_minor(stream.balance) if minor_units else stream.balance,
+        'elapsed': elapsed,
+        'rows_per_sec': stream.count / elapsed if elapsed > 0 else 0.0,
+    }
@@ -0,0 +1,250 @@
+import time
+import logging
+import threading
+from bisect import bisect_left
+from functools import wraps
+from contextlib import contextmanager
+
+# Instrumentation of the credit managers: every public call of an
+# instrumented `CreditManager` is recorded as an `Operation` (wall time,
+# the queries it ran with their duration and the rows they returned) and
+# handed to the sinks of its `Instrumentation`. The backend attaches the
+# queries to the operation running on its thread (see `current`).
+
+logger = logging.getLogger('cmanager')
+
+_local = threading.local()
+
+class Query(object):
+    """`Query` is a statement run on behalf of an operation.
+    """
+
+    def __init__(self, name, elapsed, rows, plan=None):
+        self.name = name
+        self.elapsed = elapsed
+        self.rows = rows
+        self.plan = plan  # the EXPLAIN ANALYZE output of a slow query
+
+class Operation(object):
+    """`Operation` is the record of one call of a public method of a
+    credit manager.
+    """
+
+    def __init__(self, instrumentation, method, account_id):
+        self.instrumentation = instrumentation
+        self.method = method
+        self.account_id = account_id
+        self.elapsed = None
+        self.error = None
+        self.queries = []
+
+    @property
+    def rows(self):
+        return sum(query.rows for query in self.queries)
+
+    def as_dict(self):
+        return {
+            'method': self.method,
+            'account_id': self.account_id,
+            'elapsed': self.elapsed,
+            'error': self.error,
+            'queries': len(self.queries),
+            'rows': self.rows,
+            'query_times': [(query.name, query.elapsed) for query in self.queries],
+        }
+
+def current():
+    """`current` is the operation running on this thread, if any.
+    """
+    return getattr(_local, 'operation', None)
+
+@contextmanager
+def query(name, cursor=None):
+    """`query` times the statement run within the block and adds it to
+    the current operation, along with the rows it returned (the
+    `rowcount` of the cursor, when given).
+    """
+    operation = current()
+    if operation is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        rows = cursor.rowcount if cursor is not None and cursor.rowcount > 0 else 0
+        operation.queries.append(Query(name, elapsed, rows))
+
+def slow_query():
+    """`slow_query` is the last query of the current operation if it ran
+    slower than the slow query threshold (hence needs its plan
+    captured), None otherwise.
+    """
+    operation = current()
+    if operation is None or operation.instrumentation.slow_query is None or not operation.queries:
+        return None
+    last = operation.queries[-1]
+    return last if last.elapsed >= operation.instrumentation.slow_query else None
+
+class Instrumentation(object):
+    """`Instrumentation` hands the operations of the credit managers
+    using it to its sinks. With `slow_query` (in seconds) set, the
+    Postgres backend captures the `EXPLAIN ANALYZE` output of the queries
+    running slower than that (running them a second time, writes within a
+    transaction rolled back).
+    """
+
+    def __init__(self, sinks=None, slow_query=None):
+        self.sinks = list(sinks or [])
+        self.slow_query = slow_query
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def record(self, operation):
+        for sink in self.sinks:
+            try:
+                sink.record(operation)
+            except Exception:
+                # a broken sink never fails the operation.
+                logger.exception('instrumentation sink %r failed', sink)
+
+def instrumented(method):
+    """`instrumented` records the calls of a public method of a credit
+    manager with its instrumentation (if any). Calls made while another
+    operation runs on the thread are part of that operation.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if instrumentation is None or current() is not None:
+            return method(self, *args, **kwargs)
+
+        operation = Operation(instrumentation, method.__name__, self.account_id)
+        _local.operation = operation
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        except Exception as e:
+            operation.error = e.__class__.__name__
+            raise
+        finally:
+            operation.elapsed = time.time() - start
+            _local.operation = None
+            instrumentation.record(operation)
+    return wrapper
+
+class LogSink(object):
+    """`LogSink` logs every operation (and the plan of its slow queries).
+    """
+
+    def __init__(self, logger=logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def record(self, operation):
+        self.logger.log(
+            self.level, '%s account=%s elapsed=%.3fms queries=%d rows=%d%s',
+            operation.method, operation.account_id, 1000 * operation.elapsed,
+            len(operation.queries), operation.rows,
+            ' error=%s' % operation.error if operation.error else ''
+        )
+        for query in operation.queries:
+            if query.plan is not None:
+                self.logger.warning('slow query %s (%.3fms) in %s:\n%s',
+                                    query.name, 1000 * query.elapsed, operation.method, query.plan)
+
+class CallbackSink(object):
+    """`CallbackSink` calls a function with every operation.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, operation):
+        self.callback(operation)
+
+# upper bounds of the histogram buckets, in milliseconds.
+BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+class Histogram(object):
+    """`Histogram` counts durations in the buckets of `BUCKETS` (the
+    last one holding everything slower).
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        ms = 1000 * elapsed
+        self.counts[bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction):
+        """`percentile` is the upper bound (in milliseconds) of the
+        bucket holding the given percentile.
+        """
+        rank, seen = fraction * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max,
+        }
+
+class HistogramSink(object):
+    """`HistogramSink` keeps in process latency histograms of every
+    method and of every query, along with the query and row counts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.methods = {}
+        self.queries = {}
+        self.query_counts = {}
+        self.rows = {}
+        self.errors = {}
+
+    def record(self, operation):
+        with self._lock:
+            method = operation.method
+            self.methods.setdefault(method, Histogram()).add(operation.elapsed)
+            self.query_counts[method] = self.query_counts.get(method, 0) + len(operation.queries)
+            self.rows[method] = self.rows.get(method, 0) + operation.rows
+            if operation.error:
+                self.errors[method] = self.errors.get(method, 0) + 1
+            for query in operation.queries:
+                self.queries.setdefault(query.name, Histogram()).add(query.elapsed)
+
+    def snapshot(self):
+        """`snapshot` summarizes the histograms by method and by query.
+        """
+        with self._lock:
+            methods = {}
+            for method, histogram in self.methods.items():
+                methods[method] = histogram.summary()
+                methods[method].update({
+                    'queries': self.query_counts[method],
+                    'rows': self.rows[method],
+                    'errors': self.errors.get(method, 0),
+                })
+            return {
+                'methods': methods,
+                'queries': dict((name, histogram.summary()) for name, histogram in self.queries.items()),
+            }
@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from .exceptions import InvalidParameterValue
+
+# Amounts as integer minor units: a count of micro-dollars (1e-6 USD),
+# which fits a 64 bit integer (a BIGINT column) up to about 9.2e12 USD.
+# Converting an amount is exact, or refused: an amount finer than a
+# micro-dollar has no minor unit representation.
+#
+# Rounding: `round_up` is `Decimal.quantize(Decimal('.01'), ROUND_UP)`
+# on integers, ie. to the cent away from zero (-0.001 USD is -0.01 USD).
+# The interest of a period is rounded up to a micro-dollar the same way
+# (see `interest`); rounding it up to the cent afterwards gives the very
+# cent the exact interest rounds up to, since every cent is a whole
+# number of micro-dollars.
+
+DIGITS = 6
+UNITS = 10 ** DIGITS  # minor units per dollar
+CENT = UNITS // 100  # minor units per cent
+DAYS_IN_YEAR = 365
+
+def in_minor_units(amount):
+    """`in_minor_units` tells if an amount is a whole number
+    of minor units.
+    """
+    return amount.scaleb(DIGITS) == amount.scaleb(DIGITS).to_integral_value()
+
+def to_minor(amount):
+    """`to_minor` turns an amount in dollars (a `Decimal`) into
+    minor units.
+    """
+    if not in_minor_units(amount):
+        raise InvalidParameterValue("Amount %s is finer than a micro-dollar" % amount)
+    return int(amount.scaleb(DIGITS))
+
+def from_minor(units):
+    """`from_minor` turns minor units into an amount in dollars
+    (a `Decimal` with 6 decimals).
+    """
+    return Decimal(units).scaleb(-DIGITS)
+
+def _divide_up(numerator, denominator):
+    """`_divide_up` divides integers rounding away from zero
+    (the denominator is positive).
+    """
+    if numerator < 0:
+        return -((-numerator + denominator - 1) // denominator)
+    return (numerator + denominator - 1) // denominator
+
+def round_up(units, step=CENT):
+    """`round_up` rounds minor units away from zero to a multiple
+    of `step` (a cent by default).
+    """
+    return _divide_up(units, step) * step
+
+def to_cents(units):
+    """`to_cents` rounds minor units up to the cent (see `round_up`)
+    and returns the amount in dollars with 2 decimals, ie. what
+    `cmanager.round_up` returns for the same amount.
+    """
+    return Decimal(round_up(units) // CENT).scaleb(-2)
+
+def _scaled(value):
+    """`_scaled` splits a `Decimal` into an integer and a number of
+    decimals (value = integer / 10 ** decimals), exactly.
+    """
+    sign, digits, exponent = Decimal(value).as_tuple()
+    integer = 0
+    for digit in digits:
+        integer = integer * 10 + digit
+    if sign:
+        integer = -integer
+    if exponent >= 0:
+        return integer * 10 ** exponent, 0
+    return integer, -exponent
+
+def interest(apr, weighted_due):
+    """`interest` is the interest at `apr` on the day weighted due of a
+    period (the sum of the due of every day, in dollars), in minor units
+    rounded up (away from zero). It is computed exactly on integers,
+    whatever the precision of the `Decimal` arguments.
+    """
+    apr, apr_decimals = _scaled(apr)
+    due, due_decimals = _scaled(weighted_due)
+    # apr * due * UNITS / 365, a single division rounded up.
+    return _divide_up(apr * due * UNITS, DAYS_IN_YEAR * 10 ** (apr_decimals + due_decimals))
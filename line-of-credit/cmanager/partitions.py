@@ -0,0 +1,171 @@
+import sys
+import argparse
+from datetime import datetime, date
+
+from .settings import DB_CONN_STRING, PARTITION_MONTHS_AHEAD
+from .pool import ConnectionPool
+from .cmanager import as_datetime
+
+from .exceptions import InvalidParameterValue
+
+# The transaction table is range partitioned by month on `tstamp` (see
+# `bootstrap.sql`); rows of a month without a partition land in the
+# default partition until `ensure_partitions` gives the month its own.
+
+def month_start(value):
+    """`month_start` is the first instant of the month of a date.
+    """
+    return datetime(value.year, value.month, 1)
+
+def next_month(value):
+    if value.month == 12:
+        return datetime(value.year + 1, 1, 1)
+    return datetime(value.year, value.month + 1, 1)
+
+def partition_name(month):
+    return 'transaction_y%04dm%02d' % (month.year, month.month)
+
+def list_partitions(cursor):
+    """`list_partitions` lists the (name, lower bound, upper bound) of the
+    monthly partitions attached to the transaction table, oldest first.
+    """
+    cursor.execute("""
+        SELECT
+            child.relname
+        FROM
+            pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE
+            pg_inherits.inhparent = 'transaction'::regclass;
+    """)
+    partitions = []
+    for (name,) in cursor.fetchall():
+        try:
+            month = datetime.strptime(name, 'transaction_y%Ym%m')
+        except ValueError:
+            continue  # the default partition
+        partitions.append((name, month, next_month(month)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def _create_partition(cursor, month):
+    name, upper = partition_name(month), next_month(month)
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM transaction_default WHERE tstamp >= %s AND tstamp < %s
+        );
+    """, (month, upper))
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            "CREATE TABLE %s PARTITION OF transaction FOR VALUES FROM (%%s) TO (%%s);" % name,
+            (month, upper)
+        )
+        return
+
+    # the month already has rows in the default partition: move them to
+    # the new table before attaching it (attaching checks the default
+    # partition holds no row of the month anymore).
+    cursor.execute("CREATE TABLE %s (LIKE transaction INCLUDING DEFAULTS INCLUDING CONSTRAINTS);" % name)
+    cursor.execute("""
+        WITH moved AS (
+            DELETE FROM transaction_default WHERE tstamp >= %%s AND tstamp < %%s RETURNING *)
+        INSERT INTO %s SELECT * FROM moved;
+    """ % name, (month, upper))
+    cursor.execute(
+        "ALTER TABLE transaction ATTACH PARTITION %s FOR VALUES FROM (%%s) TO (%%s);" % name,
+        (month, upper)
+    )
+
+def ensure_partitions(conn, start=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """`ensure_partitions` creates the missing monthly partitions from the
+    month of `start` (today by default) up to `months_ahead` months later,
+    in a single transaction, and returns the names of the partitions
+    created. Run it ahead of time (the end of term runner does) so that
+    the new transactions never fall into the default partition.
+    """
+    if months_ahead < 0:
+        raise InvalidParameterValue("Invalid number of months ahead")
+    month = month_start(start or date.today())
+
+    created = []
+    conn.autocommit = False
+    try:
+        cursor = conn.cursor()
+        existing = set(name for name, _, _ in list_partitions(cursor))
+        for _ in range(months_ahead + 1):
+            if partition_name(month) not in existing:
+                _create_partition(cursor, month)
+                created.append(partition_name(month))
+            month = next_month(month)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+    return created
+
+def archivable_partitions(cursor, before=None):
+    """`archivable_partitions` lists the partitions which are closed and
+    fully eot'd: they end before the last eot of every account (hence no
+    open period, nor the balance carried into one, is read from them)
+    and before `before` (if given).
+    """
+    cursor.execute("SELECT MIN(last_eot) FROM account;")
+    oldest_eot = cursor.fetchone()[0]
+    if oldest_eot is None:
+        return []
+    if before is not None:
+        oldest_eot = min(oldest_eot, as_datetime(before))
+    return [name for name, _, upper in list_partitions(cursor) if upper <= oldest_eot]
+
+def archive_partitions(conn, before=None, drop=False):
+    """`archive_partitions` detaches the archivable partitions from the
+    transaction table (see `archivable_partitions`) and returns their
+    names. The detached tables are kept as they are, for auditing or
+    to be dumped elsewhere, unless `drop` is set.
+    """
+    conn.autocommit = False
+    try:
+        cursor = conn.cursor()
+        # no eot may move while the partitions are picked and detached.
+        cursor.execute("LOCK TABLE account IN SHARE MODE;")
+        archived = archivable_partitions(cursor, before)
+        for name in archived:
+            cursor.execute("ALTER TABLE transaction DETACH PARTITION %s;" % name)
+            if drop:
+                cursor.execute("DROP TABLE %s;" % name)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+    return archived
+
+def main(argv=None):
+    """`main` is the command line entry point of the partition maintenance.
+    """
+    parser = argparse.ArgumentParser(
+        description='Create the upcoming monthly partitions of the ledger and archive the closed ones.'
+    )
+    parser.add_argument('--months-ahead', type=int, default=PARTITION_MONTHS_AHEAD,
+                        help='months to create partitions for, after the current one')
+    parser.add_argument('--archive', action='store_true', help='detach the fully eot\'d partitions')
+    parser.add_argument('--before', help='only archive partitions ending before this date (YYYY-MM-DD)')
+    parser.add_argument('--drop', action='store_true', help='drop the archived partitions')
+    parser.add_argument('--dsn', default=DB_CONN_STRING, help='database connection string')
+    args = parser.parse_args(argv)
+
+    pool = ConnectionPool(args.dsn, minconn=1, maxconn=1)
+    with pool.connection() as conn:
+        for name in ensure_partitions(conn, months_ahead=args.months_ahead):
+            sys.stdout.write('created %s\n' % name)
+        if args.archive:
+            before = datetime.strptime(args.before, '%Y-%m-%d') if args.before else None
+            for name in archive_partitions(conn, before, args.drop):
+                sys.stdout.write('%s %s\n' % ('dropped' if args.drop else 'detached', name))
+    pool.closeall()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+from .settings import (
+    DB_CONN_STRING, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER
+)
+
+from .prepared import PreparedConnection
+
+from .exceptions import SystemFailed, InvalidParameterValue, PoolTimeout
+
+class ConnectionPool(object):
+    """`ConnectionPool` keeps a bounded set of autocommit connections
+    to the database which can be shared by any number of `CreditManager`
+    instances across threads. A connection is checked out for the
+    duration of a single operation and returned right after.
+    """
+
+    def __init__(self, dsn=DB_CONN_STRING, minconn=DB_POOL_MIN,
+                 maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise InvalidParameterValue("Invalid pool size")
+        if timeout is not None and timeout < 0:
+            raise InvalidParameterValue("Invalid pool checkout timeout")
+
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        # seconds to wait for a free connection (None waits forever).
+        self.timeout = timeout
+        # connections idle for longer than this many seconds are checked
+        # with a round trip before being handed out (None disables it);
+        # the busy ones, returned moments ago, go out right away.
+        self.ping_after = ping_after
+
+        # all the state below is guarded by this condition.
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []  # (connection, returned at) pairs, used as a stack
+        self._size = 0  # number of open connections (idle + in use)
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+        # open the minimum number of connections upfront.
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.time()))
+            self._size += 1
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(self.dsn, connection_factory=PreparedConnection)
+        except Exception as e:
+            raise SystemFailed(str(e))
+
+        # NOTE: every operation of the `CreditManager` is a single
+        # statement unless it explicitly opens a transaction, hence
+        # the pooled connections run in autocommit mode.
+        conn.autocommit = True
+        return conn
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if self.ping_after is None or time.time() - idle_since < self.ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """`getconn` checks out a healthy connection from the pool,
+        waiting up to `timeout` seconds for one to be returned when
+        all `maxconn` connections are in use.
+        """
+        with self._cond:
+            waited_from = None
+            while not self._idle and self._size >= self.maxconn:
+                now = time.time()
+                if waited_from is None:
+                    waited_from = now
+                    self._waits += 1
+                remaining = None
+                if self.timeout is not None:
+                    remaining = waited_from + self.timeout - now
+                    if remaining <= 0:
+                        self._wait_time += now - waited_from
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            "No connection available after %s seconds" % self.timeout
+                        )
+                self._cond.wait(remaining)
+            if waited_from is not None:
+                self._wait_time += time.time() - waited_from
+
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                # reserve a slot and open the connection outside the lock.
+                conn, idle_since = None, None
+                self._size += 1
+            self._in_use += 1
+            self._checkouts += 1
+
+        try:
+            if conn is not None and not self._healthy(conn, idle_since):
+                self._close(conn)
+                with self._cond:
+                    self._discarded += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            # give the reserved slot back.
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """`putconn` returns a connection to the pool. Broken
+        connections (or ones asked to be closed) are discarded.
+        """
+        if not close and not conn.closed:
+            try:
+                # never hand out a connection in the middle of a transaction.
+                status = conn.get_transaction_status()
+                if status in (psycopg2.extensions.TRANSACTION_STATUS_INTRANS,
+                              psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+                    if conn.autocommit:
+                        # psycopg2 ignores `rollback()` in autocommit mode
+                        # (eg. a transaction opened with `BEGIN`).
+                        cursor = conn.cursor()
+                        cursor.execute("ROLLBACK;")
+                        cursor.close()
+                    else:
+                        conn.rollback()
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    # busy or lost: no telling what state it is in.
+                    close = True
+                if not close and not conn.autocommit:
+                    conn.autocommit = True
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+        if close:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """`connection` checks out a connection for the duration
+        of a `with` block.
+        """
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # the connection is most likely unusable from here on.
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def stats(self):
+        """`stats` returns a snapshot of the pool usage for monitoring.
+        """
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max': self.maxconn,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time': self._wait_time,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+            }
+
+    def closeall(self):
+        """`closeall` closes all the idle connections of the pool.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
@@ -0,0 +1,151 @@
+import re
+import psycopg2
+import psycopg2.errorcodes
+import psycopg2.extensions
+
+from . import queries
+
+# Server side prepared statements for the statements of `cmanager.queries`.
+# A statement is parsed and planned once per connection (`PREPARE`) and
+# then only run (`EXECUTE`) with its arguments.
+#
+# NOTE: psycopg2 speaks the simple query protocol, hence the arguments of
+# `EXECUTE` are still sent as (escaped) literals; what is saved is the
+# parsing and the planning of the statement on every call.
+
+# the type of every named parameter used by the statements.
+PARAM_TYPES = {
+    'account_id': 'BIGINT',
+    'after': 'TIMESTAMP',
+    'after_id': 'BIGINT',
+    'amount': 'NUMERIC',
+    'append_only': 'BOOLEAN',
+    'apr': 'NUMERIC',
+    'as_of': 'TIMESTAMP',
+    'balance': 'NUMERIC',
+    'check_balance': 'BOOLEAN',
+    'day': 'DATE',
+    'description': 'VARCHAR',
+    'end_date': 'TIMESTAMP',
+    'id': 'BIGINT',
+    'interest': 'NUMERIC',
+    'last_eot': 'TIMESTAMP',
+    'limit': 'NUMERIC',
+    'page_size': 'BIGINT',
+    'pattern': 'VARCHAR',
+    'payments': 'NUMERIC',
+    'period': 'INTEGER',
+    'previous_eot': 'TIMESTAMP',
+    'start_date': 'TIMESTAMP',
+    'tstamp': 'TIMESTAMP',
+    'type': 'VARCHAR',
+}
+
+# the amounts, when stored as minor units (see `cmanager.money`).
+MINOR_UNIT_PARAMS = ('amount', 'balance', 'interest', 'limit', 'payments')
+
+PARAM = re.compile(r'%\((\w+)\)s')
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """`PreparedConnection` is a connection which remembers the
+    statements prepared on its session.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PreparedConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+class Statement(object):
+    """`Statement` is a statement of `cmanager.queries` turned into its
+    `PREPARE` and `EXECUTE` commands: every named parameter becomes a
+    positional one (`$1`, `$2`...), numbered in order of appearance.
+    With `minor_units`, the amounts are BIGINT (a statement of its own).
+    """
+
+    def __init__(self, name, minor_units=False):
+        self.name = 'cmanager_%s' % name.lower()
+        if minor_units:
+            self.name += '_minor'
+        self.params = []
+
+        def number(match):
+            param = match.group(1)
+            if param not in self.params:
+                self.params.append(param)
+            return '$%d' % (self.params.index(param) + 1)
+
+        def param_type(param):
+            if minor_units and param in MINOR_UNIT_PARAMS:
+                return 'BIGINT'
+            return PARAM_TYPES[param]
+
+        body = PARAM.sub(number, getattr(queries, name)).replace('%%', '%')
+        if self.params:
+            self.prepare = 'PREPARE %s (%s) AS %s' % (
+                self.name, ', '.join(param_type(param) for param in self.params),
+                body.strip().rstrip(';')
+            )
+            self.execute = 'EXECUTE %s (%s);' % (self.name, ', '.join(['%s'] * len(self.params)))
+        else:
+            self.prepare = 'PREPARE %s AS %s' % (self.name, body.strip().rstrip(';'))
+            self.execute = 'EXECUTE %s;' % self.name
+
+    def arguments(self, params):
+        return [params[param] for param in self.params]
+
+_statements = {}
+
+def statement(name, minor_units=False):
+    """`statement` returns the (cached) `Statement` of a query.
+    """
+    key = (name, minor_units)
+    if key not in _statements:
+        _statements[key] = Statement(name, minor_units)
+    return _statements[key]
+
+def deallocated(error):
+    """`deallocated` tells if an error is a statement deallocated behind
+    our back (eg. `DEALLOCATE ALL` or `DISCARD ALL`). NOTE: psycopg2 raises
+    an `OperationalError` for that SQLSTATE (26000).
+    """
+    return getattr(error, 'pgcode', None) == psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME
+
+def reset(conn):
+    """`reset` deallocates the statements of the session (outside
+    transactions), to be prepared again as they run: a transaction which
+    failed on a deallocated statement can then be run again.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DEALLOCATE ALL;")
+    finally:
+        cursor.close()
+    if isinstance(conn, PreparedConnection):
+        conn.prepared.clear()
+
+def execute(cursor, name, params, minor_units=False):
+    """`execute` runs the statement `name` of `cmanager.queries` with the
+    given parameters, preparing it first if it was never prepared on the
+    connection of the cursor.
+    """
+    conn = cursor.connection
+    if not isinstance(conn, PreparedConnection):
+        # a connection opened elsewhere; run the plain statement.
+        cursor.execute(getattr(queries, name), params)
+        return
+
+    stmt = statement(name, minor_units)
+    if stmt.name not in conn.prepared:
+        cursor.execute(stmt.prepare)
+        conn.prepared.add(stmt.name)
+    try:
+        cursor.execute(stmt.execute, stmt.arguments(params))
+    except psycopg2.Error as e:
+        # prepare it again, outside transactions only as the failure
+        # aborted the ongoing one (its caller runs it again, see `reset`).
+        if not deallocated(e) or not conn.autocommit:
+            raise
+        conn.prepared.discard(stmt.name)
+        cursor.execute(stmt.prepare)
+        conn.prepared.add(stmt.name)
+        cursor.execute(stmt.execute, stmt.arguments(params))
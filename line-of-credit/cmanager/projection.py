@@ -0,0 +1,98 @@
+import numpy
+from decimal import Decimal
+from datetime import timedelta
+
+from . import money
+from .cmanager import as_datetime, round_up
+from .backends.memory import to_micros, DAY
+
+from .exceptions import InvalidParameterValue, InvalidPayment
+
+# What-if projections of the outstanding at the end of the current period
+# (see `CreditManager.compute_outstanding`), read only. The outstanding is
+# linear in the payments of the period: a payment of `a` on day `k` lowers
+# the due of every day from `k` to the end of the period, hence the day
+# weighted due by `a * (end - k)`. The period is summarized once and the
+# payments of all the scenarios are folded in at once with NumPy, over
+# integer minor units (exact, see `cmanager.money`), before the interest
+# is applied like `compute_outstanding` does.
+
+class Scenario(object):
+    """`Scenario` is a hypothetical apr along with the payments (a list of
+    `(tstamp, amount)`) to make before the end of the period.
+    """
+
+    def __init__(self, apr, payments=()):
+        self.apr = apr
+        self.payments = list(payments)
+
+class Projection(object):
+    """`Projection` summarizes the current period of an account once (as
+    of `as_of`, the end of the period by default, after the latest
+    transaction) and projects the outstanding of any number of scenarios.
+    """
+
+    def __init__(self, cm, as_of=None):
+        head = cm._get_head()
+        self.limit = cm.limit
+        self.previous_eot = head['last_eot']
+        self.as_of = as_datetime(as_of) if as_of else self.previous_eot + timedelta(days=cm.period)
+        if self.as_of <= head['last_tstamp']:
+            raise InvalidParameterValue("Projections start after the latest transaction")
+
+        # the same figures `compute_outstanding` works from.
+        self.outstanding_end = self.previous_eot + timedelta(days=1)
+        self.outstanding = cm.limit - cm._get_balance(self.outstanding_end)
+        period = cm.backend.period_summary(cm.account_id, cm.limit, self.previous_eot, self.as_of)
+        self.payments = period['payments']
+        self.weighted_due = period['weighted_due']
+        self.last_balance = period['last_balance']
+
+    def _micros(self, tstamp, amount):
+        tstamp = as_datetime(tstamp)
+        if not self.previous_eot <= tstamp < self.as_of:
+            raise InvalidParameterValue("Payment at %s is outside of the period" % tstamp)
+        if amount <= Decimal('0.000'):
+            raise InvalidPayment("Payment amount should be greater than 0.000 USD")
+        if not money.in_minor_units(amount):
+            raise InvalidPayment("Payment amounts have at most 6 decimals")
+        return to_micros(tstamp), money.to_minor(amount)
+
+    def project(self, scenarios):
+        """`project` returns the outstanding `compute_outstanding` would
+        compute at the end of the period for each scenario (in order).
+        """
+        scenarios = list(scenarios)
+        tstamps, amounts, counts = [], [], []
+        for scenario in scenarios:
+            for tstamp, amount in scenario.payments:
+                tstamp, amount = self._micros(tstamp, amount)
+                tstamps.append(tstamp)
+                amounts.append(amount)
+            counts.append(len(scenario.payments))
+
+        owner = numpy.repeat(numpy.arange(len(scenarios)), counts)
+        tstamps = numpy.array(tstamps, dtype=numpy.int64)
+        amounts = numpy.array(amounts, dtype=numpy.int64)
+        days = to_micros(self.as_of) // DAY - tstamps // DAY
+        early = tstamps < to_micros(self.outstanding_end)
+
+        # per scenario: the payments, the day weighted payments and the
+        # payments clearing the outstanding itself (made on the eot day).
+        paid = numpy.zeros(len(scenarios), dtype=numpy.int64)
+        weighted = numpy.zeros(len(scenarios), dtype=numpy.int64)
+        cleared = numpy.zeros(len(scenarios), dtype=numpy.int64)
+        numpy.add.at(paid, owner, amounts)
+        numpy.add.at(weighted, owner, amounts * days)
+        numpy.add.at(cleared, owner, amounts * early)
+
+        results = []
+        for index, scenario in enumerate(scenarios):
+            payments = money.from_minor(int(paid[index]))
+            outstanding = self.outstanding - money.from_minor(int(cleared[index]))
+            due = self.limit - (self.last_balance + payments)
+            if outstanding > Decimal('0.000') and self.payments + payments < outstanding:
+                weighted_due = self.weighted_due - money.from_minor(int(weighted[index]))
+                due += money.from_minor(money.interest(scenario.apr, weighted_due))
+            results.append(round_up(due))
+        return results
@@ -0,0 +1,428 @@
+# SQL statements of the credit manager, shared by the blocking
+# (`CreditManager`) and the asyncio (`AsyncCreditManager`) implementations.
+
+# columns of an exported ledger, in order, and the export formats.
+COLUMNS = ('account_id', 'id', 'tstamp', 'amount', 'balance', 'type', 'description')
+
+FORMATS = ('csv', 'jsonl')
+
+# the daily closing balance rollup (see `bootstrap.sql`) is upserted in
+# the same statement as every ledger insert: the closing balance is the
+# one of the latest transaction of the day and the payments add up.
+ROLLUP_CONFLICT = """
+    ON CONFLICT (account_id, day) DO UPDATE SET
+        balance = CASE WHEN EXCLUDED.tstamp >= daily_balance.tstamp
+                       THEN EXCLUDED.balance ELSE daily_balance.balance END,
+        tstamp = GREATEST(daily_balance.tstamp, EXCLUDED.tstamp),
+        payments = daily_balance.payments + EXCLUDED.payments
+"""
+
+# upsert one day of the rollup (used by the bulk import).
+ROLLUP_UPSERT = """
+    INSERT INTO
+        daily_balance (account_id, day, tstamp, balance, payments)
+    VALUES (%(account_id)s, %(day)s, %(tstamp)s, %(balance)s, %(payments)s)
+""" + ROLLUP_CONFLICT + ";"
+
+# rebuild the rollup of an account from its ledger (eg. for a ledger
+# loaded before the rollup existed or written behind the library's back).
+ROLLUP_REBUILD = """
+    DELETE FROM daily_balance WHERE account_id = %(account_id)s;
+    INSERT INTO
+        daily_balance (account_id, day, tstamp, balance, payments)
+    SELECT
+        account_id, tstamp::date, MAX(tstamp),
+        (array_agg(balance ORDER BY tstamp DESC, id DESC))[1],
+        COALESCE(SUM(amount) FILTER (WHERE type = 'payment'), 0)
+    FROM
+        transaction
+    WHERE
+        account_id = %(account_id)s
+    GROUP BY
+        account_id, tstamp::date;
+"""
+
+# upsert the rollup from the transaction inserted by the `entry` CTE.
+ROLLUP_ENTRY = """
+    INSERT INTO
+        daily_balance (account_id, day, tstamp, balance, payments)
+    SELECT
+        account_id, tstamp::date, tstamp, balance,
+        CASE WHEN type = 'payment' THEN amount ELSE 0 END
+    FROM
+        entry
+""" + ROLLUP_CONFLICT
+
+# create the account head record (which also keeps the terms of the
+# credit line) along with the opening balance transaction of the account.
+OPEN_ACCOUNT = """
+    WITH head AS (
+        INSERT INTO
+            account (id, apr, credit_limit, period, balance, last_tstamp, last_eot)
+        VALUES (%(account_id)s, %(apr)s, %(limit)s, %(period)s, %(limit)s, %(tstamp)s, %(tstamp)s)
+        RETURNING id, balance, last_tstamp
+    ), entry AS (
+        INSERT INTO
+            transaction (account_id, tstamp, amount, balance, description, type)
+        SELECT
+            id, last_tstamp, 0, balance, 'opening balance', 'eot'
+        FROM
+            head
+        RETURNING account_id, tstamp, amount, balance, type)
+""" + ROLLUP_ENTRY + ";"
+
+# append a transaction to the ledger and move the account head in a
+# single statement. The account row lock taken by the UPDATE serializes
+# the writers of an account (and only of that account). With
+# `check_balance` the update only happens if the resulting balance is
+# non-negative. Transactions before the last eot are refused (`closed`).
+# The statement returns no row for an unknown account and a NULL id when
+# the transaction was not posted; `backdated` tells a transaction which
+# is not the latest one (its balance, and the balances of the later
+# transactions, are left to `REPAIR`). The account row is read under its
+# lock (`locked`), hence as the writer holding it left it: an account
+# deleted meanwhile (moved to another shard) is unknown, which a plain read
+# of the statement snapshot would still see. With `append_only` a backdated
+# transaction is not posted either, so that an append runs on its own (one
+# statement in autocommit) and only a backdated one is posted again along
+# with its `REPAIR`, in one transaction.
+POST = """
+    WITH locked AS (
+        SELECT
+            last_eot, last_tstamp
+        FROM
+            account
+        WHERE
+            id = %(account_id)s
+        FOR UPDATE
+    ), head AS (
+        UPDATE
+            account
+        SET
+            balance = balance + (%(amount)s),
+            last_tstamp = GREATEST(last_tstamp, %(tstamp)s)
+        WHERE
+            id = %(account_id)s AND %(tstamp)s >= last_eot AND
+            (NOT %(append_only)s OR %(tstamp)s >= last_tstamp) AND
+            (NOT %(check_balance)s OR balance + (%(amount)s) >= 0)
+        RETURNING balance
+    ), entry AS (
+        INSERT INTO
+            transaction (account_id, tstamp, amount, balance, description, type)
+        SELECT
+            %(account_id)s, %(tstamp)s, %(amount)s, balance, %(description)s, %(type)s
+        FROM
+            head
+        RETURNING id, account_id, tstamp, amount, balance, type
+    ), rollup AS (""" + ROLLUP_ENTRY + """)
+    SELECT
+        (SELECT id FROM entry) AS id,
+        %(tstamp)s < last_tstamp AS backdated,
+        %(tstamp)s < last_eot AS closed
+    FROM
+        locked;
+"""
+
+# take the account row lock (see `REPAIR`).
+LOCK_ACCOUNT = """
+    SELECT id FROM account WHERE id = %(account_id)s FOR UPDATE;
+"""
+
+# recompute the running balances of the transactions from a backdated one
+# (`id` at `tstamp`) onwards: the balance of the transaction right before
+# it plus the running sum of the amounts, in ledger order (tstamp, id).
+# The closing balances of the days of those transactions are rewritten in
+# the rollup as well. Only the suffix of the ledger is read and only the
+# rows whose balance changed are written. Run it holding the account row
+# lock, in the transaction of the `POST` (or `CLOSE_PERIOD`) which took it
+# or after `LOCK_ACCOUNT`, so that no transaction of the account is posted
+# meanwhile.
+REPAIR = """
+    WITH base AS (
+        SELECT
+            balance
+        FROM
+            transaction
+        WHERE
+            account_id = %(account_id)s AND tstamp <= %(tstamp)s AND
+            (tstamp, id) < (%(tstamp)s, %(id)s)
+        ORDER BY tstamp DESC, id DESC
+        LIMIT 1
+    ), suffix AS (
+        SELECT
+            id, tstamp,
+            (SELECT balance FROM base) + SUM(amount) OVER (ORDER BY tstamp, id) AS balance,
+            ROW_NUMBER() OVER (PARTITION BY tstamp::date ORDER BY tstamp DESC, id DESC) = 1 AS closing
+        FROM
+            transaction
+        WHERE
+            account_id = %(account_id)s AND tstamp >= %(tstamp)s AND
+            (tstamp, id) >= (%(tstamp)s, %(id)s)
+    ), repaired AS (
+        UPDATE
+            transaction
+        SET
+            balance = suffix.balance
+        FROM
+            suffix
+        WHERE
+            transaction.account_id = %(account_id)s AND transaction.tstamp = suffix.tstamp AND
+            transaction.id = suffix.id AND transaction.balance <> suffix.balance
+        RETURNING transaction.id
+    ), rollup AS (
+        UPDATE
+            daily_balance
+        SET
+            balance = suffix.balance
+        FROM
+            suffix
+        WHERE
+            daily_balance.account_id = %(account_id)s AND daily_balance.day = suffix.tstamp::date AND
+            suffix.closing AND daily_balance.balance <> suffix.balance
+        RETURNING day
+    )
+    SELECT
+        (SELECT COUNT(*) FROM suffix) AS suffix,
+        (SELECT COUNT(*) FROM repaired) AS repaired,
+        (SELECT COUNT(*) FROM rollup) AS days;
+"""
+
+# the head record always holds the latest balance (and the last eot).
+HEAD = """
+    SELECT
+        balance, last_tstamp, last_eot
+    FROM
+        account
+    WHERE
+        id = %(account_id)s;
+"""
+
+# the balance of the account as of a point in time: the balance of the
+# latest transaction of that day before as_of or else the closing balance
+# of the latest day before it, hence at most one day of the ledger (one
+# partition) is scanned however far back the previous transaction is. Ties
+# on tstamp go to the latest transaction, in ledger order (tstamp, id).
+BALANCE_AS_OF = """
+    SELECT
+        balance
+    FROM (
+        (SELECT
+            balance, 0 AS source
+        FROM
+            transaction
+        WHERE
+            account_id = %(account_id)s AND
+            tstamp >= %(as_of)s::date AND tstamp < %(as_of)s
+        ORDER BY
+            tstamp DESC, id DESC
+        LIMIT 1)
+        UNION ALL
+        (SELECT
+            balance, 1 AS source
+        FROM
+            daily_balance
+        WHERE
+            account_id = %(account_id)s AND day < %(as_of)s::date
+        ORDER BY
+            day
+        DESC LIMIT 1)
+    ) AS candidates
+    ORDER BY
+        source
+    LIMIT 1;
+"""
+
+# summarize the period in a single row from the daily rollup: the payments
+# made since the previous eot (to check if they cleared things off) and the
+# due weighted by the number of days it was carried, ie. the closing due of
+# each day with transactions times the days until the next one (or until
+# as_of for the last one). As the interest only depends on the days between
+# transactions, this is the same as walking every transaction of the period.
+# Only the payments of the eot day come from the ledger, as the ones made
+# earlier that day belong to the previous period.
+PERIOD_SUMMARY = """
+    SELECT
+        COALESCE((
+            SELECT
+                SUM(payments)
+            FROM
+                daily_balance
+            WHERE
+                account_id = %(account_id)s AND day > %(previous_eot)s::date
+        ), 0) + COALESCE((
+            SELECT
+                SUM(amount)
+            FROM
+                transaction
+            WHERE
+                account_id = %(account_id)s AND type = 'payment' AND
+                tstamp >= %(previous_eot)s AND tstamp < %(previous_eot)s::date + 1
+        ), 0) AS payments,
+        COALESCE(SUM((next_day - day) * (%(limit)s - balance)), 0) AS weighted_due,
+        MAX(balance) FILTER (WHERE latest) AS last_balance
+    FROM (
+        SELECT
+            day, balance,
+            LEAD(day, 1, %(as_of)s::date) OVER (ORDER BY day) AS next_day,
+            ROW_NUMBER() OVER (ORDER BY day DESC) = 1 AS latest
+        FROM
+            daily_balance
+        WHERE
+            account_id = %(account_id)s AND day >= %(previous_eot)s::date
+    ) AS period;
+"""
+
+# write a record for the outstanding calculation. The interest is charged
+# to the account (reducing the available balance) and the head moves to
+# this eot, unless another run closed the period first (no row is
+# returned). Like `POST`, `backdated` tells an eot written before the
+# latest transaction.
+CLOSE_PERIOD = """
+    WITH head AS (
+        UPDATE
+            account
+        SET
+            balance = balance - (%(interest)s),
+            last_tstamp = GREATEST(last_tstamp, %(as_of)s),
+            last_eot = %(as_of)s
+        WHERE
+            id = %(account_id)s AND last_eot = %(previous_eot)s
+        RETURNING balance, last_tstamp > %(as_of)s AS backdated
+    ), entry AS (
+        INSERT INTO
+            transaction (account_id, tstamp, amount, balance, description, type)
+        SELECT
+            %(account_id)s, %(as_of)s, -(%(interest)s), balance, %(description)s, 'eot'
+        FROM
+            head
+        RETURNING id, account_id, tstamp, amount, balance, type
+    ), rollup AS (""" + ROLLUP_ENTRY + """)
+    SELECT
+        id, tstamp, (SELECT backdated FROM head) AS backdated
+    FROM
+        entry;
+"""
+
+# the transactions of the account over a time range, in insertion order.
+STATEMENT = """
+    SELECT
+        id, tstamp, amount, type, description
+    FROM
+        transaction
+    WHERE
+        account_id = %(account_id)s AND tstamp >= %(start_date)s AND tstamp < %(end_date)s
+    ORDER BY id;
+"""
+
+# the transactions whose description contains a text (`pattern` is the
+# escaped `%text%`), case insensitive, using the trigram index of the
+# descriptions of an account (see `bootstrap.sql`).
+SEARCH = """
+    SELECT
+        id, tstamp, amount, type, description
+    FROM
+        transaction
+    WHERE
+        account_id = %(account_id)s AND description ILIKE %(pattern)s AND
+        tstamp >= %(start_date)s AND tstamp < %(end_date)s
+    ORDER BY id
+    LIMIT %(page_size)s;
+"""
+
+# the amount withdrawn per description (ie. per merchant) over a time
+# range, the largest first; all of them for a NULL `page_size`.
+SPENDING = """
+    SELECT
+        description,
+        COUNT(*) AS withdrawals,
+        -SUM(amount) AS spent
+    FROM
+        transaction
+    WHERE
+        account_id = %(account_id)s AND type = 'withdrawal' AND
+        description ILIKE %(pattern)s AND
+        tstamp >= %(start_date)s AND tstamp < %(end_date)s
+    GROUP BY description
+    ORDER BY spent DESC, description
+    LIMIT %(page_size)s;
+"""
+
+# the eot transactions after `after`, the boundaries of the periods (see
+# `cmanager.cache`), walking the partial index of the eot transactions.
+EOTS = """
+    SELECT
+        tstamp
+    FROM
+        transaction
+    WHERE
+        account_id = %(account_id)s AND type = 'eot' AND tstamp > %(after)s
+    ORDER BY tstamp;
+"""
+
+# one page of the statement, right after the transaction `after_id`.
+STATEMENT_PAGE = """
+    SELECT
+        id, tstamp, amount, type, description
+    FROM
+        transaction
+    WHERE
+        account_id = %(account_id)s AND id > %(after_id)s AND
+        tstamp >= %(start_date)s AND tstamp < %(end_date)s
+    ORDER BY id
+    LIMIT %(page_size)s;
+"""
+
+# the head record of an account along with the terms of its credit line,
+# locked until the end of the transaction (see `DROP_ACCOUNT`).
+ACCOUNT = """
+    SELECT
+        apr, credit_limit, period, balance, last_tstamp, last_eot
+    FROM
+        account
+    WHERE
+        id = %(account_id)s
+    FOR UPDATE;
+"""
+
+# the whole ledger of an account with the running balances, in insertion order.
+LEDGER = """
+    SELECT
+        id, tstamp, amount, balance, type, description
+    FROM
+        transaction
+    WHERE
+        account_id = %(account_id)s
+    ORDER BY
+        id;
+"""
+
+# delete an account, its ledger and its rollup (once moved to another shard).
+DROP_ACCOUNT = """
+    WITH ledger AS (
+        DELETE FROM transaction WHERE account_id = %(account_id)s
+    ), rollup AS (
+        DELETE FROM daily_balance WHERE account_id = %(account_id)s
+    )
+    DELETE FROM
+        account
+    WHERE
+        id = %(account_id)s;
+"""
+
+# create the head record of an account moved from another shard as is
+# (its ledger is copied right after).
+ATTACH_ACCOUNT = """
+    INSERT INTO
+        account (id, apr, credit_limit, period, balance, last_tstamp, last_eot)
+    VALUES (%(account_id)s, %(apr)s, %(limit)s, %(period)s, %(balance)s, %(tstamp)s, %(last_eot)s);
+"""
+
+# how far a hot standby lags behind its primary, in seconds: the age of the
+# latest transaction replayed, unless all the WAL received was replayed (an
+# idle primary sends nothing new). 0 on the primary.
+REPLICATION_LAG = """
+    SELECT
+        CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+             ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END AS lag;
+"""
@@ -0,0 +1,143 @@
+import time
+import threading
+
+from .settings import (
+    DB_REPLICAS, DB_POOL_MAX, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL, REPLICA_RETRY_AFTER
+)
+
+from .exceptions import InvalidParameterValue
+
+class ReplicaSet(object):
+    """`ReplicaSet` holds the read replicas (hot standbys of the primary,
+    as backends) serving the read-only calls of the credit managers
+    (`get_current_due` and `get_statement`, see `CreditManager(...,
+    replicas=replicas)`), taken in turn. A replica is left out when it
+    lags behind the primary by more than `max_lag` seconds (checked at
+    most every `check_interval` seconds) or for `retry_after` seconds
+    once it failed; with no replica left, the reads go to the primary.
+    """
+
+    def __init__(self, replicas, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL,
+                 retry_after=REPLICA_RETRY_AFTER):
+        if not replicas:
+            raise InvalidParameterValue("No replicas")
+        if max_lag is not None and max_lag < 0:
+            raise InvalidParameterValue("Invalid replica lag")
+        if check_interval < 0 or retry_after < 0:
+            raise InvalidParameterValue("Invalid replica check interval")
+
+        self.replicas = list(replicas)
+        # None trusts the replicas whatever their lag.
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+
+        # all the state below is guarded by this lock.
+        self._lock = threading.Lock()
+        self._next = 0
+        self._checks = {}  # replica index -> (checked at, lag)
+        self._down = {}  # replica index -> (left out until, error)
+        self._reads = 0
+        self._fallbacks = 0
+        self._lagging = 0
+        self._failures = 0
+
+    @classmethod
+    def from_dsns(cls, dsns=None, maxconn=DB_POOL_MAX, **kwargs):
+        """`from_dsns` builds a replica set over Postgres standbys
+        (`DB_REPLICAS` by default), each one with its own connection pool
+        opening its connections on demand, so that a standby down does not
+        stop the manager from starting. Put a `connect_timeout` in the DSNs.
+        """
+        # NOTE: imported here so that psycopg2 is only needed
+        # when the replicas are actually Postgres databases.
+        from .pool import ConnectionPool
+        from .backends.postgres import PostgresBackend
+        dsns = dsns if dsns is not None else DB_REPLICAS
+        return cls([PostgresBackend(ConnectionPool(dsn, minconn=0, maxconn=maxconn)) for dsn in dsns], **kwargs)
+
+    def _usable(self, index, now):
+        """`_usable` tells if the replica at `index` may serve a read:
+        not failed lately and not lagging behind.
+        """
+        with self._lock:
+            down = self._down.get(index)
+            if down is not None and now < down[0]:
+                return False
+            check = self._checks.get(index)
+        if check is None or now - check[0] >= self.check_interval:
+            # a round trip, outside of the lock.
+            try:
+                lag = self.replicas[index].replication_lag()
+            except Exception as e:
+                self.failed(self.replicas[index], e)
+                return False
+            check = (now, lag)
+            with self._lock:
+                self._checks[index] = check
+                self._down.pop(index, None)
+        if self.max_lag is not None and check[1] > self.max_lag:
+            with self._lock:
+                self._lagging += 1
+            return False
+        return True
+
+    def pick(self):
+        """`pick` returns the next usable replica, or None when the read
+        has to go to the primary.
+        """
+        now = time.time()
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        for offset in range(len(self.replicas)):
+            index = (start + offset) % len(self.replicas)
+            if self._usable(index, now):
+                with self._lock:
+                    self._reads += 1
+                return self.replicas[index]
+        with self._lock:
+            self._fallbacks += 1
+        return None
+
+    def failed(self, replica, error):
+        """`failed` leaves out a replica which failed a read (or a lag
+        check) for `retry_after` seconds.
+        """
+        index = self.replicas.index(replica)
+        with self._lock:
+            self._down[index] = (time.time() + self.retry_after, error)
+            self._checks.pop(index, None)
+            self._failures += 1
+
+    def stats(self):
+        """`stats` returns a snapshot of the routing of the reads for
+        monitoring: `reads` served by the replicas, `fallbacks` to the
+        primary, and the `lagging` and `failed` replicas met on the way,
+        along with the latest lag (or error) of every replica.
+        """
+        now = time.time()
+        with self._lock:
+            replicas = []
+            for index in range(len(self.replicas)):
+                check, down = self._checks.get(index), self._down.get(index)
+                replicas.append({
+                    'lag': check[1] if check is not None else None,
+                    'down': down is not None and now < down[0],
+                    'error': str(down[1]) if down is not None else None,
+                })
+            return {
+                'reads': self._reads,
+                'fallbacks': self._fallbacks,
+                'lagging': self._lagging,
+                'failures': self._failures,
+                'replicas': replicas,
+            }
+
+    def closeall(self):
+        """`closeall` closes the connection pools of the replicas.
+        """
+        for backend in self.replicas:
+            pool = getattr(backend, 'pool', None)
+            if pool is not None:
+                pool.closeall()
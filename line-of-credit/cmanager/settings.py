@@ -6,3 +6,36 @@ DATABASE_PASS = 'password'
 DB_CONN_STRING = "host='%s' dbname='%s' user='%s' password='%s'" % (
     DATABASE_HOST, DATABASE_NAME, DATABASE_USER, DATABASE_PASS
 )
+
+# Connection pool settings (used by `cmanager.pool.ConnectionPool`)
+DB_POOL_MIN = 1
+DB_POOL_MAX = 10
+DB_POOL_TIMEOUT = 5.0  # seconds to wait for a free connection
+DB_POOL_PING_AFTER = 5.0  # seconds a connection stays idle before it is checked on checkout
+
+# Ledger partitioning (used by `cmanager.partitions`)
+PARTITION_MONTHS_AHEAD = 3  # monthly partitions created ahead of time
+
+# Group commit of the writes (used by `cmanager.buffer.WriteBuffer`)
+WRITE_BUFFER_MAX_BATCH = 100  # writes committed together at most
+WRITE_BUFFER_MAX_LATENCY = 0.005  # seconds a write waits for its batch to fill up
+WRITE_BUFFER_TIMEOUT = 30.0  # seconds a caller waits for its write to be committed
+
+# Statement cache (used by `cmanager.cache.StatementCache`)
+STATEMENT_CACHE_MAX_ROWS = 100000  # rows of closed periods kept in memory at most
+
+# Storage of the amounts (see `cmanager.money`): NUMERIC dollars, or BIGINT
+# micro-dollars once the schema is migrated with `minor_units.sql`.
+MONEY_MINOR_UNITS = False
+
+# Read replicas (used by `cmanager.replica.ReplicaSet`): the DSNs of the
+# hot standbys serving the read-only calls of the credit managers.
+DB_REPLICAS = []
+REPLICA_MAX_LAG = 1.0  # seconds a replica may lag behind before its reads go to the primary
+REPLICA_CHECK_INTERVAL = 1.0  # seconds between two lag checks of a replica
+REPLICA_RETRY_AFTER = 5.0  # seconds a failed replica is left out
+
+# Sharding (used by `cmanager.backends.sharded.ShardRouter`): the shard
+# databases by name, eg. {'a': "host='db1' dbname='a' ...", 'b': ...}.
+DB_SHARDS = {}
+SHARD_VNODES = 64  # points of every shard on the consistent hash ring
@@ -0,0 +1,27 @@
+-- MIGRATE THE AMOUNTS TO MINOR UNITS
+-- run on a database created with `bootstrap.sql`, then set
+-- `MONEY_MINOR_UNITS = True` in `cmanager/settings.py`. Every amount and
+-- balance becomes a BIGINT count of micro-dollars (see `cmanager/money.py`):
+-- the arithmetic of the statements (the running balances, the rollup and
+-- the day weighted due) runs on native integers, and the rows (and the
+-- `(account_id, tstamp, id, balance)` index) hold fixed width values.
+--
+-- The amounts written by the library are whole micro-dollars; the interest
+-- of the periods closed by older versions (which was not rounded) is rounded
+-- to the nearest micro-dollar here (the detached partitions are left as they
+-- are). The apr is a rate, it stays NUMERIC.
+BEGIN;
+
+ALTER TABLE account
+	   ALTER COLUMN credit_limit TYPE BIGINT USING ROUND(credit_limit * 1000000),
+	   ALTER COLUMN balance TYPE BIGINT USING ROUND(balance * 1000000);
+
+ALTER TABLE transaction
+	   ALTER COLUMN amount TYPE BIGINT USING ROUND(amount * 1000000),
+	   ALTER COLUMN balance TYPE BIGINT USING ROUND(balance * 1000000);
+
+ALTER TABLE daily_balance
+	   ALTER COLUMN balance TYPE BIGINT USING ROUND(balance * 1000000),
+	   ALTER COLUMN payments TYPE BIGINT USING ROUND(payments * 1000000);
+
+COMMIT;
@@ -6,16 +6,35 @@ setup(
     url='https://github.com/sandeepraju/a/line-of-credit',
     author='Sandeep Raju Prabhakar',
     author_email='SandeepPrabhakar2015@u.northwestern.edu',
-    packages=['cmanager'],
+    packages=['cmanager', 'cmanager.backends'],
     description='A simple library to manage a credit.',
     long_description=open('README.md').read(),
+    # the asyncio manager (`cmanager.aio`) needs 3.7.
+    python_requires='>=3.7',
     install_requires=[
-        'psycopg2==2.6.1',
+        'psycopg2>=2.8',
     ],
+    extras_require={
+        'projection': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'cmanager-eot = cmanager.batch:main',
+            'cmanager-partitions = cmanager.partitions:main',
+        ],
+    },
     classifiers = [
         'Development Status :: 5 - Production/Stable',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ]
 )
 
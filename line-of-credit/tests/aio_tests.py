@@ -0,0 +1,166 @@
+import sys
+import time
+import asyncio
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta, date
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.aio import AsyncCreditManager, AsyncConnectionPool
+from cmanager.exceptions import (
+    InvalidPayment, InvalidWithdrawal, WithdrawalDenied,
+    InvalidOutstandingInvocation, AccountNotFound, PoolTimeout, SystemFailed
+)
+
+class AsyncCreditManagerTest(unittest.TestCase):
+    """`AsyncCreditManagerTest` defines the test cases for the
+    asyncio credit manager.
+    """
+    accounts = 8
+    coroutines = 1600
+
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.run = self.loop.run_until_complete
+
+        self.pool = AsyncConnectionPool(DB_CONN_STRING, maxconn=16, timeout=30.0)
+        self.managers = [
+            AsyncCreditManager(account_id, self.apr, self.limit, self.period, pool=self.pool)
+            for account_id in range(1, self.accounts + 1)
+        ]
+        self.run(asyncio.gather(*[cm.open_account() for cm in self.managers]))
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+        with pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        pool.closeall()
+        self.pool.closeall()
+        self.loop.close()
+
+    def test_invalid_amounts(self):
+        cm = self.managers[0]
+        self.assertRaises(InvalidPayment, self.run, cm.pay(Decimal('0.000'), 'payment'))
+        self.assertRaises(InvalidWithdrawal, self.run, cm.withdraw(Decimal('-1.000'), 'withdrawal'))
+        self.assertRaises(
+            WithdrawalDenied, self.run, cm.withdraw(Decimal('1000.010'), 'withdrawal')
+        )
+
+    def test_unknown_account(self):
+        cm = AsyncCreditManager(self.accounts + 1, self.apr, self.limit, self.period, pool=self.pool)
+        self.assertRaises(AccountNotFound, self.run, cm.pay(Decimal('1.000'), 'payment'))
+        self.assertRaises(AccountNotFound, self.run, cm.get_current_due())
+
+    def test_payment_not_posted(self):
+        cm = self.managers[0]
+
+        async def refused(*args):
+            return False
+        cm._post = refused
+        self.assertRaises(SystemFailed, self.run, cm.pay(Decimal('1.000'), 'payment'))
+
+    def test_backdated_payment(self):
+        cm = self.managers[0]
+        day00 = datetime.combine(date.today(), datetime.min.time())
+        self.run(cm.withdraw(Decimal('100.000'), 'withdrawal', day00 + timedelta(hours=2)))
+        self.run(cm.pay(Decimal('30.000'), 'late payment', day00 + timedelta(hours=1)))
+        # the withdrawal runs on top of the payment.
+        self.assertEqual(self.run(cm.get_current_due(day00 + timedelta(hours=1, minutes=30))), Decimal('-30.00'))
+        self.assertEqual(self.run(cm.get_current_due(day00 + timedelta(hours=3))), Decimal('70.00'))
+
+    def test_simultaneous_operations_across_accounts(self):
+        # every coroutine withdraws 7 USD, far more than the credit
+        # limit of the accounts put together, and a payment of 1 USD
+        # is made on every account alongside.
+        amount = Decimal('7.000')
+
+        async def withdraw(cm):
+            try:
+                await cm.withdraw(amount, 'withdrawal')
+                return True
+            except WithdrawalDenied:
+                return False
+
+        operations = [withdraw(self.managers[i % self.accounts]) for i in range(self.coroutines)]
+        operations += [cm.pay(Decimal('1.000'), 'payment') for cm in self.managers]
+
+        start = time.time()
+        results = self.run(asyncio.gather(*operations))
+        elapsed = time.time() - start
+        sys.stderr.write('\n%d operations in %.2fs (%.0f ops/sec)\n' % (
+            len(operations), elapsed, len(operations) / elapsed))
+
+        # no account was overdrawn and each one gave out at least its
+        # credit limit in full 7 USD (the payment may come in too late
+        # to be withdrawn again).
+        for index, cm in enumerate(self.managers):
+            granted = sum(1 for result in results[index:self.coroutines:self.accounts] if result)
+            self.assertTrue(granted >= int(self.limit / amount))
+            due = self.run(cm.get_current_due())
+            self.assertEqual(due, (granted * amount - 1).quantize(Decimal('.01')))
+            self.assertTrue(self.limit - due >= Decimal('0.00'))
+
+            # the ledger agrees with the head.
+            statement = self.run(cm.get_statement())
+            self.assertEqual(len(statement), granted + 2)  # + opening balance and payment
+            self.assertEqual(sum(row['amount'] for row in statement), -due)
+
+        # the connections were shared and all given back.
+        stats = self.pool.stats()
+        self.assertEqual(stats['in_use'], 0)
+        self.assertTrue(stats['size'] <= 16)
+
+    def test_outstanding_matches_blocking_manager(self):
+        day00 = datetime(2015, 1, 1)
+        cm = AsyncCreditManager(self.accounts + 1, self.apr, self.limit, self.period, pool=self.pool)
+        self.run(cm.open_account(day00))
+        self.run(cm.withdraw(Decimal('500.000'), 'withdrawal', day00))
+        self.run(cm.pay(Decimal('200.000'), 'payment', day00 + timedelta(days=15)))
+        self.run(cm.withdraw(Decimal('100.000'), 'withdrawal', day00 + timedelta(days=25)))
+
+        blocking = CreditManager(self.accounts + 2, self.apr, self.limit, self.period)
+        blocking.open_account(day00)
+        blocking.withdraw(Decimal('500.000'), 'withdrawal', day00)
+        blocking.pay(Decimal('200.000'), 'payment', day00 + timedelta(days=15))
+        blocking.withdraw(Decimal('100.000'), 'withdrawal', day00 + timedelta(days=25))
+
+        as_of = day00 + timedelta(days=30)
+        self.assertEqual(
+            self.run(cm.compute_outstanding(as_of)), blocking.compute_outstanding(as_of)
+        )
+        self.assertRaises(InvalidOutstandingInvocation, self.run, cm.compute_outstanding(as_of))
+
+    def test_checkout_timeout(self):
+        pool = AsyncConnectionPool(DB_CONN_STRING, maxconn=1, timeout=0.1)
+
+        async def hold():
+            conn = await pool.getconn()
+            try:
+                await pool.getconn()
+            finally:
+                await pool.putconn(conn)
+
+        self.assertRaises(PoolTimeout, self.run, hold())
+        stats = pool.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['in_use'], 0)
+        pool.closeall()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
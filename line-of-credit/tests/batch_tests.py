@@ -0,0 +1,83 @@
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.batch import EndOfTermRunner
+
+from .partition_tests import drop_partitions
+
+class EndOfTermRunnerTest(unittest.TestCase):
+    """`EndOfTermRunnerTest` defines the test cases for the
+    batch end of term runner.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=5)
+
+        # 20 accounts opened on day 0 drawing $500 and 5 accounts
+        # opened 10 days later (not yet due on day 30).
+        self.due = []
+        for account_id in range(1, 26):
+            opened = self.day00 if account_id <= 20 else self.day00 + timedelta(days=10)
+            cm = CreditManager(account_id, self.apr, self.limit, self.period, pool=self.pool)
+            cm.open_account(opened)
+            cm.withdraw(Decimal('500.000'), 'first withdraw', opened)
+            if account_id <= 20:
+                self.due.append(cm)
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data and the partitions
+        # created by the runs.
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("TRUNCATE transaction, daily_balance, account;")
+            drop_partitions(cursor)
+        self.pool.closeall()
+
+    def test_closes_due_accounts(self):
+        reports = []
+        runner = EndOfTermRunner(self.pool, workers=4, chunk_size=6, progress=reports.append)
+        report = runner.run(self.day00 + timedelta(days=30))
+
+        self.assertEqual(report['due'], 20)
+        self.assertEqual(report['closed'], 20)
+        self.assertEqual(report['failed'], 0)
+        self.assertTrue(report['throughput'] > 0)
+
+        # one progress report per chunk of 6 accounts.
+        self.assertEqual(len(reports), 4)
+
+        # same outstanding as the case 01 of the unit tests.
+        for cm in self.due:
+            self.assertEqual(cm.get_current_due(), Decimal('514.39'))
+
+    def test_rerun_skips_closed_accounts(self):
+        runner = EndOfTermRunner(self.pool, workers=2)
+        as_of = self.day00 + timedelta(days=30)
+        self.assertEqual(runner.run(as_of)['closed'], 20)
+
+        # running again for the same date (eg. after a crash) is a no-op.
+        report = runner.run(as_of)
+        self.assertEqual(report['due'], 0)
+        self.assertEqual(report['closed'], 0)
+
+        # the late accounts become due once their own period completes.
+        report = runner.run(self.day00 + timedelta(days=40))
+        self.assertEqual(report['closed'], 5)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
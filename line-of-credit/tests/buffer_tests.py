@@ -0,0 +1,231 @@
+import unittest
+import threading
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.buffer import WriteBuffer
+from cmanager.backends import MemoryBackend
+from cmanager.exceptions import (
+    AccountNotFound, InvalidParameterValue, PeriodClosed, SystemFailed, UncertainCommit, WithdrawalDenied
+)
+
+try:
+    import psycopg2
+    from cmanager.pool import ConnectionPool
+    from cmanager.backends.postgres import PostgresBackend
+except ImportError:
+    psycopg2 = None
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 is not installed")
+class WriteBufferTest(unittest.TestCase):
+    """`WriteBufferTest` defines the test cases for the payments and
+    withdrawals committed in batches through a write buffer.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=4, timeout=5.0)
+        self.backend = PostgresBackend(self.pool)
+        self.buffer = WriteBuffer(self.backend, max_batch=20, max_latency=0.05)
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        self.buffer.close()
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        self.pool.closeall()
+
+    def manager(self, account_id):
+        cm = CreditManager(account_id, self.apr, self.limit, self.period,
+                           backend=self.backend, buffer=self.buffer)
+        cm.open_account(self.day00)
+        return cm
+
+    def run_threads(self, workers):
+        threads = [threading.Thread(target=worker) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_invalid_buffer(self):
+        self.assertRaises(InvalidParameterValue, WriteBuffer, self.backend, 0)
+        self.assertRaises(InvalidParameterValue, WriteBuffer, self.backend, 10, -1)
+
+    def test_writes_are_committed_in_batches(self):
+        managers = [self.manager(account_id) for account_id in range(1, 5)]
+
+        def worker(cm, thread):
+            def run():
+                for n in range(25):
+                    cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(hours=1, seconds=100 * thread + n))
+            return run
+
+        self.run_threads([worker(cm, thread) for cm in managers for thread in range(4)])
+
+        # all the 400 payments made it, in fewer commits.
+        for cm in managers:
+            self.assertEqual(cm.get_current_due(), Decimal('-100.00'))
+        stats = self.buffer.stats()
+        self.assertEqual(stats['writes'], 400)
+        self.assertEqual(stats['pending'], 0)
+        self.assertTrue(stats['batches'] < 400)
+        self.assertTrue(stats['largest_batch'] <= 20)
+        self.assertEqual(stats['retried_batches'], 0)
+
+    def test_denied_withdrawal_fails_alone(self):
+        cm = self.manager(1)
+        outcomes = []
+
+        def worker(amount, n):
+            def run():
+                try:
+                    cm.withdraw(amount, 'withdrawal', self.day00 + timedelta(hours=1, seconds=n))
+                    outcomes.append(amount)
+                except WithdrawalDenied:
+                    outcomes.append(None)
+            return run
+
+        # only two of the three withdrawals fit in the limit.
+        self.run_threads([worker(Decimal('400.000'), n) for n in range(3)])
+        self.assertEqual(sorted(outcomes, key=str), [Decimal('400.000'), Decimal('400.000'), None])
+        self.assertEqual(cm.get_current_due(), Decimal('800.00'))
+
+    def test_errors_are_raised_to_their_caller(self):
+        cm = self.manager(1)
+        unknown = CreditManager(2, self.apr, self.limit, self.period, backend=self.backend, buffer=self.buffer)
+        self.assertRaises(AccountNotFound, unknown.pay, Decimal('1.000'), 'payment')
+
+        cm.compute_outstanding(self.day00 + timedelta(days=30))
+        self.assertRaises(PeriodClosed, cm.pay, Decimal('1.000'), 'payment', self.day00 + timedelta(days=10))
+        cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(days=31))
+        self.assertEqual(cm.get_current_due(), Decimal('-1.00'))
+
+    def test_backdated_write_is_repaired(self):
+        cm = self.manager(1)
+        cm.withdraw(Decimal('100.000'), 'withdrawal', self.day00 + timedelta(days=2))
+        cm.pay(Decimal('50.000'), 'backdated payment', self.day00 + timedelta(days=1))
+
+        # the withdrawal now runs on top of the payment.
+        self.assertEqual(cm.get_current_due(self.day00 + timedelta(days=1, hours=12)), Decimal('-50.00'))
+        self.assertEqual(cm.get_current_due(self.day00 + timedelta(days=3)), Decimal('50.00'))
+
+    def test_closed_buffer(self):
+        cm = self.manager(1)
+        self.buffer.close()
+        self.assertRaises(SystemFailed, cm.pay, Decimal('1.000'), 'payment')
+
+class BlockingBackend(MemoryBackend):
+    """`BlockingBackend` holds every batch until it is released.
+    """
+    def __init__(self):
+        super(BlockingBackend, self).__init__()
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def post_batch(self, writes):
+        self.entered.set()
+        self.released.wait()
+        return super(BlockingBackend, self).post_batch(writes)
+
+class MemoryWriteBufferTest(unittest.TestCase):
+    """`MemoryWriteBufferTest` defines the test cases for the flusher
+    itself (timeouts and failures), over the in-memory backend.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+        self.backend = MemoryBackend()
+
+    def manager(self, account_id, buffer):
+        cm = CreditManager(account_id, self.apr, self.limit, self.period,
+                           backend=self.backend, buffer=buffer)
+        cm.open_account(self.day00)
+        return cm
+
+    def test_invalid_timeout(self):
+        self.assertRaises(InvalidParameterValue, WriteBuffer, self.backend, 10, 0, 0)
+
+    def test_writes_are_committed_in_batches(self):
+        buffer = WriteBuffer(self.backend, max_batch=20, max_latency=0.05, timeout=5.0)
+        managers = [self.manager(account_id, buffer) for account_id in range(1, 3)]
+
+        def worker(cm, thread):
+            for n in range(25):
+                cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(hours=1, seconds=100 * thread + n))
+
+        threads = [threading.Thread(target=worker, args=(cm, thread)) for cm in managers for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.close()
+
+        for cm in managers:
+            self.assertEqual(cm.get_current_due(), Decimal('-100.00'))
+        stats = buffer.stats()
+        self.assertEqual(stats['writes'], 200)
+        self.assertTrue(stats['batches'] < 200)
+        self.assertEqual(stats['retried_batches'], 0)
+
+    def test_timed_out_writes(self):
+        self.backend = BlockingBackend()
+        buffer = WriteBuffer(self.backend, max_batch=1, max_latency=0, timeout=0.1)
+        cm = self.manager(1, buffer)
+        outcomes = []
+
+        def first():
+            try:
+                cm.pay(Decimal('1.000'), 'first payment', self.day00 + timedelta(hours=1))
+            except Exception as e:
+                outcomes.append(e)
+        thread = threading.Thread(target=first)
+        thread.start()
+        self.backend.entered.wait()
+
+        # the second write waits behind the held batch: it is dropped.
+        self.assertRaises(SystemFailed, cm.pay, Decimal('2.000'), 'second payment', self.day00 + timedelta(hours=2))
+        thread.join()
+        self.backend.released.set()
+        buffer.close()
+
+        # the held one may still go through, and does.
+        self.assertEqual(len(outcomes), 1)
+        self.assertTrue(isinstance(outcomes[0], UncertainCommit))
+        self.assertEqual(cm.get_current_due(), Decimal('-1.00'))
+
+    def test_flusher_failure_is_raised_to_the_callers(self):
+        buffer = WriteBuffer(self.backend, max_batch=20, max_latency=0.01, timeout=5.0)
+        cm = self.manager(1, buffer)
+
+        def crash(batch):
+            raise RuntimeError("flusher crashed")
+        buffer._flush = crash
+
+        with self.assertRaises(SystemFailed) as raised:
+            cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(hours=1))
+        self.assertTrue('flusher crashed' in str(raised.exception))
+        # the buffer is closed from then on.
+        self.assertRaises(SystemFailed, cm.pay, Decimal('1.000'), 'payment', self.day00 + timedelta(hours=2))
+        buffer.close()
+        self.assertEqual(cm.get_current_due(), Decimal('0.00'))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
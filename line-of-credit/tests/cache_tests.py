@@ -0,0 +1,195 @@
+import random
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.backends import MemoryBackend
+from cmanager.cache import StatementCache, DiskStore
+from cmanager.exceptions import InvalidParameterValue, PeriodClosed
+
+try:
+    import psycopg2
+    from cmanager.pool import ConnectionPool
+    from cmanager.backends.postgres import PostgresBackend
+except ImportError:
+    psycopg2 = None
+
+class CountingBackend(MemoryBackend):
+    """`CountingBackend` is the in-memory backend counting
+    the statements it is asked for.
+    """
+    def __init__(self):
+        super(CountingBackend, self).__init__()
+        self.statements = 0
+
+    def get_statement(self, account_id, start_date, end_date):
+        self.statements += 1
+        return super(CountingBackend, self).get_statement(account_id, start_date, end_date)
+
+class StatementCacheTest(object):
+    """`StatementCacheTest` defines the test cases for the statements
+    of the closed periods served from the cache.
+    """
+    periods = 4
+
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.random = random.Random(20151220)
+        self.day00 = datetime(2015, 1, 1)
+        self.backend = self.make_backend()
+        self.cache = StatementCache()
+        self.cm = self.manager(self.cache)
+        self.cm.open_account(self.day00)
+
+        # a few closed periods of random transactions, then an open one.
+        for period in range(self.periods + 1):
+            start = self.day00 + timedelta(days=30 * period)
+            for _ in range(self.random.randint(0, 8)):
+                tstamp = start + timedelta(minutes=self.random.randint(0, 29 * 24 * 60))
+                self.cm.pay(Decimal(self.random.randint(1, 10000)) / 100, 'payment', tstamp)
+            if period < self.periods:
+                self.cm.compute_outstanding(start + timedelta(days=30))
+        self.uncached = self.manager(None)
+
+    def manager(self, cache):
+        return CreditManager(1, Decimal('0.350'), Decimal('1000.000'), 30, backend=self.backend, cache=cache)
+
+    def ids(self, rows):
+        return [(row['id'], row['tstamp'], row['amount'], row['type'], row['description']) for row in rows]
+
+    def test_statements_match_the_backend(self):
+        end = self.day00 + timedelta(days=30 * (self.periods + 1))
+        bounds = [self.day00 - timedelta(days=1), end + timedelta(days=1)]
+        bounds += [self.day00 + timedelta(days=30 * period) for period in range(self.periods + 1)]
+        bounds += [self.day00 + timedelta(minutes=self.random.randint(0, 150 * 24 * 60)) for _ in range(10)]
+        for start_date in bounds:
+            for end_date in bounds:
+                self.assertEqual(
+                    self.ids(self.cm.get_statement(start_date, end_date)),
+                    self.ids(self.uncached.get_statement(start_date, end_date))
+                )
+        self.assertEqual(self.ids(self.cm.get_statement()), self.ids(self.uncached.get_statement()))
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['misses'], self.periods)  # each closed period was read once
+        self.assertTrue(stats['hits'] > 0)
+        self.assertEqual(stats['periods'], self.periods)
+
+    def test_open_period_is_live(self):
+        self.cm.get_statement()
+        last_eot = self.cm._get_head()['last_eot']
+        self.cm.withdraw(Decimal('10.000'), 'withdrawal', last_eot + timedelta(days=1))
+        self.cm.pay(Decimal('5.000'), 'backdated payment', last_eot + timedelta(hours=1))
+        self.assertEqual(self.ids(self.cm.get_statement()), self.ids(self.uncached.get_statement()))
+        self.assertEqual(self.cache.stats()['invalidations'], 0)
+
+        # the periods closed meanwhile are cached in turn.
+        self.cm.compute_outstanding(last_eot + timedelta(days=30))
+        self.assertEqual(self.ids(self.cm.get_statement()), self.ids(self.uncached.get_statement()))
+        self.assertEqual(self.cache.stats()['misses'], self.periods + 1)
+
+    def test_closed_periods_are_not_written(self):
+        self.cm.get_statement()
+        self.assertRaises(PeriodClosed, self.cm.pay, Decimal('1.000'), 'payment', self.day00 + timedelta(days=1))
+        self.assertEqual(self.ids(self.cm.get_statement()), self.ids(self.uncached.get_statement()))
+
+    def test_invalidation(self):
+        self.cm.get_statement()
+        self.assertEqual(self.cache.invalidate(1, self.day00 + timedelta(days=31)), 1)
+        self.assertEqual(self.cache.invalidate(1, self.day00 + timedelta(days=31)), 0)
+        self.assertEqual(self.cache.stats()['periods'], self.periods - 1)
+
+        self.cm.get_statement()
+        self.assertEqual(self.cache.stats()['misses'], self.periods + 1)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+class MemoryStatementCacheTest(StatementCacheTest, unittest.TestCase):
+    """`MemoryStatementCacheTest` runs the test cases against the
+    in-memory backend, along with the cache size bound and the store.
+    """
+    def make_backend(self):
+        return CountingBackend()
+
+    def test_invalid_cache(self):
+        self.assertRaises(InvalidParameterValue, StatementCache, -1)
+
+    def test_cached_periods_are_not_read_again(self):
+        self.cm.get_statement()
+        statements = self.backend.statements
+        self.cm.get_statement(self.day00, self.day00 + timedelta(days=30 * self.periods))
+        self.assertEqual(self.backend.statements, statements)  # no tail either
+
+        self.cm.get_statement()
+        self.assertEqual(self.backend.statements, statements + 1)  # the open period only
+
+    def test_least_recently_used_periods_are_evicted(self):
+        self.cache.max_rows = max(len(self.uncached.get_statement(
+            self.day00 + timedelta(days=30 * period), self.day00 + timedelta(days=30 * (period + 1))
+        )) for period in range(self.periods))
+        self.cm.get_statement()
+        stats = self.cache.stats()
+        self.assertTrue(stats['rows'] <= self.cache.max_rows)
+        self.assertEqual(stats['periods'] + stats['evictions'], self.periods)
+        self.assertEqual(self.ids(self.cm.get_statement()), self.ids(self.uncached.get_statement()))
+
+    def test_disk_store(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.manager(StatementCache(store=DiskStore(path))).get_statement()
+
+            # a fresh cache (eg. after a restart) reads the periods from disk.
+            cache = StatementCache(store=DiskStore(path))
+            expected = self.ids(self.uncached.get_statement())
+            statements = self.backend.statements
+            self.assertEqual(self.ids(self.manager(cache).get_statement()), expected)
+            self.assertEqual(self.backend.statements, statements + 1)  # the open period only
+            self.assertEqual(cache.stats()['disk_hits'], self.periods)
+
+            self.assertEqual(cache.invalidate(1, self.day00), 1)
+            self.assertEqual(len(DiskStore(path).keys(1)), self.periods - 1)
+        finally:
+            shutil.rmtree(path)
+
+    def test_writes_do_not_touch_the_store(self):
+        path = tempfile.mkdtemp()
+        try:
+            store = DiskStore(path)
+            cm = self.manager(StatementCache(store=store))
+            cm.get_statement()
+
+            def untouched(*args):
+                raise AssertionError("the store was touched")
+            store.keys = store.discard = untouched
+            cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(days=30 * self.periods + 1))
+            cm.withdraw(Decimal('1.000'), 'withdrawal')
+        finally:
+            shutil.rmtree(path)
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 is not installed")
+class PostgresStatementCacheTest(StatementCacheTest, unittest.TestCase):
+    """`PostgresStatementCacheTest` runs the test cases against
+    the Postgres backend.
+    """
+    def make_backend(self):
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=2)
+        return PostgresBackend(self.pool)
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        self.pool.closeall()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -1,59 +1,46 @@
+import csv
+import json
 import unittest
-import psycopg2
-import psycopg2.extras
-from decimal import Decimal
+from io import BytesIO
+from decimal import Decimal, ROUND_UP
 from datetime import datetime, date, timedelta
 
-from settings import DB_CONN_STRING
+from .settings import DB_CONN_STRING
 
 from cmanager import CreditManager
+from cmanager.backends import MemoryBackend
 from cmanager.exceptions import (
     InvalidPayment, InvalidWithdrawal,
     WithdrawalDenied, InvalidParameterValue, SystemFailed,
-    InvalidOutstandingInvocation
+    InvalidOutstandingInvocation, AccountNotFound, PeriodClosed
 )
 
-class CreditManagerTest(unittest.TestCase):
+try:
+    import psycopg2
+    import psycopg2.extras
+    from cmanager.backends.postgres import PostgresBackend
+except ImportError:
+    psycopg2 = None
+
+class CreditManagerTest(object):
     """`CreditManagerTest` defines all the unit test
-    cases for the cmanager module.
+    cases for the cmanager module. They run against
+    every storage backend (see the test classes below).
     """
     def setUp(self):
         """`setUp` prepares the data before each test case.
         """
         # set up the test constants
+        self.account_id = 1
         self.apr = Decimal('0.350')  # 35%
         self.limit = Decimal('1000.000')  # credit limit in USD
         self.period = 30  # payment period in days
 
-        # create a database connection to the test db based on the settings
-        conn = psycopg2.connect(DB_CONN_STRING)
-
-        # NOTE: this ideally should not be done and instead each
-        # transaction has to be handled based on the application
-        # logic. Since we know that there will not be many
-        # simultaneous connections to the database in our usecase,
-        # it is okay to autocommit each SQL query to simply some code.
-        conn.autocommit = True
-        
-        # get the cursor object to make queries
-        self.cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        # set up initial seed data
-        today = date.today()
-        self.cursor.execute("""
-            INSERT INTO 
-                transaction (tstamp, amount, balance, type, description)
-            VALUES ('%s', 0, %s, 'eot', 'opening balance');
-        """ % (today, self.limit))  # eot -- END of Term (payment term)
-
-        # create the credit manager object
-        self.cm = CreditManager(self.apr, self.limit, self.period)
-        
-    def tearDown(self):
-        """`tearDown` restores the state of the system after each test case.
-        """
-        # reset the database by deleting all the data.
-        self.cursor.execute("TRUNCATE transaction;");
+        # create the credit manager object and open its account
+        # (this creates the opening balance record).
+        self.backend = self.make_backend()
+        self.cm = CreditManager(self.account_id, self.apr, self.limit, self.period, backend=self.backend)
+        self.cm.open_account()
 
     def test_if_payment_on_zero_outstanding_allowed(self):
         # make a payment without any withdrawal
@@ -84,8 +71,7 @@ class CreditManagerTest(unittest.TestCase):
         self.assertEqual(self.cm.pay(Decimal('100.000'), 'payment 001'), None)
 
         # verify that the payment is made successfully.
-        self.cursor.execute("SELECT * FROM transaction OFFSET 1;")  # ignore the first one.
-        results = self.cursor.fetchall()
+        results = self.ledger()[1:]  # ignore the first one.
 
         # check that only one record exists
         self.assertEqual(len(results), 1)
@@ -102,8 +88,7 @@ class CreditManagerTest(unittest.TestCase):
         self.assertEqual(self.cm.pay(Decimal('10.000'), 'payment 002'), None)
         
         # verify that the payment is made successfully.
-        self.cursor.execute("SELECT * FROM transaction OFFSET 1;")  # ignore the first one.
-        results = self.cursor.fetchall()
+        results = self.ledger()[1:]  # ignore the first one.
 
         # check that two records exist
         self.assertEqual(len(results), 2)
@@ -130,6 +115,12 @@ class CreditManagerTest(unittest.TestCase):
             'swiped at starbucks'
         )
 
+    def test_amounts_finer_than_a_micro_dollar(self):
+        self.assertRaises(InvalidPayment, self.cm.pay, Decimal('10.0000001'), 'payment')
+        self.assertRaises(InvalidWithdrawal, self.cm.withdraw, Decimal('0.0000001'), 'swiped at starbucks')
+        self.cm.pay(Decimal('10.000001'), 'payment')
+        self.assertEqual(self.cm.get_current_due(), Decimal('-10.01'))
+
     def test_withdrawal_with_proper_amount(self):
         now1 = datetime.now()
 
@@ -137,8 +128,7 @@ class CreditManagerTest(unittest.TestCase):
         self.assertEqual(self.cm.withdraw(Decimal('100.000'), 'jewel osco'), None)
 
         # verify that the withdrawal is made successfully.
-        self.cursor.execute("SELECT * FROM transaction OFFSET 1;")  # ignore the first one.
-        results = self.cursor.fetchall()
+        results = self.ledger()[1:]  # ignore the first one.
 
         # check that only one record exists
         self.assertEqual(len(results), 1)
@@ -156,8 +146,7 @@ class CreditManagerTest(unittest.TestCase):
         self.cm.withdraw(Decimal('10.000'), 'walmart')
         
         # verify that the withdrawal is made successfully.
-        self.cursor.execute("SELECT * FROM transaction OFFSET 1;")  # ignore the first one.
-        results = self.cursor.fetchall()
+        results = self.ledger()[1:]  # ignore the first one.
 
         # check that two records exist
         self.assertEqual(len(results), 2)
@@ -186,7 +175,7 @@ class CreditManagerTest(unittest.TestCase):
 
         # inspect the results
         self.assertEqual(len(results), 1)
-        self.assertTrue(results[0].has_key('tstamp'))
+        self.assertTrue('tstamp' in results[0].keys())
         self.assertEqual(results[0]['amount'], Decimal('0.000'))
         self.assertEqual(results[0]['type'], 'eot')
         self.assertEqual(results[0]['description'], 'opening balance')
@@ -216,7 +205,132 @@ class CreditManagerTest(unittest.TestCase):
         self.assertEqual(results[3]['amount'], Decimal('10.000'))
         
         # TODO: test statement with transaction dates
+
+    def test_statement_streaming(self):
+        for i in range(10):
+            self.cm.withdraw(Decimal('10.000'), 'withdraw %d' % i)
+
+        # the streamed statement has the same rows as the materialized one.
+        expected = [dict(row) for row in self.cm.get_statement()]
+        self.assertEqual([dict(row) for row in self.cm.iter_statement(fetch_size=3)], expected)
+
+    def test_statement_pagination(self):
+        for i in range(10):
+            self.cm.withdraw(Decimal('10.000'), 'withdraw %d' % i)
+
+        # walk the statement 4 rows at a time.
+        pages = []
+        after_id = None
+        while True:
+            page = self.cm.get_statement_page(after_id=after_id, page_size=4)
+            if not page:
+                break
+            pages.append(page)
+            after_id = page[-1]['id']
+
+        self.assertEqual([len(page) for page in pages], [4, 4, 3])
+        self.assertEqual(
+            [row['id'] for page in pages for row in page],
+            [row['id'] for row in self.cm.get_statement()]
+        )
         
+    def test_statement_search(self):
+        self.cm.withdraw(Decimal('10.000'), 'Payment at Walmart #12')
+        self.cm.withdraw(Decimal('20.000'), 'Payment at Starbucks')
+        self.cm.withdraw(Decimal('30.000'), 'Payment at WALMART #7')
+        self.cm.pay(Decimal('50.000'), 'Payment for the month')
+        self.cm.withdraw(Decimal('1.000'), '100% juice_bar')
+
+        self.assertEqual(
+            [row['amount'] for row in self.cm.search_statement('walmart')],
+            [Decimal('-10.000'), Decimal('-30.000')]
+        )
+        self.assertEqual(len(self.cm.search_statement('walmart', limit=1)), 1)
+        self.assertEqual(len(self.cm.search_statement('payment')), 4)
+        self.assertEqual(self.cm.search_statement('walmart', date.today() + timedelta(days=1)), [])
+
+        # the text is matched as is.
+        self.assertEqual([row['description'] for row in self.cm.search_statement('0% j')], ['100% juice_bar'])
+        self.assertEqual(self.cm.search_statement('juic_'), [])
+        self.assertEqual(self.cm.search_statement('%'), self.cm.search_statement('100%'))
+
+        self.assertRaises(InvalidParameterValue, self.cm.search_statement, '')
+        self.assertRaises(InvalidParameterValue, self.cm.search_statement, 'walmart', limit=0)
+
+    def test_spending(self):
+        self.cm.withdraw(Decimal('10.000'), 'Payment at Walmart')
+        self.cm.withdraw(Decimal('20.000'), 'Payment at Starbucks')
+        self.cm.withdraw(Decimal('15.000'), 'Payment at Walmart')
+        self.cm.pay(Decimal('50.000'), 'Payment at Walmart')  # a refund, not spent
+
+        self.assertEqual(
+            [(row['description'], row['withdrawals'], row['spent']) for row in self.cm.get_spending()],
+            [('Payment at Walmart', 2, Decimal('25.000')), ('Payment at Starbucks', 1, Decimal('20.000'))]
+        )
+        self.assertEqual([row['description'] for row in self.cm.get_spending(limit=1)], ['Payment at Walmart'])
+        self.assertEqual([row['description'] for row in self.cm.get_spending(text='star')], ['Payment at Starbucks'])
+        self.assertEqual(self.cm.get_spending(date.today() + timedelta(days=1)), [])
+        self.assertRaises(InvalidParameterValue, self.cm.get_spending, limit=0)
+
+    def test_statement_export(self):
+        self.cm.withdraw(Decimal('10.000'), 'walmart')
+        self.cm.pay(Decimal('10.000'), 'payment, "quoted"')
+
+        out = BytesIO()
+        self.cm.export_statement(out)
+        rows = list(csv.DictReader(out.getvalue().decode('utf-8').splitlines()))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1]['amount'], '-10.000')
+        self.assertEqual(rows[1]['balance'], '990.000')
+        self.assertEqual(rows[2]['description'], 'payment, "quoted"')
+
+        out = BytesIO()
+        self.cm.export_statement(out, format='jsonl')
+        rows = [json.loads(line) for line in out.getvalue().decode('utf-8').splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['eot', 'withdrawal', 'payment'])
+        self.assertEqual(rows[2]['description'], 'payment, "quoted"')
+        self.assertEqual(rows[2]['account_id'], self.account_id)
+
+        self.assertRaises(InvalidParameterValue, self.cm.export_statement, BytesIO(), format='xml')
+
+    def test_bulk_import(self):
+        now = datetime.now()
+        report = self.cm.import_transactions([
+            (now, Decimal('100.000'), 'withdrawal', 'walmart'),
+            (now + timedelta(minutes=1), Decimal('50.000'), 'payment', 'payment 001'),
+            (now + timedelta(minutes=2), Decimal('20.000'), 'withdrawal', 'jewel osco'),
+        ])
+        self.assertEqual(report['rows'], 3)
+        self.assertTrue(report['rows_per_sec'] > 0)
+
+        # the running balance was computed for every row.
+        results = self.ledger()[1:]
+        self.assertEqual([row['amount'] for row in results], [Decimal('-100.000'), Decimal('50.000'), Decimal('-20.000')])
+        self.assertEqual([row['balance'] for row in results], [Decimal('900.000'), Decimal('950.000'), Decimal('930.000')])
+        self.assertEqual(self.cm.get_current_due(), Decimal('70.00'))
+
+        # the regular operations carry on from the imported balance.
+        self.cm.withdraw(Decimal('30.000'), 'walmart')
+        self.assertEqual(self.cm.get_current_due(), Decimal('100.00'))
+
+    def test_bulk_import_is_all_or_nothing(self):
+        now = datetime.now()
+        rows = [
+            (now, Decimal('100.000'), 'withdrawal', 'walmart'),
+            (now + timedelta(minutes=1), Decimal('0.000'), 'withdrawal', 'jewel osco'),
+        ]
+        self.assertRaises(InvalidWithdrawal, self.cm.import_transactions, rows)
+
+        rows = [
+            (now, Decimal('100.000'), 'payment', 'payment 001'),
+            (now - timedelta(days=1), Decimal('100.000'), 'payment', 'payment 002'),
+        ]
+        self.assertRaises(InvalidParameterValue, self.cm.import_transactions, rows)
+
+        # nothing was imported.
+        self.assertEqual(len(self.cm.get_statement()), 1)
+        self.assertEqual(self.cm.get_current_due(), Decimal('0.00'))
+
     def test_due_when_no_transactions_are_done(self):
         self.assertEqual(Decimal('0.000'), self.cm.get_current_due())
 
@@ -266,6 +380,16 @@ class CreditManagerTest(unittest.TestCase):
         day30 = day00 + timedelta(days=30)
         self.assertEqual(self.cm.compute_outstanding(day30), Decimal('514.39'))
 
+        # the interest is charged to the account
+        self.assertEqual(self.cm.get_current_due(), Decimal('514.39'))
+
+        # and the period cannot be closed twice
+        self.assertRaises(
+            InvalidOutstandingInvocation,
+            self.cm.compute_outstanding,
+            day30
+        )
+
     def test_compute_outstanding_case_03(self):
         # additional: case 03
         # on day 1: draws $500
@@ -285,6 +409,57 @@ class CreditManagerTest(unittest.TestCase):
         day30 = day00 + timedelta(days=30)
         self.assertEqual(self.cm.compute_outstanding(day30), Decimal('50.00'))
 
+    def test_backdated_transactions_rebalance_the_ledger(self):
+        day00 = datetime.combine(date.today(), datetime.min.time())
+        self.cm.withdraw(Decimal('100.000'), 'first withdraw', day00 + timedelta(hours=12))
+        self.cm.withdraw(Decimal('100.000'), 'second withdraw', day00 + timedelta(days=5))
+        self.cm.pay(Decimal('50.000'), 'late payment', day00 + timedelta(days=3))
+        self.cm.withdraw(Decimal('25.000'), 'late withdraw', day00 + timedelta(days=5))
+
+        # in insertion order; every balance is the running one.
+        self.assertEqual(
+            [row['balance'] for row in self.ledger()],
+            [Decimal('1000.000'), Decimal('900.000'), Decimal('850.000'), Decimal('950.000'), Decimal('825.000')]
+        )
+        self.assertEqual(self.cm.get_current_due(day00 + timedelta(days=2)), Decimal('100.00'))
+        self.assertEqual(self.cm.get_current_due(day00 + timedelta(days=4)), Decimal('50.00'))
+        self.assertEqual(self.cm.get_current_due(day00 + timedelta(days=10)), Decimal('175.00'))
+        self.assertEqual(self.cm.get_current_due(), Decimal('175.00'))
+
+        # the interest runs on the repaired balances: 100 due for 3 days,
+        # 50 for 2 days and 175 for 25 days.
+        interest = (self.apr / Decimal('365.00')) * (3 * 100 + 2 * 50 + 25 * 175)
+        self.assertEqual(
+            self.cm.compute_outstanding(day00 + timedelta(days=30)),
+            (interest + Decimal('175.000')).quantize(Decimal('.01'), rounding=ROUND_UP)
+        )
+
+    def test_transactions_at_the_same_time(self):
+        day00 = datetime.combine(date.today(), datetime.min.time())
+        noon = day00 + timedelta(hours=12)
+        self.cm.withdraw(Decimal('100.000'), 'first withdraw', noon)
+        self.cm.withdraw(Decimal('50.000'), 'second withdraw', noon)
+        self.cm.pay(Decimal('30.000'), 'payment', noon)
+
+        # the balance as of a later time is the one after the last of them.
+        self.assertEqual(self.cm.get_current_due(noon + timedelta(minutes=1)), Decimal('120.00'))
+        self.assertEqual(self.cm.get_current_due(day00 + timedelta(days=1, hours=1)), Decimal('120.00'))
+
+    def test_transactions_in_closed_periods_are_refused(self):
+        day00 = datetime.combine(date.today(), datetime.min.time())
+        self.cm.withdraw(Decimal('100.000'), 'withdraw', day00 + timedelta(days=1))
+        self.cm.compute_outstanding(day00 + timedelta(days=30))
+        due = self.cm.get_current_due()
+
+        self.assertRaises(PeriodClosed, self.cm.pay, Decimal('50.000'), 'late payment', day00 + timedelta(days=20))
+        self.assertRaises(PeriodClosed, self.cm.withdraw, Decimal('50.000'), 'late withdraw', day00 + timedelta(days=20))
+        self.assertEqual(self.cm.get_current_due(), due)
+
+        # the current period is still open to backdating.
+        self.cm.withdraw(Decimal('10.000'), 'withdraw', day00 + timedelta(days=40))
+        self.cm.pay(Decimal('50.000'), 'late payment', day00 + timedelta(days=30, hours=1))
+        self.assertEqual(self.cm.get_current_due(day00 + timedelta(days=35)), due - Decimal('50.00'))
+
     def test_withdrawal_on_excess_payment(self):
         self.assertEqual(self.cm.pay(Decimal('2000.00'), 'making extra payment'), None)
         self.assertEqual(self.cm.withdraw(Decimal('2500.00'), 'withdrawing more than the limit'), None)
@@ -292,6 +467,108 @@ class CreditManagerTest(unittest.TestCase):
         # check the due
         self.assertEqual(self.cm.get_current_due(), Decimal('500.000'))
 
+    def test_unknown_account(self):
+        cm = CreditManager(self.account_id + 1, self.apr, self.limit, self.period, backend=self.backend)
+
+        self.assertRaises(AccountNotFound, cm.get_current_due)
+        self.assertRaises(AccountNotFound, cm.pay, Decimal('10.000'), 'payment 001')
+        self.assertRaises(AccountNotFound, cm.withdraw, Decimal('10.000'), 'walmart')
+
+    def test_accounts_are_isolated(self):
+        # open a second account with its own opening balance
+        other = CreditManager(self.account_id + 1, self.apr, Decimal('500.000'), self.period, backend=self.backend)
+        other.open_account()
+
+        # transactions on one account must not leak into the other
+        self.cm.withdraw(Decimal('100.000'), 'walmart')
+        other.withdraw(Decimal('500.000'), 'jewel osco')
+
+        self.assertEqual(self.cm.get_current_due(), Decimal('100.00'))
+        self.assertEqual(other.get_current_due(), Decimal('500.00'))
+        self.assertEqual(len(self.cm.get_statement()), 2)
+        self.assertEqual(len(other.get_statement()), 2)
+
+        # the other account is exhausted while this one still has credit
+        self.assertRaises(
+            WithdrawalDenied,
+            other.withdraw,
+            Decimal('10.000'),
+            'walmart'
+        )
+        self.assertEqual(self.cm.withdraw(Decimal('10.000'), 'walmart'), None)
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 is not installed")
+class PostgresCreditManagerTest(CreditManagerTest, unittest.TestCase):
+    """`PostgresCreditManagerTest` runs the test cases against
+    the Postgres backend.
+    """
+    def make_backend(self):
+        # create a database connection to the test db based on the settings
+        conn = psycopg2.connect(DB_CONN_STRING)
+
+        # NOTE: this ideally should not be done and instead each
+        # transaction has to be handled based on the application
+        # logic. Since we know that there will not be many
+        # simultaneous connections to the database in our usecase,
+        # it is okay to autocommit each SQL query to simply some code.
+        conn.autocommit = True
+        
+        # get the cursor object to make queries
+        self.cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        return PostgresBackend()
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        self.cursor.execute("TRUNCATE transaction, daily_balance, account;");
+
+    def ledger(self):
+        """`ledger` fetches all the transactions of the account.
+        """
+        self.cursor.execute("SELECT * FROM transaction WHERE account_id = %s ORDER BY id;", (self.account_id,))
+        return self.cursor.fetchall()
+
+    def test_backdated_transaction_is_not_posted_without_its_repair(self):
+        day00 = datetime.combine(date.today(), datetime.min.time())
+        self.cm.withdraw(Decimal('100.000'), 'withdraw', day00 + timedelta(days=5))
+
+        # the repair fails right after the backdated payment is posted.
+        execute = self.backend._execute
+        def failing(cursor, name, params):
+            if name == 'REPAIR':
+                raise psycopg2.OperationalError("server closed the connection unexpectedly")
+            return execute(cursor, name, params)
+        self.backend._execute = failing
+        with self.assertRaises(psycopg2.OperationalError):
+            self.cm.pay(Decimal('50.000'), 'late payment', day00 + timedelta(days=3))
+        self.backend._execute = execute
+
+        # neither the payment nor the head moved; the ledger is consistent.
+        self.assertEqual([row['balance'] for row in self.ledger()], [Decimal('1000.000'), Decimal('900.000')])
+        self.assertEqual(self.cm.get_current_due(), Decimal('100.00'))
+        self.assertEqual(self.cm.get_current_due(day00 + timedelta(days=4)), Decimal('0.00'))
+
+class MemoryCreditManagerTest(CreditManagerTest, unittest.TestCase):
+    """`MemoryCreditManagerTest` runs the test cases against
+    the in-memory backend.
+    """
+    def make_backend(self):
+        return MemoryBackend()
+
+    def ledger(self):
+        """`ledger` fetches all the transactions of the account.
+        """
+        return self.backend.get_ledger(self.account_id)
+
+    def test_payment_not_posted(self):
+        class Refusing(object):
+            def post(self, *args):
+                return False
+
+        self.cm.writer = Refusing()
+        self.assertRaises(SystemFailed, self.cm.pay, Decimal('100.000'), 'payment')
+
 def main():
     unittest.main()
 
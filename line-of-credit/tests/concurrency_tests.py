@@ -0,0 +1,98 @@
+import sys
+import time
+import unittest
+import threading
+import psycopg2.extras
+from decimal import Decimal
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.exceptions import WithdrawalDenied
+
+class WithdrawalConcurrencyTest(unittest.TestCase):
+    """`WithdrawalConcurrencyTest` stresses the withdrawal path with
+    many parallel withdrawers to make sure no account is overdrawn.
+    """
+    threads = 32
+    withdrawals_per_thread = 50
+    accounts = 4
+
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=16, timeout=30.0)
+        self.managers = []
+        for account_id in range(1, self.accounts + 1):
+            cm = CreditManager(account_id, self.apr, self.limit, self.period, pool=self.pool)
+            cm.open_account()
+            self.managers.append(cm)
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        self.pool.closeall()
+
+    def test_no_overdraft_under_parallel_withdrawals(self):
+        # 32 threads x 50 withdrawals of 7 USD each is far more than
+        # the credit limit of the four accounts put together.
+        amount = Decimal('7.000')
+        granted = [0] * self.threads
+        denied = [0] * self.threads
+
+        def worker(index):
+            cm = self.managers[index % self.accounts]
+            for _ in range(self.withdrawals_per_thread):
+                try:
+                    cm.withdraw(amount, 'stress %d' % index)
+                    granted[index] += 1
+                except WithdrawalDenied:
+                    denied[index] += 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.threads)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        operations = self.threads * self.withdrawals_per_thread
+        self.assertEqual(sum(granted) + sum(denied), operations)
+        sys.stderr.write('\n%d withdrawals in %.2fs (%.0f ops/sec)\n' % (
+            operations, elapsed, operations / elapsed))
+
+        # every account was drained to the last full 7 USD, never below zero.
+        allowed = int(self.limit / amount)
+        self.assertEqual(sum(granted), allowed * self.accounts)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            for cm in self.managers:
+                self.assertEqual(cm.get_current_due(), (allowed * amount).quantize(Decimal('.01')))
+
+                # the ledger agrees with the head and never went negative.
+                cursor.execute("""
+                    SELECT
+                        MIN(balance) AS lowest, COUNT(*) AS entries
+                    FROM
+                        transaction
+                    WHERE
+                        account_id = %s;
+                """, (cm.account_id,))
+                ledger = cursor.fetchone()
+                self.assertTrue(ledger['lowest'] >= Decimal('0.000'))
+                self.assertEqual(ledger['entries'], allowed + 1)  # + opening balance
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
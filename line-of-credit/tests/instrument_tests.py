@@ -0,0 +1,170 @@
+import logging
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.backends import MemoryBackend
+from cmanager.instrument import Instrumentation, CallbackSink, HistogramSink, LogSink, Histogram
+from cmanager.exceptions import WithdrawalDenied
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    from cmanager.pool import ConnectionPool
+    from cmanager.backends.postgres import PostgresBackend
+except ImportError:
+    psycopg2 = None
+
+class InstrumentationTest(unittest.TestCase):
+    """`InstrumentationTest` defines the test cases for the recording
+    of the operations of the credit managers and their sinks.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+
+        self.operations = []
+        self.histograms = HistogramSink()
+        self.instrumentation = Instrumentation([CallbackSink(self.operations.append), self.histograms])
+        self.cm = CreditManager(1, self.apr, self.limit, self.period,
+                                backend=MemoryBackend(), instrumentation=self.instrumentation)
+        self.cm.open_account(self.day00)
+
+    def test_operations_are_recorded(self):
+        self.cm.withdraw(Decimal('100.000'), 'withdraw', self.day00 + timedelta(days=1))
+        self.cm.get_current_due()
+        self.assertEqual(
+            [operation.method for operation in self.operations],
+            ['open_account', 'withdraw', 'get_current_due']
+        )
+        for operation in self.operations:
+            self.assertEqual(operation.account_id, 1)
+            self.assertTrue(operation.elapsed >= 0)
+            self.assertEqual(operation.queries, [])  # no queries in memory
+
+    def test_failures_are_recorded(self):
+        self.assertRaises(WithdrawalDenied, self.cm.withdraw, Decimal('2000.000'), 'withdraw')
+        self.assertEqual(self.operations[-1].error, 'WithdrawalDenied')
+        self.assertEqual(self.histograms.snapshot()['methods']['withdraw']['errors'], 1)
+
+    def test_uninstrumented_manager(self):
+        cm = CreditManager(2, self.apr, self.limit, self.period, backend=MemoryBackend())
+        cm.open_account(self.day00)
+        cm.pay(Decimal('10.000'), 'pay')
+        self.assertEqual(len(self.operations), 1)  # the first account opening only
+
+    def test_broken_sink_does_not_fail_the_operation(self):
+        def broken(operation):
+            raise ValueError(operation.method)
+        self.instrumentation.add_sink(CallbackSink(broken))
+        logging.getLogger('cmanager').disabled = True
+        try:
+            self.cm.pay(Decimal('10.000'), 'pay', self.day00 + timedelta(days=1))
+        finally:
+            logging.getLogger('cmanager').disabled = False
+        self.assertEqual(self.cm.get_current_due(), Decimal('-10.00'))
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for ms in range(1, 101):
+            histogram.add(ms / 1000.0)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['p50_ms'], 50)
+        self.assertEqual(summary['p95_ms'], 100)
+        self.assertEqual(summary['max_ms'], 100)
+
+        for day in range(1, 6):
+            self.cm.pay(Decimal('1.000'), 'pay', self.day00 + timedelta(days=day))
+        self.assertEqual(self.histograms.snapshot()['methods']['pay']['count'], 5)
+
+    def test_log_sink(self):
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        log = logging.getLogger('cmanager.tests')
+        log.addHandler(Handler())
+        log.propagate = False
+        self.instrumentation.add_sink(LogSink(log, logging.WARNING))
+        self.cm.pay(Decimal('10.000'), 'pay', self.day00 + timedelta(days=1))
+        self.assertEqual(len(records), 1)
+        self.assertTrue(records[0].startswith('pay account=1 elapsed='))
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 is not installed")
+class PostgresInstrumentationTest(unittest.TestCase):
+    """`PostgresInstrumentationTest` defines the test cases for the
+    queries recorded by the Postgres backend and the slow query capture.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.day00 = datetime(2015, 1, 1)
+        self.operations = []
+        self.instrumentation = Instrumentation([CallbackSink(self.operations.append)])
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=2)
+        self.cm = CreditManager(1, Decimal('0.350'), Decimal('1000.000'), 30,
+                                backend=PostgresBackend(self.pool), instrumentation=self.instrumentation)
+        self.cm.open_account(self.day00)
+        # owed at the end of the first day, hence charged interest.
+        self.cm.withdraw(Decimal('100.000'), 'withdraw', self.day00 + timedelta(hours=12))
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        self.pool.closeall()
+
+    def test_queries_are_recorded(self):
+        self.cm.compute_outstanding(self.day00 + timedelta(days=30))
+        operation = self.operations[-1]
+        self.assertEqual(operation.method, 'compute_outstanding')
+        self.assertEqual(
+            [query.name for query in operation.queries],
+            ['HEAD', 'BALANCE_AS_OF', 'BALANCE_AS_OF', 'PERIOD_SUMMARY', 'CLOSE_PERIOD']
+        )
+        self.assertEqual(operation.rows, 5)
+        self.assertTrue(sum(query.elapsed for query in operation.queries) <= operation.elapsed)
+        self.assertTrue(all(query.plan is None for query in operation.queries))
+
+        self.cm.get_statement(self.day00)
+        self.assertEqual(self.operations[-1].rows, 3)  # opening, withdrawal and eot
+
+    def test_slow_queries_are_explained(self):
+        self.instrumentation.slow_query = 0.0  # every query is slow
+        for day in range(2, 5):
+            self.cm.withdraw(Decimal('100.000'), 'withdraw', self.day00 + timedelta(days=day))
+            plan = self.operations[-1].queries[0].plan
+            self.assertTrue('actual time' in plan)
+
+        # the writes under EXPLAIN ANALYZE were rolled back, and the
+        # connections left idle.
+        self.instrumentation.slow_query = None
+        self.assertEqual(len(self.cm.get_statement(self.day00)), 5)
+        self.assertEqual(self.cm.get_current_due(), Decimal('400.00'))
+        with self.pool.connection() as conn:
+            self.cm.backend._explain(conn, 'HEAD', {'account_id': 1})
+            self.assertEqual(conn.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+        # and every withdrawal was committed.
+        self.pool.closeall()
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=2)
+        cm = CreditManager(1, Decimal('0.350'), Decimal('1000.000'), 30, backend=PostgresBackend(self.pool))
+        self.assertEqual(cm.get_current_due(), Decimal('400.00'))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
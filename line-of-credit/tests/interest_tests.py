@@ -0,0 +1,143 @@
+import random
+import unittest
+import psycopg2
+import psycopg2.extras
+from decimal import Decimal, ROUND_UP
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager, queries
+from cmanager.backends import MemoryBackend
+from cmanager.exceptions import WithdrawalDenied
+
+def reference_outstanding(cursor, cm, as_of):
+    """`reference_outstanding` computes the outstanding of the period
+    the way `compute_outstanding` used to: by pulling every transaction
+    since the previous eot and iterating over them row by row.
+    """
+    interest = Decimal('0.000')
+    cursor.execute("SELECT last_eot FROM account WHERE id = %s;", (cm.account_id,))
+    previous_eot = cursor.fetchone()['last_eot']
+
+    cursor.execute("""
+        SELECT balance FROM transaction
+        WHERE account_id = %s AND tstamp < %s ORDER BY tstamp DESC LIMIT 1;
+    """, (cm.account_id, as_of))
+    due = (cm.limit - cursor.fetchone()['balance']).quantize(Decimal('.01'), rounding=ROUND_UP)
+
+    cursor.execute("""
+        SELECT balance FROM transaction
+        WHERE account_id = %s AND tstamp < %s ORDER BY tstamp DESC LIMIT 1;
+    """, (cm.account_id, previous_eot + timedelta(days=1)))
+    outstanding = cm.limit - cursor.fetchone()['balance']
+
+    if outstanding > Decimal('0.000'):
+        cursor.execute("""
+            SELECT SUM(amount) AS amounts FROM transaction
+            WHERE account_id = %s AND type='payment' AND tstamp >= %s;
+        """, (cm.account_id, previous_eot))
+        payments = cursor.fetchone()['amounts'] or Decimal('0.000')
+        if payments < outstanding:
+            cursor.execute("""
+                SELECT balance, tstamp FROM transaction
+                WHERE account_id = %s AND tstamp >= %s ORDER BY tstamp, id;
+            """, (cm.account_id, previous_eot))
+            rows = cursor.fetchall()
+            prev_transaction = rows[0]
+            for transaction in rows[1:]:
+                due = cm.limit - prev_transaction['balance']
+                interest += (transaction['tstamp'].date() - prev_transaction['tstamp'].date()).days * (cm.apr/Decimal('365.00')) * due
+                prev_transaction = transaction
+            due = cm.limit - prev_transaction['balance']
+            interest += (as_of.date() - prev_transaction['tstamp'].date()).days * (cm.apr/Decimal('365.00')) * due
+
+    return (interest + due).quantize(Decimal('.01'), rounding=ROUND_UP)
+
+class InterestRegressionTest(unittest.TestCase):
+    """`InterestRegressionTest` checks that the set based interest
+    computation of `compute_outstanding` matches the row by row
+    computation on randomized ledgers.
+    """
+    ledgers = 50
+
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        conn = psycopg2.connect(DB_CONN_STRING)
+        conn.autocommit = True
+        self.cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        self.random = random.Random(20151101)
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        self.cursor.execute("TRUNCATE transaction, daily_balance, account;")
+
+    def random_ledger(self, account_id, backend=None):
+        apr = Decimal(self.random.randint(1, 600)) / 1000
+        limit = Decimal(self.random.randint(100, 5000))
+        period = 30
+        cm = CreditManager(account_id, apr, limit, period, backend=backend)
+
+        day00 = datetime(2015, 1, 1)
+        cm.open_account(day00)
+        offsets = sorted(self.random.randint(0, period * 86400) for _ in range(self.random.randint(0, 40)))
+        for offset in offsets:
+            amount = Decimal(self.random.randint(1, 50000)) / 100
+            tstamp = day00 + timedelta(seconds=offset)
+            if self.random.random() < 0.3:
+                cm.pay(amount, 'payment', tstamp)
+            else:
+                try:
+                    cm.withdraw(amount, 'withdrawal', tstamp)
+                except WithdrawalDenied:
+                    pass
+        return cm, day00 + timedelta(days=period, hours=self.random.randint(0, 23))
+
+    def test_set_based_interest_matches_row_by_row(self):
+        for account_id in range(1, self.ledgers + 1):
+            cm, as_of = self.random_ledger(account_id)
+            expected = reference_outstanding(self.cursor, cm, as_of)
+            self.assertEqual(cm.compute_outstanding(as_of), expected)
+
+    def test_rollup_matches_ledger(self):
+        def rollup(account_id):
+            self.cursor.execute("""
+                SELECT day, tstamp, balance, payments FROM daily_balance
+                WHERE account_id = %s ORDER BY day;
+            """, (account_id,))
+            return [tuple(row) for row in self.cursor.fetchall()]
+
+        for account_id in range(1, self.ledgers + 1):
+            cm, as_of = self.random_ledger(account_id)
+            cm.compute_outstanding(as_of)
+
+            # the incrementally maintained rollup is the one built
+            # from the ledger from scratch.
+            maintained = rollup(account_id)
+            self.cursor.execute(queries.ROLLUP_REBUILD, {'account_id': account_id})
+            self.assertEqual(maintained, rollup(account_id))
+
+    def test_memory_backend_matches_postgres(self):
+        for account_id in range(1, self.ledgers + 1):
+            # replay the very same ledger on both backends.
+            state = self.random.getstate()
+            cm, as_of = self.random_ledger(account_id)
+            self.random.setstate(state)
+            memory, _ = self.random_ledger(account_id, MemoryBackend())
+
+            self.assertEqual(
+                [(row['tstamp'], row['amount'], row['type']) for row in memory.get_statement()],
+                [(row['tstamp'], row['amount'], row['type']) for row in cm.get_statement()]
+            )
+            self.assertEqual(memory.get_current_due(as_of), cm.get_current_due(as_of))
+            self.assertEqual(memory.compute_outstanding(as_of), cm.compute_outstanding(as_of))
+            self.assertEqual(memory.get_current_due(), cm.get_current_due())
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import random
+import unittest
+from fractions import Fraction
+from decimal import Decimal, ROUND_UP
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager, money
+from cmanager.backends import MemoryBackend
+from cmanager.exceptions import InvalidParameterValue
+
+try:
+    import psycopg2
+    from cmanager.pool import ConnectionPool
+    from cmanager.backends.postgres import PostgresBackend
+except ImportError:
+    psycopg2 = None
+
+class MoneyTest(unittest.TestCase):
+    """`MoneyTest` defines the test cases for the minor unit
+    representation of the amounts and its rounding.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.random = random.Random(20151215)
+
+    def test_conversions(self):
+        self.assertEqual(money.to_minor(Decimal('1000.000')), 1000000000)
+        self.assertEqual(money.to_minor(Decimal('-0.000001')), -1)
+        self.assertEqual(money.from_minor(1500000), Decimal('1.5'))
+        self.assertEqual(str(money.from_minor(0)), '0.000000')
+        self.assertRaises(InvalidParameterValue, money.to_minor, Decimal('0.0000001'))
+        self.assertTrue(money.in_minor_units(Decimal('12.34')))
+        self.assertFalse(money.in_minor_units(Decimal('1.0000005')))
+
+    def test_round_up_matches_quantize(self):
+        for _ in range(10000):
+            units = self.random.randint(-10 ** 10, 10 ** 10)
+            expected = money.from_minor(units).quantize(Decimal('.01'), rounding=ROUND_UP)
+            self.assertEqual(money.to_cents(units), expected)
+            self.assertEqual(str(money.to_cents(units)), str(expected))
+        self.assertEqual(money.round_up(10001), 20000)
+        self.assertEqual(money.round_up(-10001), -20000)
+        self.assertEqual(money.round_up(-10000), -10000)
+        self.assertEqual(money.round_up(0), 0)
+
+    def test_interest_is_exact(self):
+        for _ in range(10000):
+            apr = Decimal(self.random.randint(1, 600)) / 1000
+            weighted_due = Decimal(self.random.randint(-10 ** 9, 10 ** 9)) / 1000
+            exact = Fraction(apr) * Fraction(weighted_due) * money.UNITS / 365
+            units = money.interest(apr, weighted_due)
+            # rounded away from zero, by less than a minor unit.
+            self.assertTrue(abs(units) >= abs(exact) > abs(units) - 1)
+            # hence up to the cent like the exact interest.
+            dollars = exact / money.UNITS
+            self.assertEqual(
+                money.to_cents(units),
+                (Decimal(dollars.numerator) / Decimal(dollars.denominator)).quantize(Decimal('.01'), rounding=ROUND_UP)
+            )
+        self.assertEqual(money.interest(Decimal('0.365'), Decimal('100.000')), 100000)
+        # any exponent, and more digits than the decimal context holds.
+        self.assertEqual(money.interest(Decimal('0.365'), Decimal('1E+2')), 100000)
+        self.assertEqual(money.interest(Decimal('0.365'), Decimal('-100')), -100000)
+        self.assertEqual(money.interest(Decimal('0.35'), Decimal('1.' + '0' * 40 + '1')), 959)
+
+    def test_interest_is_charged_in_minor_units(self):
+        day00 = datetime(2015, 1, 1)
+        cm = CreditManager(1, Decimal('0.350'), Decimal('1000.000'), 30, backend=MemoryBackend())
+        cm.open_account(day00)
+        cm.withdraw(Decimal('100.000'), 'withdrawal', day00 + timedelta(hours=1))
+
+        # 100 due for 30 days: 2.876712328... rounded up to 2.876713.
+        self.assertEqual(cm.compute_outstanding(day00 + timedelta(days=30)), Decimal('102.88'))
+        self.assertEqual(cm.get_statement(day00)[-1]['amount'], Decimal('-2.876713'))
+        self.assertEqual(cm.get_current_due(), Decimal('102.88'))
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 is not installed")
+class MinorUnitStorageTest(unittest.TestCase):
+    """`MinorUnitStorageTest` runs the credit manager against the schema
+    migrated to minor units (`minor_units.sql`), migrated back after.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=2)
+        with cls.pool.connection() as conn:
+            with open('minor_units.sql') as migration:
+                conn.cursor().execute(migration.read())
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.pool.connection() as conn:
+            conn.cursor().execute("""
+                ALTER TABLE account
+                    ALTER COLUMN credit_limit TYPE NUMERIC USING credit_limit / 1000000.0,
+                    ALTER COLUMN balance TYPE NUMERIC USING balance / 1000000.0;
+                ALTER TABLE transaction
+                    ALTER COLUMN amount TYPE NUMERIC USING amount / 1000000.0,
+                    ALTER COLUMN balance TYPE NUMERIC USING balance / 1000000.0;
+                ALTER TABLE daily_balance
+                    ALTER COLUMN balance TYPE NUMERIC USING balance / 1000000.0,
+                    ALTER COLUMN payments TYPE NUMERIC USING payments / 1000000.0;
+            """)
+        cls.pool.closeall()
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+
+    def replay(self, backend):
+        day00 = datetime(2015, 1, 1)
+        cm = CreditManager(1, Decimal('0.350'), Decimal('1000.000'), 30, backend=backend)
+        cm.open_account(day00)
+        cm.withdraw(Decimal('500.000'), 'withdrawal', day00 + timedelta(hours=1))
+        cm.pay(Decimal('120.125'), 'payment', day00 + timedelta(days=10))
+        cm.withdraw(Decimal('33.333333'), 'withdrawal', day00 + timedelta(days=12))
+        cm.pay(Decimal('10.000'), 'backdated payment', day00 + timedelta(days=5))
+        return cm, day00 + timedelta(days=30)
+
+    def test_matches_the_memory_backend(self):
+        cm, as_of = self.replay(PostgresBackend(self.pool, minor_units=True))
+        memory, _ = self.replay(MemoryBackend())
+
+        self.assertEqual(cm.get_current_due(as_of), memory.get_current_due(as_of))
+        self.assertEqual(cm.compute_outstanding(as_of), memory.compute_outstanding(as_of))
+        self.assertEqual(cm.get_current_due(), memory.get_current_due())
+        self.assertEqual(
+            [(row['tstamp'], row['amount']) for row in cm.get_statement()],
+            [(row['tstamp'], row['amount']) for row in memory.get_statement()]
+        )
+
+        # the amounts are stored as integers.
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT balance FROM account WHERE id = 1;")
+            self.assertEqual(cursor.fetchone()[0], money.to_minor(memory.backend.get_head(1)['balance']))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import unittest
+import psycopg2.extras
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.partitions import (
+    ensure_partitions, list_partitions, archivable_partitions, archive_partitions
+)
+from cmanager.exceptions import InvalidParameterValue
+
+def drop_partitions(cursor):
+    """`drop_partitions` drops the monthly partitions of the ledger,
+    attached or detached (archived), which the test cases created.
+    """
+    cursor.execute("""
+        SELECT
+            relname
+        FROM
+            pg_class
+        WHERE
+            relkind IN ('r', 'p') AND relname ~ '^transaction_y[0-9]{4}m[0-9]{2}$';
+    """)
+    for (name,) in cursor.fetchall():
+        cursor.execute("DROP TABLE %s;" % name)
+
+class PartitionTest(unittest.TestCase):
+    """`PartitionTest` defines the test cases for the monthly
+    partitions of the ledger and their archival.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=2)
+
+        # opened on day 0, drawing $100 every ten days (in the default
+        # partition as long as no monthly partition exists).
+        self.cm = CreditManager(1, self.apr, self.limit, self.period, pool=self.pool)
+        self.cm.open_account(self.day00)
+        for day in range(0, 60, 10):
+            self.cm.withdraw(Decimal('100.000'), 'withdraw %d' % day, self.day00 + timedelta(days=day))
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data and the partitions.
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("TRUNCATE transaction, daily_balance, account;")
+            drop_partitions(cursor)
+        self.pool.closeall()
+
+    def placement(self):
+        """`placement` counts the transactions of each partition.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute("""
+                SELECT
+                    tableoid::regclass::text AS partition, COUNT(*) AS entries
+                FROM
+                    transaction
+                GROUP BY
+                    tableoid;
+            """)
+            return dict((row['partition'], row['entries']) for row in cursor.fetchall())
+
+    def test_ensure_creates_upcoming_months(self):
+        with self.pool.connection() as conn:
+            created = ensure_partitions(conn, self.day00, months_ahead=3)
+            self.assertEqual(created, [
+                'transaction_y2015m01', 'transaction_y2015m02',
+                'transaction_y2015m03', 'transaction_y2015m04',
+            ])
+            # nothing to do the second time.
+            self.assertEqual(ensure_partitions(conn, self.day00, months_ahead=3), [])
+            self.assertRaises(InvalidParameterValue, ensure_partitions, conn, self.day00, -1)
+
+    def test_rows_move_out_of_default_partition(self):
+        self.assertEqual(self.placement(), {'transaction_default': 7})
+        with self.pool.connection() as conn:
+            ensure_partitions(conn, self.day00, months_ahead=1)
+
+        # January holds the opening balance and 4 withdrawals.
+        self.assertEqual(self.placement(), {'transaction_y2015m01': 5, 'transaction_y2015m02': 2})
+        self.assertEqual(self.cm.get_current_due(), Decimal('600.00'))
+        self.assertEqual(self.cm.get_current_due(self.day00 + timedelta(days=15)), Decimal('200.00'))
+
+        # new transactions go straight to their month.
+        self.cm.pay(Decimal('50.000'), 'payment', self.day00 + timedelta(days=45))
+        self.assertEqual(self.placement()['transaction_y2015m02'], 3)
+
+    def test_archive_detaches_fully_eotd_months(self):
+        with self.pool.connection() as conn:
+            ensure_partitions(conn, self.day00, months_ahead=3)
+
+        # the eots of Jan 31 and Mar 2 close January and February.
+        self.cm.compute_outstanding(self.day00 + timedelta(days=30))
+        due = self.cm.compute_outstanding(self.day00 + timedelta(days=60))
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # no month ends before the cut off.
+            self.assertEqual(archivable_partitions(cursor, self.day00 + timedelta(days=30)), [])
+            self.assertEqual(
+                archive_partitions(conn),
+                ['transaction_y2015m01', 'transaction_y2015m02']
+            )
+            self.assertEqual(
+                [name for name, _, _ in list_partitions(cursor)],
+                ['transaction_y2015m03', 'transaction_y2015m04']
+            )
+            # the detached months are kept as plain tables.
+            cursor.execute("DROP TABLE transaction_y2015m01, transaction_y2015m02;")
+
+        # the current period carries on with the recent partitions only.
+        self.assertEqual(self.cm.get_current_due(), due)
+        self.assertEqual(self.cm.get_current_due(self.day00 + timedelta(days=61)), due)
+        self.cm.withdraw(Decimal('100.000'), 'withdraw 70', self.day00 + timedelta(days=70))
+        self.assertTrue(self.cm.compute_outstanding(self.day00 + timedelta(days=90)) > due)
+        self.assertEqual(len(self.cm.get_statement(self.day00)), 3)  # eot, withdrawal and eot
+
+    def test_open_period_blocks_archival(self):
+        with self.pool.connection() as conn:
+            ensure_partitions(conn, self.day00, months_ahead=3)
+        self.cm.compute_outstanding(self.day00 + timedelta(days=30))
+        self.cm.compute_outstanding(self.day00 + timedelta(days=60))
+
+        # an account never closed since day 0 still needs January.
+        other = CreditManager(2, self.apr, self.limit, self.period, pool=self.pool)
+        other.open_account(self.day00)
+        with self.pool.connection() as conn:
+            self.assertEqual(archive_partitions(conn, drop=True), [])
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import unittest
+import threading
+import psycopg2.extensions
+from decimal import Decimal
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.exceptions import PoolTimeout, InvalidParameterValue
+
+class ConnectionPoolTest(unittest.TestCase):
+    """`ConnectionPoolTest` defines the test cases for the
+    connection pool shared by the credit managers.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.account_id = 1
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=4, timeout=5.0)
+        self.cm = CreditManager(self.account_id, self.apr, self.limit, self.period, pool=self.pool)
+        self.cm.open_account()
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        self.pool.closeall()
+
+    def test_invalid_pool_size(self):
+        self.assertRaises(InvalidParameterValue, ConnectionPool, DB_CONN_STRING, 2, 1)
+        self.assertRaises(InvalidParameterValue, ConnectionPool, DB_CONN_STRING, 0, 0)
+
+    def test_manager_shared_across_threads(self):
+        def worker():
+            for _ in range(25):
+                self.cm.pay(Decimal('1.000'), 'payment')
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # all the 200 payments made it, over at most 4 connections.
+        self.assertEqual(self.cm.get_current_due(), Decimal('-200.00'))
+        stats = self.pool.stats()
+        self.assertEqual(stats['in_use'], 0)
+        self.assertTrue(stats['size'] <= 4)
+        self.assertTrue(stats['checkouts'] >= 201)
+
+    def test_checkout_timeout(self):
+        pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1, timeout=0.1)
+        conn = pool.getconn()
+        try:
+            self.assertRaises(PoolTimeout, pool.getconn)
+        finally:
+            pool.putconn(conn)
+
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertTrue(stats['wait_time'] >= 0.1)
+        self.assertEqual(stats['in_use'], 0)
+        pool.closeall()
+
+    def test_open_transaction_is_rolled_back(self):
+        pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+        conn = pool.getconn()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN;")
+        cursor.execute("SELECT id FROM account WHERE id = 1 FOR UPDATE;")
+        pool.putconn(conn)
+
+        conn = pool.getconn()
+        self.assertEqual(conn.get_transaction_status(), psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.assertTrue(conn.autocommit)
+        pool.putconn(conn)
+        pool.closeall()
+
+        # the row lock went with the transaction.
+        self.cm.pay(Decimal('1.000'), 'payment')
+        self.assertEqual(self.cm.get_current_due(), Decimal('-1.00'))
+
+    def test_broken_connection_is_replaced(self):
+        pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1, ping_after=0.0)
+        conn = pool.getconn()
+        pool.putconn(conn)
+
+        # the idle connection dies behind the pool's back.
+        conn.close()
+        fresh = pool.getconn()
+        self.assertFalse(fresh is conn)
+        self.assertFalse(fresh.closed)
+        pool.putconn(fresh)
+
+        stats = pool.stats()
+        self.assertEqual(stats['discarded'], 1)
+        self.assertEqual(stats['size'], 1)
+        pool.closeall()
+
+    def test_recently_used_connection_is_not_pinged(self):
+        pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+        conn = pool.getconn()
+        pool.putconn(conn)
+
+        # handed out again without a round trip.
+        def ping():
+            raise AssertionError("the connection was pinged")
+        conn.cursor = ping
+        self.assertTrue(pool.getconn() is conn)
+        del conn.cursor
+        pool.putconn(conn)
+        pool.closeall()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING
+
+from cmanager import CreditManager
+from cmanager.pool import ConnectionPool
+from cmanager.prepared import Statement, statement
+from cmanager.backends.postgres import PostgresBackend
+
+class PreparedStatementTest(unittest.TestCase):
+    """`PreparedStatementTest` defines the test cases for the server
+    side prepared statements run by the Postgres backend.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+
+        # a single connection, so every statement runs on the same session.
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=1)
+        self.cm = CreditManager(1, self.apr, self.limit, self.period, backend=PostgresBackend(self.pool))
+        self.cm.open_account(self.day00)
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        self.pool.closeall()
+
+    def prepared(self):
+        """`prepared` lists the statements prepared on the session.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM pg_prepared_statements ORDER BY name;")
+            return [name for (name,) in cursor.fetchall()]
+
+    def test_parameters_are_numbered_once(self):
+        stmt = Statement('CLOSE_PERIOD')
+        self.assertEqual(stmt.name, 'cmanager_close_period')
+        self.assertEqual(stmt.params, ['interest', 'as_of', 'account_id', 'previous_eot', 'description'])
+        self.assertTrue('%(' not in stmt.prepare)
+        self.assertTrue(stmt.prepare.startswith(
+            'PREPARE cmanager_close_period (NUMERIC, TIMESTAMP, BIGINT, TIMESTAMP, VARCHAR) AS'
+        ))
+        self.assertEqual(stmt.execute, 'EXECUTE cmanager_close_period (%s, %s, %s, %s, %s);')
+        self.assertTrue(statement('CLOSE_PERIOD') is statement('CLOSE_PERIOD'))
+
+    def test_minor_unit_statements(self):
+        stmt = statement('CLOSE_PERIOD', minor_units=True)
+        self.assertEqual(stmt.name, 'cmanager_close_period_minor')
+        self.assertTrue(stmt.prepare.startswith(
+            'PREPARE cmanager_close_period_minor (BIGINT, TIMESTAMP, BIGINT, TIMESTAMP, VARCHAR) AS'
+        ))
+        self.assertFalse(stmt is statement('CLOSE_PERIOD'))
+
+    def test_statements_without_parameters(self):
+        stmt = statement('REPLICATION_LAG')
+        self.assertEqual(stmt.params, [])
+        self.assertTrue(stmt.prepare.startswith('PREPARE cmanager_replication_lag AS'))
+        self.assertEqual(stmt.execute, 'EXECUTE cmanager_replication_lag;')
+        self.assertEqual(PostgresBackend(self.pool).replication_lag(), 0.0)  # not a standby
+
+    def test_statements_are_prepared_once(self):
+        # from the first day on, hence owed at its end (the period is
+        # summarized).
+        for day in range(10):
+            self.cm.withdraw(Decimal('10.000'), 'withdraw %d' % day, self.day00 + timedelta(days=day, hours=12))
+            self.cm.pay(Decimal('5.000'), 'pay %d' % day, self.day00 + timedelta(days=day, hours=12))
+        self.assertEqual(self.cm.get_current_due(), Decimal('50.00'))
+        self.cm.compute_outstanding(self.day00 + timedelta(days=30))
+
+        self.assertEqual(self.prepared(), [
+            'cmanager_balance_as_of', 'cmanager_close_period', 'cmanager_head',
+            'cmanager_open_account', 'cmanager_period_summary', 'cmanager_post',
+        ])
+        # the pool holds a single connection: one checkout at a time.
+        with self.pool.connection() as conn:
+            remembered = sorted(conn.prepared)
+        self.assertEqual(remembered, self.prepared())
+
+    def test_deallocated_statements_are_prepared_again(self):
+        self.cm.withdraw(Decimal('100.000'), 'withdraw', self.day00 + timedelta(days=1))
+        with self.pool.connection() as conn:
+            conn.cursor().execute("DEALLOCATE ALL;")
+        self.cm.withdraw(Decimal('100.000'), 'withdraw', self.day00 + timedelta(days=2))
+        self.assertEqual(self.cm.get_current_due(), Decimal('200.00'))
+
+    def test_deallocated_statements_are_prepared_again_in_transactions(self):
+        # a backdated payment is posted along with its repair in one
+        # transaction, which runs again once the statements are prepared.
+        self.cm.withdraw(Decimal('100.000'), 'withdraw', self.day00 + timedelta(days=3))
+        self.cm.pay(Decimal('10.000'), 'late payment', self.day00 + timedelta(days=2))
+        with self.pool.connection() as conn:
+            conn.cursor().execute("DEALLOCATE ALL;")
+        self.cm.pay(Decimal('20.000'), 'late payment', self.day00 + timedelta(days=1))
+        self.assertEqual(self.cm.get_current_due(self.day00 + timedelta(days=2, hours=12)), Decimal('-30.00'))
+        self.assertEqual(self.cm.get_current_due(), Decimal('70.00'))
+
+    def test_arguments_are_not_sql(self):
+        description = "Robert'); DROP TABLE transaction; -- %s %(x)s $1"
+        self.cm.withdraw(Decimal('100.000'), description, self.day00 + timedelta(days=1))
+        self.assertEqual(self.cm.get_statement(self.day00)[-1]['description'], description)
+
+    def test_unprepared_backend(self):
+        cm = CreditManager(2, self.apr, self.limit, self.period, backend=PostgresBackend(self.pool, prepare=False))
+        cm.open_account(self.day00)
+        cm.withdraw(Decimal('100.000'), 'withdraw', self.day00 + timedelta(days=1))
+        self.assertEqual(cm.get_current_due(), Decimal('100.00'))
+        # only the manager of the first account prepared its statements.
+        self.assertEqual(self.prepared(), ['cmanager_open_account'])
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
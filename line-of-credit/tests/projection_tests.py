@@ -0,0 +1,121 @@
+import random
+import unittest
+from decimal import Decimal, ROUND_UP
+from datetime import datetime, timedelta
+
+from cmanager import CreditManager
+from cmanager.backends import MemoryBackend
+from cmanager.exceptions import InvalidParameterValue, InvalidPayment, WithdrawalDenied
+
+try:
+    import numpy
+    from cmanager.projection import Scenario
+except ImportError:
+    numpy = None
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class ProjectionTest(unittest.TestCase):
+    """`ProjectionTest` checks the what-if projections of the outstanding
+    against `compute_outstanding` run on the ledger the scenario leads to.
+    """
+    ledgers = 20
+    scenarios = 25
+
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.random = random.Random(20151201)
+        self.day00 = datetime(2015, 1, 1)
+        self.period = 30
+
+    def history(self):
+        """`history` is a random ledger over the first half of the period.
+        """
+        limit = Decimal(self.random.randint(100, 5000))
+        # a withdrawal on the first day, the outstanding of the period.
+        rows = [(
+            self.day00 + timedelta(minutes=self.random.randint(1, 24 * 60 - 1)),
+            Decimal(self.random.randint(1, int(limit) * 100)) / 200, 'withdrawal'
+        )]
+        for _ in range(self.random.randint(0, 15)):
+            tstamp = self.day00 + timedelta(minutes=self.random.randint(0, 15 * 24 * 60))
+            amount = Decimal(self.random.randint(1, int(limit) * 100)) / 200
+            rows.append((tstamp, amount, self.random.choice(['withdrawal', 'withdrawal', 'payment'])))
+        return limit, sorted(rows)
+
+    def replay(self, limit, rows, apr, payments=()):
+        """`replay` opens an account in memory and posts the history
+        along with the payments of a scenario.
+        """
+        cm = CreditManager(1, apr, limit, self.period, backend=MemoryBackend())
+        cm.open_account(self.day00)
+        for tstamp, amount, kind in rows:
+            if kind == 'payment':
+                cm.pay(amount, 'payment', tstamp)
+            else:
+                try:
+                    cm.withdraw(amount, 'withdrawal', tstamp)
+                except WithdrawalDenied:
+                    pass
+        for tstamp, amount in payments:
+            cm.pay(amount, 'what-if payment', tstamp)
+        return cm
+
+    def random_scenario(self, limit):
+        apr = Decimal(self.random.randint(1, 600)) / 1000
+        payments = []
+        for _ in range(self.random.randint(0, 4)):
+            # after the history (the memory ledger does not rebalance
+            # backdated transactions), before the end of the period.
+            tstamp = self.day00 + timedelta(days=16, minutes=self.random.randint(0, 13 * 24 * 60))
+            payments.append((tstamp, Decimal(self.random.randint(1, int(limit) * 10)) / 200))
+        return Scenario(apr, sorted(payments))
+
+    def test_projection_matches_compute_outstanding(self):
+        end = self.day00 + timedelta(days=self.period)
+        for _ in range(self.ledgers):
+            limit, rows = self.history()
+            cm = self.replay(limit, rows, Decimal('0.350'))
+            scenarios = [self.random_scenario(limit) for _ in range(self.scenarios)]
+            projected = cm.project_outstanding(scenarios)
+            self.assertEqual(len(projected), len(scenarios))
+
+            for scenario, outstanding in zip(scenarios, projected):
+                expected = self.replay(limit, rows, scenario.apr, scenario.payments).compute_outstanding(end)
+                self.assertEqual(outstanding, expected)
+
+            # nothing was written.
+            self.assertEqual(cm.get_current_due(end), self.replay(limit, rows, Decimal('0.350')).get_current_due(end))
+
+    def test_payment_on_the_eot_day_clears_the_outstanding(self):
+        cm = self.replay(Decimal('1000.000'), [], Decimal('0.350'))
+        cm.compute_outstanding(self.day00 + timedelta(days=30))  # nothing due
+        cm.withdraw(Decimal('500.000'), 'withdrawal', self.day00 + timedelta(days=30, hours=1))
+
+        eot = self.day00 + timedelta(days=30)
+        projected = cm.project_outstanding([
+            Scenario(Decimal('0.350')),
+            Scenario(Decimal('0.350'), [(eot + timedelta(hours=2), Decimal('500.000'))]),
+            Scenario(Decimal('0.350'), [(eot + timedelta(days=5), Decimal('500.000'))]),
+        ])
+        # 500 owed for the whole period, cleared on the eot day, or
+        # cleared (hence no interest) five days in.
+        self.assertEqual(projected, [
+            (Decimal('500.000') + Decimal('0.350') / Decimal('365.00') * (30 * 500)).quantize(Decimal('.01'), rounding=ROUND_UP),
+            Decimal('0.00'), Decimal('0.00'),
+        ])
+
+    def test_invalid_scenarios(self):
+        cm = self.replay(Decimal('1000.000'), [], Decimal('0.350'))
+        before = self.day00 - timedelta(days=1)
+        after = self.day00 + timedelta(days=31)
+        self.assertRaises(InvalidParameterValue, cm.project_outstanding, [Scenario(Decimal('0.350'), [(before, Decimal('1'))])])
+        self.assertRaises(InvalidParameterValue, cm.project_outstanding, [Scenario(Decimal('0.350'), [(after, Decimal('1'))])])
+        self.assertRaises(InvalidPayment, cm.project_outstanding, [Scenario(Decimal('0.350'), [(self.day00, Decimal('0'))])])
+        self.assertRaises(InvalidParameterValue, cm.project_outstanding, [], self.day00)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
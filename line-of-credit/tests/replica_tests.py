@@ -0,0 +1,180 @@
+import time
+import unittest
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import DB_CONN_STRING, REPLICA_CONN_STRINGS
+
+from cmanager import CreditManager
+from cmanager.backends import MemoryBackend
+from cmanager.replica import ReplicaSet
+from cmanager.exceptions import InvalidParameterValue, SystemFailed
+
+try:
+    import psycopg2
+    from cmanager.pool import ConnectionPool
+    from cmanager.backends.postgres import PostgresBackend
+except ImportError:
+    psycopg2 = None
+
+class StandbyBackend(MemoryBackend):
+    """`StandbyBackend` is an in-memory replica which lags behind
+    or fails on demand.
+    """
+    def __init__(self):
+        super(StandbyBackend, self).__init__()
+        self.lag = 0.0
+        self.down = False
+        self.failing = False  # the reads only
+
+    def replication_lag(self):
+        if self.down:
+            raise SystemFailed("could not connect to server")
+        return self.lag
+
+    def get_head(self, account_id):
+        if self.down or self.failing:
+            raise SystemFailed("could not connect to server")
+        return super(StandbyBackend, self).get_head(account_id)
+
+class ReplicaRoutingTest(unittest.TestCase):
+    """`ReplicaRoutingTest` defines the test cases for the routing of
+    the read-only calls to the replicas. The replicas are stale copies
+    of the account (opened, without the later writes), hence what a
+    call returns tells where it was read.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+
+        self.primary = MemoryBackend()
+        self.standbys = [StandbyBackend(), StandbyBackend()]
+        for backend in [self.primary] + self.standbys:
+            backend.open_account(1, self.apr, self.limit, self.period, self.day00)
+        self.standbys[1].post(1, Decimal('-1.000'), 'withdrawal', self.day00, 'withdrawal', True)
+
+        self.replicas = ReplicaSet(self.standbys, max_lag=1.0, check_interval=0.0, retry_after=60.0)
+        self.writer = self.manager()
+        self.writer.withdraw(Decimal('500.000'), 'withdrawal', self.day00 + timedelta(days=1))
+
+    def manager(self, **kwargs):
+        return CreditManager(1, self.apr, self.limit, self.period, backend=self.primary,
+                             replicas=self.replicas, **kwargs)
+
+    def test_reads_go_to_the_replicas_in_turn(self):
+        cm = self.manager()
+        self.assertEqual([cm.get_current_due() for _ in range(4)], [Decimal('0.00'), Decimal('1.00')] * 2)
+        self.assertEqual(len(cm.get_statement()), 1)
+        self.assertEqual(self.replicas.stats()['reads'], 5)
+
+        # the outstanding is computed on the primary.
+        self.assertEqual(cm.compute_outstanding(self.day00 + timedelta(days=30)), Decimal('500.00'))
+        self.assertEqual(self.replicas.stats()['reads'], 5)
+
+    def test_read_your_writes(self):
+        cm = self.manager(read_your_writes=0.2)
+        other = self.manager(read_your_writes=0.2)
+        cm.pay(Decimal('100.000'), 'payment', self.day00 + timedelta(days=2))
+        self.assertEqual(cm.get_current_due(), Decimal('400.00'))
+        self.assertEqual(len(cm.get_statement()), 3)
+        # not the writes of another manager (the primary has 3 rows).
+        self.assertTrue(len(other.get_statement()) < 3)
+
+        time.sleep(0.25)
+        self.assertTrue(len(cm.get_statement()) < 3)
+        self.assertRaises(InvalidParameterValue, self.manager, read_your_writes=-1)
+
+    def test_lagging_replicas(self):
+        cm = self.manager()
+        self.standbys[0].lag = 5.0
+        self.assertEqual([cm.get_current_due() for _ in range(2)], [Decimal('1.00')] * 2)
+        self.standbys[1].lag = 1.5
+        self.assertEqual(cm.get_current_due(), Decimal('500.00'))
+
+        stats = self.replicas.stats()
+        self.assertEqual((stats['reads'], stats['fallbacks']), (2, 1))
+        self.assertEqual([replica['lag'] for replica in stats['replicas']], [5.0, 1.5])
+
+        self.standbys[0].lag = 0.5
+        self.assertEqual(cm.get_current_due(), Decimal('0.00'))
+
+    def test_unavailable_replicas(self):
+        cm = self.manager()
+        self.standbys[0].down = True
+        self.assertEqual([cm.get_current_due() for _ in range(3)], [Decimal('1.00')] * 3)
+        stats = self.replicas.stats()
+        self.assertEqual(stats['failures'], 1)  # then left out
+        self.assertTrue(stats['replicas'][0]['down'])
+
+        # failing in the middle of a read.
+        self.standbys[1].failing = True
+        self.assertEqual(cm.get_current_due(), Decimal('500.00'))
+        self.assertEqual(self.replicas.stats()['failures'], 2)
+        self.assertEqual(cm.get_current_due(), Decimal('500.00'))
+        self.assertEqual(self.replicas.stats()['fallbacks'], 1)
+
+        # back after `retry_after`.
+        self.standbys[0].down = self.standbys[1].failing = False
+        self.replicas.retry_after = 0.0
+        self.replicas._down.clear()
+        self.assertEqual(sorted(cm.get_current_due() for _ in range(2)), [Decimal('0.00'), Decimal('1.00')])
+
+    def test_account_not_replicated_yet(self):
+        cm = CreditManager(2, self.apr, self.limit, self.period, backend=self.primary, replicas=self.replicas)
+        cm.open_account(self.day00)
+        self.assertEqual(cm.get_current_due(), Decimal('0.00'))
+        self.assertEqual(self.replicas.stats()['failures'], 0)
+
+    def test_invalid_replica_sets(self):
+        self.assertRaises(InvalidParameterValue, ReplicaSet, [])
+        self.assertRaises(InvalidParameterValue, ReplicaSet, self.standbys, max_lag=-1)
+        self.assertRaises(InvalidParameterValue, ReplicaSet, self.standbys, check_interval=-1)
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 is not installed")
+class PostgresReplicaTest(unittest.TestCase):
+    """`PostgresReplicaTest` reads through Postgres replicas
+    (see `REPLICA_CONN_STRINGS`).
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.pool = ConnectionPool(DB_CONN_STRING, minconn=1, maxconn=2)
+        self.replicas = ReplicaSet.from_dsns(REPLICA_CONN_STRINGS, maxconn=2)
+        self.cm = CreditManager(1, Decimal('0.350'), Decimal('1000.000'), 30,
+                                backend=PostgresBackend(self.pool), replicas=self.replicas)
+        self.cm.open_account(datetime(2015, 1, 1))
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the database by deleting all the data.
+        with self.pool.connection() as conn:
+            conn.cursor().execute("TRUNCATE transaction, daily_balance, account;")
+        self.pool.closeall()
+        self.replicas.closeall()
+
+    def test_reads_from_the_replicas(self):
+        self.cm.withdraw(Decimal('250.000'), 'withdrawal', datetime(2015, 1, 2))
+        self.assertEqual(self.cm.get_current_due(), Decimal('250.00'))
+        self.assertEqual(len(self.cm.get_statement(datetime(2015, 1, 1), datetime(2015, 2, 1))), 2)
+        stats = self.replicas.stats()
+        self.assertEqual((stats['reads'], stats['fallbacks']), (2, 0))
+        self.assertEqual([replica['lag'] for replica in stats['replicas']], [0.0] * len(REPLICA_CONN_STRINGS))
+
+    def test_replica_down(self):
+        replicas = ReplicaSet.from_dsns(["host='localhost' port=1 dbname='a' connect_timeout=1"])
+        cm = CreditManager(1, Decimal('0.350'), Decimal('1000.000'), 30,
+                           backend=PostgresBackend(self.pool), replicas=replicas)
+        self.assertEqual(cm.get_current_due(), Decimal('0.00'))
+        self.assertEqual(replicas.stats()['fallbacks'], 1)
+        replicas.closeall()
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -11,3 +11,14 @@ DATABASE_PASS = 'password'
 DB_CONN_STRING = "host='%s' dbname='%s' user='%s' password='%s'" % (
     DATABASE_HOST, DATABASE_NAME, DATABASE_USER, DATABASE_PASS
 )
+
+# The shard databases of the sharding test cases (wiped as well), by name.
+SHARD_DATABASE_NAMES = ['a', 'b']
+SHARD_CONN_STRINGS = dict(
+    (name, "host='%s' dbname='%s' user='%s' password='%s'" % (DATABASE_HOST, name, DATABASE_USER, DATABASE_PASS))
+    for name in SHARD_DATABASE_NAMES
+)
+
+# The read replicas of the replica test cases; the test database stands in
+# for a replica (it is no standby, hence never lags).
+REPLICA_CONN_STRINGS = [DB_CONN_STRING]
@@ -0,0 +1,228 @@
+import io
+import unittest
+import threading
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+from .settings import SHARD_CONN_STRINGS
+
+from cmanager import CreditManager
+from cmanager.buffer import WriteBuffer
+from cmanager.backends import MemoryBackend, ShardRouter, ShardedBackend
+from cmanager.exceptions import InvalidParameterValue, AccountNotFound
+
+try:
+    import psycopg2
+    from cmanager.batch import ShardedEndOfTermRunner
+    from .partition_tests import drop_partitions
+except ImportError:
+    psycopg2 = None
+
+class ShardRouterTest(unittest.TestCase):
+    """`ShardRouterTest` defines the test cases for the mapping
+    of the accounts to the shards.
+    """
+    accounts = range(1, 5001)
+
+    def router(self, names, **kwargs):
+        return ShardRouter(dict((name, MemoryBackend()) for name in names), **kwargs)
+
+    def test_accounts_spread_over_the_shards(self):
+        router = self.router(['a', 'b', 'c', 'd'])
+        counts = {}
+        for account_id in self.accounts:
+            shard = router.shard_for(account_id)
+            counts[shard] = counts.get(shard, 0) + 1
+        self.assertEqual(sorted(counts), ['a', 'b', 'c', 'd'])
+        for count in counts.values():
+            self.assertTrue(0.15 < float(count) / len(self.accounts) < 0.35)
+
+        # the same in every router over the same shards.
+        other = self.router(['d', 'c', 'b', 'a'])
+        self.assertTrue(all(router.shard_for(n) == other.shard_for(n) for n in self.accounts))
+
+    def test_an_added_shard_only_takes_accounts(self):
+        before = self.router(['a', 'b', 'c', 'd'])
+        after = self.router(['a', 'b', 'c', 'd', 'e'])
+        moved = [n for n in self.accounts if before.shard_for(n) != after.shard_for(n)]
+        self.assertTrue(all(after.shard_for(n) == 'e' for n in moved))
+        self.assertTrue(0.1 < float(len(moved)) / len(self.accounts) < 0.3)
+
+    def test_moved_accounts_are_kept(self):
+        router = self.router(['a', 'b'])
+        home = router.home(7)
+        target = 'b' if home == 'a' else 'a'
+        rebuilt = self.router(['a', 'b'], moved={7: target})
+        self.assertEqual(rebuilt.shard_for(7), target)
+        self.assertEqual(rebuilt.moved(), {7: target})
+        self.assertEqual(rebuilt.shard_for(8), router.shard_for(8))
+
+    def test_invalid_routers(self):
+        self.assertRaises(InvalidParameterValue, ShardRouter, {})
+        self.assertRaises(InvalidParameterValue, self.router, ['a'], vnodes=0)
+        self.assertRaises(InvalidParameterValue, self.router, ['a'], moved={1: 'b'})
+        self.assertRaises(InvalidParameterValue, self.router(['a']).move_account, 1, 'b')
+
+class ShardedBackendTest(object):
+    """`ShardedBackendTest` defines the test cases for the credit
+    managers over sharded backends.
+    """
+    def setUp(self):
+        """`setUp` prepares the data before each test case.
+        """
+        self.apr = Decimal('0.350')  # 35%
+        self.limit = Decimal('1000.000')  # credit limit in USD
+        self.period = 30  # payment period in days
+        self.day00 = datetime(2015, 1, 1)
+        self.router = ShardRouter(self.make_shards())
+        self.backend = ShardedBackend(self.router)
+
+        self.managers = []
+        for account_id in range(1, 11):
+            cm = CreditManager(account_id, self.apr, self.limit, self.period, backend=self.backend)
+            cm.open_account(self.day00)
+            cm.withdraw(Decimal('10.000') * account_id, 'Payment at Merchant %d' % account_id, self.day00 + timedelta(days=1))
+            cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(days=2))
+            self.managers.append(cm)
+
+    def other_shard(self, account_id):
+        return [name for name in sorted(self.router.shards) if name != self.router.shard_for(account_id)][0]
+
+    def rows(self, statement):
+        # the rows of a statement, but their ids.
+        return [(row['tstamp'], row['amount'], row['type'], row['description']) for row in statement]
+
+    def test_accounts_live_on_their_shard(self):
+        for cm in self.managers:
+            shards = [name for name, backend in self.router.shards.items() if backend.get_head(cm.account_id)]
+            self.assertEqual(shards, [self.router.shard_for(cm.account_id)])
+            self.assertEqual(cm.get_current_due(), Decimal('10.000') * cm.account_id - 1)
+        # both shards hold accounts.
+        self.assertEqual(len(set(self.router.shard_for(cm.account_id) for cm in self.managers)), 2)
+
+    def test_move_account(self):
+        cm = self.managers[2]
+        source, target = self.router.shard_for(cm.account_id), self.other_shard(cm.account_id)
+        statement, due = cm.get_statement(), cm.get_current_due()
+
+        self.assertEqual(self.router.move_account(cm.account_id, target), 3)
+        self.assertEqual(self.router.shard_for(cm.account_id), target)
+        self.assertEqual(self.router.shards[source].get_head(cm.account_id), None)
+        self.assertEqual(self.rows(cm.get_statement()), self.rows(statement))
+        self.assertEqual(cm.get_current_due(), due)
+
+        # the account carries on on its new shard, and back.
+        cm.pay(Decimal('5.000'), 'payment', self.day00 + timedelta(days=3))
+        self.assertEqual(cm.compute_outstanding(self.day00 + timedelta(days=30)), cm.get_current_due())
+        self.router.move_account(cm.account_id, source)
+        self.assertEqual(self.router.moved(), {})
+        self.assertEqual(self.router.shards[target].get_head(cm.account_id), None)
+        self.assertEqual(len(cm.get_statement()), 5)
+
+        self.assertRaises(AccountNotFound, self.router.move_account, 99, self.other_shard(99))
+
+    def test_writes_during_a_move(self):
+        cm = self.managers[0]
+        target = self.other_shard(cm.account_id)
+
+        def worker(thread):
+            for n in range(20):
+                cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(days=3, seconds=thread * 20 + n))
+
+        threads = [threading.Thread(target=worker, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        self.router.move_account(cm.account_id, target)
+        for thread in threads:
+            thread.join()
+
+        # every payment made it, on the target shard.
+        self.assertEqual(self.router.shard_for(cm.account_id), target)
+        self.assertEqual(cm.get_current_due(), Decimal('10.000') - 1 - 80)
+        self.assertEqual(len(cm.get_statement()), 83)
+
+    def test_buffered_writes(self):
+        buffer = WriteBuffer(self.backend, max_batch=20, max_latency=0.05, timeout=5.0)
+        managers = [CreditManager(cm.account_id, self.apr, self.limit, self.period,
+                                  backend=self.backend, buffer=buffer) for cm in self.managers]
+
+        def worker(cm):
+            for n in range(10):
+                cm.pay(Decimal('1.000'), 'payment', self.day00 + timedelta(days=3, seconds=n))
+
+        threads = [threading.Thread(target=worker, args=(cm,)) for cm in managers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        unknown = CreditManager(99, self.apr, self.limit, self.period, backend=self.backend, buffer=buffer)
+        self.assertRaises(AccountNotFound, unknown.pay, Decimal('1.000'), 'payment')
+        buffer.close()
+
+        # one commit per shard for every batch, none posted on its own.
+        for cm in managers:
+            self.assertEqual(cm.get_current_due(), Decimal('10.000') * cm.account_id - 11)
+        stats = buffer.stats()
+        self.assertEqual(stats['writes'], 101)
+        self.assertTrue(stats['batches'] < 101)
+        self.assertEqual(stats['retried_batches'], 0)
+
+    def test_export_fans_out(self):
+        start, end = self.day00, self.day00 + timedelta(days=40)
+        merged = io.BytesIO()
+        self.backend.export(merged, None, start, end, 'csv')
+        lines = merged.getvalue().splitlines()
+
+        expected = set()
+        for backend in self.router.shards.values():
+            exported = io.BytesIO()
+            backend.export(exported, None, start, end, 'csv')
+            header = exported.getvalue().splitlines()[0]
+            expected.update(exported.getvalue().splitlines()[1:])
+        self.assertEqual(lines[0], header)
+        self.assertEqual(len(lines), 1 + 30)
+        self.assertEqual(set(lines[1:]), expected)
+
+        some = io.BytesIO()
+        self.backend.export(some, [1, 2], start, end, 'jsonl')
+        self.assertEqual(len(some.getvalue().splitlines()), 6)
+
+class MemoryShardedBackendTest(ShardedBackendTest, unittest.TestCase):
+    """`MemoryShardedBackendTest` runs the test cases against
+    in-memory shards.
+    """
+    def make_shards(self):
+        return dict((name, MemoryBackend()) for name in ('a', 'b'))
+
+@unittest.skipIf(psycopg2 is None, "psycopg2 is not installed")
+class PostgresShardedBackendTest(ShardedBackendTest, unittest.TestCase):
+    """`PostgresShardedBackendTest` runs the test cases against
+    Postgres shards (see `SHARD_CONN_STRINGS`).
+    """
+    def make_shards(self):
+        return ShardRouter.from_dsns(SHARD_CONN_STRINGS, maxconn=5).shards
+
+    def tearDown(self):
+        """`tearDown` restores the state of the system after each test case.
+        """
+        # reset the databases by deleting all the data and the partitions
+        # created by the end of term runs.
+        for backend in self.router.shards.values():
+            with backend.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("TRUNCATE transaction, daily_balance, account;")
+                drop_partitions(cursor)
+        self.router.closeall()
+
+    def test_sharded_end_of_term_run(self):
+        report = ShardedEndOfTermRunner(self.router, workers=2).run(self.day00 + timedelta(days=30))
+        self.assertEqual((report['due'], report['closed'], report['failed']), (10, 10, 0))
+        self.assertEqual(sorted(report['shards']), sorted(SHARD_CONN_STRINGS))
+        for cm in self.managers:
+            self.assertEqual(len(cm.get_statement()), 4)  # along with the eot
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()